@@ -1,8 +1,18 @@
 import jnius_config
 from capreolus.utils.common import Anserini
+from capreolus.utils.jvm import format_size, heap_size
 
 jnius_config.set_classpath(Anserini.get_fat_jar())
+# the in-process JVM runs searches too, so its heap is sized like a searcher's unless CAPREOLUS_JVM_HEAP_JNIUS is set
+jnius_config.add_options("-Xmx" + format_size(heap_size("jnius")))
 
-from capreolus.pipeline import Notebook
-from capreolus.task.rank import RankTask
-from capreolus.task.rerank import RerankTask
+_lazy_imports = {"Notebook": "capreolus.pipeline", "RankTask": "capreolus.task.rank", "RerankTask": "capreolus.task.rerank"}
+
+
+# import the pipeline and tasks on first use, so that importing a capreolus submodule stays cheap
+def __getattr__(name):
+    if name in _lazy_imports:
+        import importlib
+
+        return getattr(importlib.import_module(_lazy_imports[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
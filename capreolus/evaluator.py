@@ -1,10 +1,14 @@
+import hashlib
+import json
+import multiprocessing
 import os
 
-import pytrec_eval
 import numpy as np
 
+from capreolus.registry import MAX_THREADS
 from capreolus.utils.loginit import get_logger
 from capreolus.searcher import Searcher
+from capreolus.utils.trec import BinaryRun
 
 logger = get_logger(__name__)
 
@@ -28,29 +32,125 @@ def _verify_metric(metrics):
             raise ValueError(f"Unexpected evaluation metric: {metric}, should be one of { ' '.join(sorted(expected_metrics))}")
 
 
-def _transform_metric(metrics):
+def _run_arrays(runs):
+    """ Flatten a {qid: {docid: score}} dict or a BinaryRun to (qids, per-entry qid index, docids, scores) """
+    if isinstance(runs, BinaryRun):
+        qids = runs.qids.tolist()
+        qidx = np.repeat(np.arange(len(qids)), np.diff(runs.qid_offsets))
+        return qids, qidx, runs.docids[runs.docidx], np.asarray(runs.scores, dtype=np.float64)
+
+    qids = list(runs)
+    qidx = np.repeat(np.arange(len(qids)), [len(runs[qid]) for qid in qids])
+    docids = np.array([docid for qid in qids for docid in runs[qid]], dtype=str)
+    scores = np.fromiter((score for qid in qids for score in runs[qid].values()), dtype=np.float64, count=len(qidx))
+    return qids, qidx, docids, scores
+
+
+def _per_query_bincount(qidx, nqueries, weights):
+    return np.bincount(qidx, weights=weights, minlength=nqueries)
+
+
+def evaluate_per_query(runs, qrels, metrics):
     """
-    Remove the _NUM at the end of metric is applicable
+    Evaluate runs with vectorized numpy implementations of the trec_eval measures in VALID_METRICS. Like trec_eval,
+    documents are ranked by decreasing score with ties broken by decreasing docid, documents with a label >= 1 are
+    relevant, and only queries appearing both in the run and in the qrels are evaluated.
 
     Args:
-        metrics: a list of str
+        runs: a dict with format {qid: {docid: score}} or a BinaryRun
+        qrels: dict, containing the judgements provided by benchmark
+        metrics: list, metrics expected to calculate, e.g. ndcg_cut_20, etc
 
     Returns:
-        a set of transformed metric
+        a list of the evaluated qids and a dict {metric: np.array of per-query scores in the same order as the qids}
     """
-    assert isinstance(metrics, list)
-    metrics = {"_".join(metric.split("_")[:-1]) if "_cut" in metric or "P_" in metric else metric for metric in metrics}
-    return metrics
+    run_qids, run_qidx, docids, scores = _run_arrays(runs)
+
+    # keep only the queries with judgements and renumber them
+    keep_query = np.array([qid in qrels for qid in run_qids], dtype=bool)
+    qids = [qid for qid, keep in zip(run_qids, keep_query) if keep]
+    new_qidx = np.cumsum(keep_query) - 1
+    keep_entry = keep_query[run_qidx] if len(run_qidx) else np.zeros(0, dtype=bool)
+    qidx, docids, scores = new_qidx[run_qidx[keep_entry]], docids[keep_entry], scores[keep_entry]
+    nqueries = len(qids)
+
+    qrels_qidx = np.repeat(np.arange(nqueries), [len(qrels[qid]) for qid in qids])
+    qrels_docids = np.array([docid for qid in qids for docid in qrels[qid]], dtype=str)
+    qrels_labels = np.fromiter(
+        (label for qid in qids for label in qrels[qid].values()), dtype=np.float64, count=len(qrels_qidx)
+    )
+
+    # map docids to their rank in sorted order, which is used both for breaking ties and for joining runs and qrels
+    _, docranks = np.unique(np.concatenate([docids, qrels_docids]), return_inverse=True)
+    docranks = docranks.reshape(-1)
+    ndocs = docranks.max() + 1 if len(docranks) else 0
+    run_keys = qidx * ndocs + docranks[: len(docids)]
+    qrels_keys = qrels_qidx * ndocs + docranks[len(docids) :]
+
+    order = np.lexsort((-docranks[: len(docids)], -scores, qidx))
+    qidx, run_keys = qidx[order], run_keys[order]
+
+    qrels_order = np.argsort(qrels_keys)
+    qrels_keys, qrels_qidx, qrels_labels = qrels_keys[qrels_order], qrels_qidx[qrels_order], qrels_labels[qrels_order]
+    pos = np.searchsorted(qrels_keys, run_keys)
+    pos[pos == len(qrels_keys)] = 0
+    labels = np.where(qrels_keys[pos] == run_keys, qrels_labels[pos], 0) if len(qrels_keys) else np.zeros(len(run_keys))
+
+    query_starts = np.concatenate([[0], np.cumsum(np.bincount(qidx, minlength=nqueries))[:-1]]).astype(np.int64)
+    ranks = np.arange(len(qidx)) - query_starts[qidx]
+    relevant = labels >= 1
+    cum_relevant = np.cumsum(relevant)
+    cum_relevant = cum_relevant - (cum_relevant - relevant)[query_starts[qidx]]
+    precision_at_rank = np.where(relevant, cum_relevant / (ranks + 1), 0)
+
+    num_rel = _per_query_bincount(qrels_qidx, nqueries, qrels_labels >= 1)
+    safe_num_rel = np.maximum(num_rel, 1)
+
+    def ideal_dcg(cutoff):
+        # sort each query's positive labels in decreasing order to rank them ideally
+        ideal_order = np.lexsort((-qrels_labels, qrels_qidx))
+        ideal_qidx, ideal_labels = qrels_qidx[ideal_order], qrels_labels[ideal_order]
+        ideal_starts = np.concatenate([[0], np.cumsum(np.bincount(ideal_qidx, minlength=nqueries))[:-1]]).astype(np.int64)
+        ideal_ranks = np.arange(len(ideal_qidx)) - ideal_starts[ideal_qidx]
+        gains = np.where((ideal_labels > 0) & (ideal_ranks < cutoff), ideal_labels, 0) / np.log2(ideal_ranks + 2)
+        return _per_query_bincount(ideal_qidx, nqueries, gains)
+
+    results = {}
+    for metric in metrics:
+        name, cutoff = metric, None
+        if "_cut" in metric or metric.startswith("P_"):
+            name, cutoff = "_".join(metric.split("_")[:-1]), int(metric.split("_")[-1])
+
+        if name == "P":
+            results[metric] = _per_query_bincount(qidx, nqueries, relevant & (ranks < cutoff)) / cutoff
+        elif name == "map":
+            results[metric] = _per_query_bincount(qidx, nqueries, precision_at_rank) / safe_num_rel
+        elif name == "map_cut":
+            results[metric] = _per_query_bincount(qidx, nqueries, precision_at_rank * (ranks < cutoff)) / safe_num_rel
+        elif name == "Rprec":
+            results[metric] = _per_query_bincount(qidx, nqueries, relevant & (ranks < num_rel[qidx])) / safe_num_rel
+        elif name == "recip_rank":
+            recip_rank = np.zeros(nqueries)
+            np.maximum.at(recip_rank, qidx[relevant], 1 / (ranks[relevant] + 1))
+            results[metric] = recip_rank
+        elif name == "set_recall":
+            results[metric] = _per_query_bincount(qidx, nqueries, relevant) / safe_num_rel
+        elif name == "ndcg_cut":
+            gains = np.where((labels > 0) & (ranks < cutoff), labels, 0) / np.log2(ranks + 2)
+            idcg = ideal_dcg(cutoff)
+            results[metric] = _per_query_bincount(qidx, nqueries, gains) / np.where(idcg > 0, idcg, 1)
+        else:
+            raise ValueError(f"Unexpected evaluation metric: {metric}")
+
+    return qids, results
 
 
 def _eval_runs(runs, qrels, metrics, dev_qids):
     assert isinstance(metrics, list)
     dev_qrels = {qid: labels for qid, labels in qrels.items() if qid in dev_qids}
-    evaluator = pytrec_eval.RelevanceEvaluator(dev_qrels, _transform_metric(metrics))
+    qids, per_query = evaluate_per_query(runs, dev_qrels, metrics)
 
-    scores = [[metrics_dict.get(m, -1) for m in metrics] for metrics_dict in evaluator.evaluate(runs).values()]
-    scores = np.array(scores).mean(axis=0).tolist()
-    scores = dict(zip(metrics, scores))
+    scores = {metric: float(per_query[metric].mean()) if qids else 0.0 for metric in metrics}
     return scores
 
 
@@ -59,7 +159,8 @@ def eval_runs(runs, qrels, metrics):
     Evaluate runs loaded by Searcher.load_trec_run
 
     Args:
-        runs: a dict with format {qid: {docid: score}}, could be prepared by Searcher.load_trec_run
+        runs: a dict with format {qid: {docid: score}}, could be prepared by Searcher.load_trec_run.
+              A BinaryRun or the path to a run file (e.g., as returned when streaming predictions) is also accepted.
         qrels: dict, containing the judgements provided by benchmark
         metrics: str or list, metrics expected to calculate, e.g. ndcg_cut_20, etc
 
@@ -68,7 +169,9 @@ def eval_runs(runs, qrels, metrics):
     """
     metrics = [metrics] if isinstance(metrics, str) else list(metrics)
     _verify_metric(metrics)
-    return _eval_runs(runs, qrels, metrics, dev_qids=list(qrels.keys()))
+    if not isinstance(runs, (dict, BinaryRun)):
+        runs = Searcher.load_binary_run(runs)
+    return _eval_runs(runs, qrels, metrics, dev_qids=qrels)
 
 
 def eval_runfile(runfile, qrels, metrics):
@@ -85,13 +188,28 @@ def eval_runfile(runfile, qrels, metrics):
     """
     metrics = [metrics] if isinstance(metrics, str) else list(metrics)
     _verify_metric(metrics)
-    runs = Searcher.load_trec_run(runfile)
-    return _eval_runs(runs, qrels, metrics, dev_qids=list(qrels.keys()))
+    runs = Searcher.load_binary_run(runfile)
+    return _eval_runs(runs, qrels, metrics, dev_qids=qrels)
+
+
+def _best_run_cache_key(runfiles, qrels, primary_metric, metrics, folds):
+    """ Hash everything the result of search_best_run depends on: the run files' names, sizes and mtimes, the
+        metrics, the fold definitions and the qrels """
+    run_stats = []
+    for runfile in sorted(runfiles):
+        stat = os.stat(runfile)
+        run_stats.append([os.path.basename(runfile), stat.st_size, stat.st_mtime_ns])
+
+    key = {"runs": run_stats, "primary_metric": primary_metric, "metrics": metrics, "folds": folds}
+    h = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8"))
+    h.update(json.dumps(qrels, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
 
 
 def search_best_run(runfile_dir, benchmark, primary_metric, metrics=None, folds=None):
     """
-    Select the runfile with respect to the specified metric
+    Select the runfile with respect to the specified metric. The result is cached in runfile_dir and reused as long as
+    the runfiles, metrics, folds and qrels are unchanged.
 
     Args:
         runfile_dir: the directory path to all the runfiles to select from
@@ -115,23 +233,82 @@ def search_best_run(runfile_dir, benchmark, primary_metric, metrics=None, folds=
         if (f != "done" and not os.path.isdir(os.path.join(runfile_dir, f)))
     ]
 
+    cache_key = _best_run_cache_key(runfiles, benchmark.qrels, primary_metric, metrics, folds)
+    cache_fn = os.path.join(runfile_dir, ".best_run_cache", cache_key + ".json")
+    if os.path.exists(cache_fn):
+        with open(cache_fn, "rt") as f:
+            cached = json.load(f)
+        return {"score": cached["score"], "path": {s: os.path.join(runfile_dir, fn) for s, fn in cached["path"].items()}}
+
+    best_run = _search_best_run(runfiles, benchmark, primary_metric, metrics, folds)
+
+    # the cache only stores run file names, so that it remains valid if runfile_dir is moved
+    cached = {"score": best_run["score"], "path": {s: os.path.basename(path) for s, path in best_run["path"].items()}}
+    try:
+        os.makedirs(os.path.dirname(cache_fn), exist_ok=True)
+        tmp_fn = f"{cache_fn}.tmp-{os.getpid()}"
+        with open(tmp_fn, "wt") as outf:
+            json.dump(cached, outf)
+        os.replace(tmp_fn, cache_fn)
+    except OSError as e:
+        logger.warning("failed to cache the best run in %s: %s", runfile_dir, e)
+
+    return best_run
+
+
+_worker_qrels = None
+_worker_metric = None
+
+
+def _init_eval_worker(qrels, metric):
+    global _worker_qrels, _worker_metric
+    _worker_qrels = qrels
+    _worker_metric = metric
+
+
+def _eval_fold_scores(runfile, fold_qids):
+    """ Evaluate runfile once over all qids and average the per-query scores within each fold's dev qids """
+    qids, per_query = evaluate_per_query(Searcher.load_binary_run(runfile), _worker_qrels, [_worker_metric])
+
+    fold_scores = {}
+    for s, dev_qids in fold_qids.items():
+        mask = np.array([qid in dev_qids for qid in qids], dtype=bool)
+        fold_scores[s] = float(per_query[_worker_metric][mask].mean()) if mask.any() else 0
+    return runfile, fold_scores
+
+
+def _eval_runfiles_by_fold(runfiles, qrels, metric, fold_qids):
+    """ Return {runfile: {fold: score}}, evaluating the runfiles in parallel when there are several of them """
+    if len(runfiles) < 2 or MAX_THREADS < 2:
+        _init_eval_worker(qrels, metric)
+        return dict(_eval_fold_scores(runfile, fold_qids) for runfile in runfiles)
+
+    # workers are spawned rather than forked, since this process may already be running the pyjnius JVM and torch threads
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(min(MAX_THREADS, len(runfiles)), initializer=_init_eval_worker, initargs=(qrels, metric)) as pool:
+        return dict(pool.starmap(_eval_fold_scores, [(runfile, fold_qids) for runfile in runfiles]))
+
+
+def _search_best_run(runfiles, benchmark, primary_metric, metrics, folds):
     if len(runfiles) == 1:
         return {"score": eval_runfile(runfiles[0], benchmark.qrels, metrics), "path": {s: runfiles[0] for s in folds}}
 
+    fold_qids = {s: set(v["train_qids"]) | set(v["predict"]["dev"]) for s, v in folds.items()}
+    run_scores = _eval_runfiles_by_fold(sorted(runfiles), benchmark.qrels, primary_metric, fold_qids)
+
     best_scores = {s: {primary_metric: 0, "path": None} for s in folds}
-    for runfile in runfiles:
-        runs = Searcher.load_trec_run(runfile)
-        for s, v in folds.items():
-            score = _eval_runs(
-                runs, benchmark.qrels, [primary_metric], dev_qids=(set(v["train_qids"]) | set(v["predict"]["dev"]))
-            )[primary_metric]
+    for runfile, fold_scores in run_scores.items():
+        for s, score in fold_scores.items():
             if score > best_scores[s][primary_metric]:
                 best_scores[s] = {primary_metric: score, "path": runfile}
 
     test_runs, test_qrels = {}, {}
+    loaded_runs = {}
     for s, score_dict in best_scores.items():
         test_qids = folds[s]["predict"]["test"]
-        test_runs.update({qid: v for qid, v in Searcher.load_trec_run(score_dict["path"]).items() if qid in test_qids})
+        if score_dict["path"] not in loaded_runs:
+            loaded_runs[score_dict["path"]] = Searcher.load_trec_run(score_dict["path"])
+        test_runs.update({qid: v for qid, v in loaded_runs[score_dict["path"]].items() if qid in test_qids})
         test_qrels.update({qid: v for qid, v in benchmark.qrels.items() if qid in test_qids})
 
     scores = eval_runs(test_runs, benchmark.qrels, metrics)
@@ -1,15 +1,42 @@
+import hashlib
+import json
+import multiprocessing
+import os
 from collections import defaultdict
 
 import numpy as np
-from pymagnitude import Magnitude, MagnitudeUtils
 
-from capreolus.registry import ModuleBase, RegisterableModule, Dependency, CACHE_BASE_PATH
+from capreolus.index import fetch_docs, open_reader
+from capreolus.registry import ModuleBase, RegisterableModule, Dependency, CACHE_BASE_PATH, MAX_THREADS
 from capreolus.utils.loginit import get_logger
 from capreolus.utils.common import padlist
 from capreolus.utils.exceptions import MissingDocError
+from capreolus.utils.featurecache import PairFeatureCache
+from capreolus.utils.tokenstore import TokenCache
 
 logger = get_logger(__name__)
 
+# below this many documents, starting worker JVMs costs more than tokenizing in the current process
+PARALLEL_TOKENIZE_MIN_DOCS = 5000
+PARALLEL_TOKENIZE_CHUNK_SIZE = 1000
+# number of terms to look up in a Magnitude model per query
+EMBEDDING_LOOKUP_BATCH_SIZE = 10000
+
+# per-process state used by _tokenize_chunk in tokenization worker processes
+_worker_reader = None
+_worker_tokenizer = None
+
+
+def _init_tokenize_worker(index_path, tokenizer_cls, tokenizer_cfg):
+    global _worker_reader, _worker_tokenizer
+    _worker_reader = open_reader(index_path)
+    _worker_tokenizer = tokenizer_cls(tokenizer_cfg)
+
+
+def _tokenize_chunk(docids):
+    docs = fetch_docs(_worker_reader, docids)
+    return [(docid, None if doc is None else _worker_tokenizer.tokenize(doc)) for docid, doc in zip(docids, docs)]
+
 
 class Extractor(ModuleBase, metaclass=RegisterableModule):
     """the module base class"""
@@ -65,53 +92,206 @@ class EmbedText(Extractor):
         maxdoclen = 800
 
     def _get_pretrained_emb(self):
+        from pymagnitude import Magnitude, MagnitudeUtils
+
         magnitude_cache = CACHE_BASE_PATH / "magnitude/"
         return Magnitude(MagnitudeUtils.download_model(self.embed_paths[self.cfg["embeddings"]], download_dir=magnitude_cache))
 
+    def _get_token_cache_path(self):
+        """ The token cache depends only on the index and tokenizer, so it is shared by extractors using the same pair """
+        return self["index"].get_cache_path() / self["tokenizer"].get_module_path() / "doctoks"
+
+    def _tokenize_docs(self, docids):
+        if MAX_THREADS > 1 and len(docids) >= PARALLEL_TOKENIZE_MIN_DOCS:
+            return self._tokenize_docs_parallel(docids)
+
+        tokenize = self["tokenizer"].tokenize
+        docid2toks = {}
+        for i in range(0, len(docids), PARALLEL_TOKENIZE_CHUNK_SIZE):
+            chunk = docids[i : i + PARALLEL_TOKENIZE_CHUNK_SIZE]
+            for docid, doc in zip(chunk, self["index"].get_docs(chunk)):
+                if doc is None:
+                    logger.warning(f"cannot find doc {docid} from index")
+                    continue
+                docid2toks[docid] = tokenize(doc)
+        return docid2toks
+
+    def _tokenize_docs_parallel(self, docids):
+        """ Fetch and tokenize docids in chunks across MAX_THREADS processes, each with its own JVM.
+            Results are returned in the same order as `docids`. """
+
+        # the JVM cannot be used after a fork, so workers are spawned and create their own index and tokenizer objects
+        initargs = (
+            self["index"].get_index_path().as_posix(),
+            self["tokenizer"].__class__,
+            dict(self["tokenizer"].cfg),
+        )
+        chunks = [docids[i : i + PARALLEL_TOKENIZE_CHUNK_SIZE] for i in range(0, len(docids), PARALLEL_TOKENIZE_CHUNK_SIZE)]
+        nprocs = min(MAX_THREADS, len(chunks))
+        logger.info(f"tokenizing {len(docids)} documents with {nprocs} processes")
+
+        docid2toks = {}
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(nprocs, initializer=_init_tokenize_worker, initargs=initargs) as pool:
+            for chunk_results in pool.imap(_tokenize_chunk, chunks):
+                for docid, toks in chunk_results:
+                    if toks is None:
+                        logger.warning(f"cannot find doc {docid} from index")
+                        continue
+                    docid2toks[docid] = toks
+
+        return docid2toks
+
     def _build_vocab(self, qids, docids, topics):
         tokenize = self["tokenizer"].tokenize
         self.qid2toks = {qid: tokenize(topics[qid]) for qid in qids}
-        # self.docid2toks = {docid: tokenize(self["index"].get_doc(docid)) for docid in docids}
+
+        # tokenized documents are cached on disk, so we only need to tokenize docs that were never seen before
+        token_cache = TokenCache(self._get_token_cache_path())
+        uncached_docids = [docid for docid in docids if docid not in token_cache]
+        if uncached_docids:
+            logger.info(f"tokenizing {len(uncached_docids)} documents missing from the token cache")
+            # empty documents are cached too, so that we do not attempt to tokenize them again in the future
+            token_cache.add(self._tokenize_docs(uncached_docids))
+
+        # documents are kept as token ids in the cache's memory-mapped store rather than as lists of strings.
+        # cache2stoi maps the cache's token ids to this extractor's token ids, and is applied when a doc is accessed.
+        self.doc_store = token_cache.store
         # seems like for antique the doc '2814599_5' doesn't appear in the collection
-        self.docid2toks = {}
+        self.docids = set()
         for docid in docids:
-            try:
-                doc = tokenize(self["index"].get_doc(docid))
-                if not doc or len(doc) == 0:
-                    logger.warning(f"bad document {docid} tokenization result, ignore the document")
-                    continue
-                self.docid2toks[docid] = doc
-            except:
-                logger.warning(f"cannot find doc {docid} from index")
+            if docid not in self.doc_store:
+                continue
+
+            if len(self.doc_store.get(docid)) == 0:
+                logger.warning(f"bad document {docid} tokenization result, ignore the document")
+                continue
+            self.docids.add(docid)
+
         self._extend_stoi(self.qid2toks.values(), calc_idf=self.cfg["calcidf"])
-        self._extend_stoi(self.docid2toks.values(), calc_idf=self.cfg["calcidf"])
+
+        doc_tokids = [np.zeros(0, dtype=np.int32)] + [self.doc_store.get(docid) for docid in self.docids]
+        doc_tokids = np.unique(np.concatenate(doc_tokids))
+        doc_toks = [token_cache.vocab[tokid] for tokid in doc_tokids.tolist()]
+        self._extend_stoi([doc_toks], calc_idf=self.cfg["calcidf"])
+
+        self.cache2stoi = np.full(len(token_cache.vocab), self.pad, dtype=np.int64)
+        self.cache2stoi[doc_tokids] = [self.stoi[tok] for tok in doc_toks]
+
         self.itos = {i: s for s, i in self.stoi.items()}
         logger.info(f"vocabulary constructed, with {len(self.itos)} terms in total")
 
+        self._build_query_matrix()
+
+    def _build_query_matrix(self):
+        """ Pre-encode and pad every query, so batches can gather query rows rather than encoding each instance """
+        qlen = self.cfg["maxqlen"]
+        self.qid2row = {qid: row for row, qid in enumerate(self.qid2toks)}
+        self.query_matrix = np.full((len(self.qid2row), qlen), self.pad, dtype=np.int64)
+        self.query_idf_matrix = np.zeros((len(self.qid2row), qlen), dtype=np.float32)
+        for qid, row in self.qid2row.items():
+            toks = self.qid2toks[qid][:qlen]
+            self.query_matrix[row, : len(toks)] = self._tok2vec(toks)
+            self.query_idf_matrix[row, : len(toks)] = self._get_idf(toks)
+
     def _get_idf(self, toks):
         return [self.idf.get(tok, 0) for tok in toks]
 
+    def _get_embedding_cache_path(self):
+        """ Embedding matrices are cached by embedding name and by a hash of the vocabulary (in token id order), so
+            they are shared by every extractor that builds the same stoi. Only the vectors found in the pretrained
+            embeddings are cached, so that the random vectors of missing terms are drawn by each run (with its seed). """
+        vocab = "\n".join(sorted(self.stoi, key=self.stoi.get))
+        key = hashlib.sha256(vocab.encode("utf-8")).hexdigest()
+        return CACHE_BASE_PATH / "embeddings" / self.cfg["embeddings"] / key
+
+    def _load_cached_embedding_matrix(self, cache_path):
+        matrix_fn, found_fn, stoi_fn = cache_path / "embeddings.npy", cache_path / "found.npy", cache_path / "stoi.json"
+        if not (matrix_fn.exists() and found_fn.exists() and stoi_fn.exists()):
+            return None
+
+        with open(stoi_fn, "rt") as f:
+            if json.load(f) != self.stoi:
+                return None
+
+        return np.load(matrix_fn, mmap_mode="r"), np.load(found_fn)
+
+    def _save_embedding_matrix(self, cache_path, embed_matrix, found):
+        os.makedirs(cache_path, exist_ok=True)
+        with open(cache_path / "stoi.json", "wt") as f:
+            json.dump(self.stoi, f)
+        np.save(cache_path / "found.npy", found)
+
+        # the matrix is written last and moved into place, so a matrix is only found once it is complete
+        tmp_fn = cache_path / f"embeddings.tmp-{os.getpid()}.npy"
+        np.save(tmp_fn, embed_matrix)
+        os.replace(tmp_fn, cache_path / "embeddings.npy")
+
+    def _lookup_embeddings(self, magnitude_emb, terms):
+        """ Return a (len(terms), dim) matrix with the vectors of `terms` and a mask of the terms found in the model.
+            Only the requested terms are checked against the model, and vectors are queried in batches. """
+        found = np.array([term in magnitude_emb for term in terms], dtype=bool)
+        found_terms = [term for term, is_found in zip(terms, found) if is_found]
+
+        vectors = np.zeros((len(terms), magnitude_emb.dim), dtype=np.float32)
+        found_vectors = [
+            np.asarray(magnitude_emb.query(found_terms[i : i + EMBEDDING_LOOKUP_BATCH_SIZE]), dtype=np.float32).reshape(
+                -1, magnitude_emb.dim
+            )
+            for i in range(0, len(found_terms), EMBEDDING_LOOKUP_BATCH_SIZE)
+        ]
+        if found_vectors:
+            vectors[found] = np.concatenate(found_vectors)
+        return vectors, found
+
+    def get_pair_features(self, name, qids, docids, queries, docs, compute):
+        """ Return an array with the `name` features of each (qid, docid) pair, such as a reranker's matching
+            histograms, calling `compute(qids, docids)` for pairs whose features were never computed before.
+
+            Features are cached as float16 next to the cached embedding matrix, so they must only depend on the
+            (frozen) embeddings and on the pair's padded query and document token ids, which are given by the rows of
+            `queries` and `docs`. Pairs are cached by a hash of these ids, since the same qid and docid are tokenized
+            differently by other benchmarks, query types, and tokenizer settings.
+        """
+        if not hasattr(self, "_pair_feature_caches"):
+            self._pair_feature_caches = {}
+
+        if name not in self._pair_feature_caches:
+            # the random vectors of missing terms differ between runs, so features are also keyed by the actual matrix
+            embeddings_key = hashlib.sha256(np.ascontiguousarray(self.embeddings).tobytes()).hexdigest()[:16]
+            cache_name = f"{name}_maxqlen-{self.cfg['maxqlen']}_maxdoclen-{self.cfg['maxdoclen']}_embeddings-{embeddings_key}"
+            self._pair_feature_caches[name] = PairFeatureCache(self._get_embedding_cache_path() / "features" / cache_name)
+
+        queries, docs = np.asarray(queries, dtype=np.int64), np.asarray(docs, dtype=np.int64)
+        fingerprints = [
+            hashlib.blake2b(query.tobytes() + doc.tobytes(), digest_size=16).hexdigest() for query, doc in zip(queries, docs)
+        ]
+        return self._pair_feature_caches[name].get(qids, docids, compute, fingerprints=fingerprints)
+
     def _build_embedding_matrix(self):
         assert len(self.stoi) > 1  # needs more vocab than self.pad_tok
 
-        magnitude_emb = self._get_pretrained_emb()
-        emb_dim = magnitude_emb.dim
-        embed_vocab = set(term for term, _ in magnitude_emb)
-        embed_matrix = np.zeros((len(self.stoi), emb_dim), dtype=np.float32)
-
-        n_missed = 0
-        for term, idx in self.stoi.items():
-            if term in embed_vocab:
-                embed_matrix[idx] = magnitude_emb.query(term)
-            elif term == self.pad_tok:
-                embed_matrix[idx] = np.zeros(emb_dim)
-            else:
-                n_missed += 1
-                embed_matrix[idx] = np.zeros(emb_dim) if self.cfg["zerounk"] else np.random.normal(scale=0.5, size=emb_dim)
-
-        logger.info(f"embedding matrix {self.cfg['embeddings']} constructed, with shape {embed_matrix.shape}")
+        cache_path = self._get_embedding_cache_path()
+        cached = self._load_cached_embedding_matrix(cache_path)
+        if cached is not None:
+            embed_matrix, found = cached
+            logger.info(f"embedding matrix {self.cfg['embeddings']} loaded from {cache_path}, with shape {embed_matrix.shape}")
+        else:
+            terms = sorted(self.stoi, key=self.stoi.get)
+            embed_matrix, found = self._lookup_embeddings(self._get_pretrained_emb(), terms)
+            embed_matrix[self.stoi[self.pad_tok]] = 0
+            self._save_embedding_matrix(cache_path, embed_matrix, found)
+            logger.info(f"embedding matrix {self.cfg['embeddings']} constructed, with shape {embed_matrix.shape}")
+
+        missed = ~found
+        missed[self.stoi[self.pad_tok]] = False
+        n_missed = int(missed.sum())
         if n_missed > 0:
             logger.warning(f"{n_missed}/{len(self.stoi)} (%.3f) term missed" % (n_missed / len(self.stoi)))
+            if not self.cfg["zerounk"]:
+                # the cached matrix is read-only and has zeros for missing terms
+                embed_matrix = np.array(embed_matrix)
+                embed_matrix[missed] = np.random.normal(scale=0.5, size=(n_missed, embed_matrix.shape[1]))
 
         self.embeddings = embed_matrix
 
@@ -133,7 +313,8 @@ class EmbedText(Extractor):
         self.itos = {self.pad: self.pad_tok}
         self.stoi = {self.pad_tok: self.pad}
         self.qid2toks = defaultdict(list)
-        self.docid2toks = defaultdict(list)
+        self.docids = set()
+        self.doc_store = None
         self.idf = defaultdict(lambda: 0)
         self.embeddings = None
         # self.cache = self.load_cache()    # TODO
@@ -142,11 +323,57 @@ class EmbedText(Extractor):
         self._build_embedding_matrix()
 
     def has_doc(self, docid):
-        return docid in self.docid2toks
+        return docid in self.docids
 
     def _tok2vec(self, toks):
         return [self.stoi[tok] for tok in toks]
 
+    def _docs2matrix(self, qids, docids):
+        """ Return a (len(docids), maxdoclen) matrix with the padded token ids of each doc in `docids`.
+            Token ids are gathered from the flat token store with a single fancy-indexing operation. """
+        rows = []
+        for qid, docid in zip(qids, docids):
+            if not self.has_doc(docid):
+                raise MissingDocError(qid, docid)
+            rows.append(self.doc_store.docid2row[docid])
+
+        rows = np.array(rows, dtype=np.int64)
+        positions = np.arange(self.cfg["maxdoclen"])
+        starts = self.doc_store.offsets[rows]
+        lengths = self.doc_store.offsets[rows + 1] - starts
+        mask = positions[None, :] < lengths[:, None]
+
+        tokids = self.doc_store.ids[np.where(mask, starts[:, None] + positions[None, :], 0)]
+        return np.where(mask, self.cache2stoi[tokids], self.pad)
+
+    def ids2batch(self, qids, posids, negids=None):
+        """ Build the features for a whole batch of (qid, posid[, negid]) instances.
+
+        Args:
+            qids: list of qids, one per instance
+            posids: list of docids, one per instance
+            negids: list of negative docids, one per instance, or None when predicting
+
+        Returns:
+            a dict with the same keys as id2vec, where each array has a leading batch dimension
+        """
+        qrows = [self.qid2row[qid] for qid in qids]
+        idfs = self.query_idf_matrix[qrows]
+        data = {
+            "qid": list(qids),
+            "posdocid": list(posids),
+            "idfs": idfs,
+            "query": self.query_matrix[qrows],
+            "posdoc": self._docs2matrix(qids, posids),
+            "query_idf": idfs,
+        }
+
+        if negids is not None:
+            data["negdocid"] = list(negids)
+            data["negdoc"] = self._docs2matrix(qids, negids)
+
+        return data
+
     def id2vec(self, qid, posid, negid=None, query=None):
         if query is not None:
             if qid is None:
@@ -159,22 +386,16 @@ class EmbedText(Extractor):
             query = self.qid2toks[qid]
 
         # TODO find a way to calculate qlen/doclen stats earlier, so we can log them and check sanity of our values
-        qlen, doclen = self.cfg["maxqlen"], self.cfg["maxdoclen"]
-        posdoc = self.docid2toks.get(posid, None)
-        if not posdoc:
-            raise MissingDocError(qid, posid)
-
+        qlen = self.cfg["maxqlen"]
         idfs = padlist(self._get_idf(query), qlen, 0)
         query = self._tok2vec(padlist(query, qlen, self.pad_tok))
-        posdoc = self._tok2vec(padlist(posdoc, doclen, self.pad_tok))
 
-        # TODO determine whether pin_memory is happening. may not be because we don't place the strings in a np or torch object
         data = {
             "qid": qid,
             "posdocid": posid,
             "idfs": np.array(idfs, dtype=np.float32),
             "query": np.array(query, dtype=np.long),
-            "posdoc": np.array(posdoc, dtype=np.long),
+            "posdoc": self._docs2matrix([qid], [posid])[0],
             "query_idf": np.array(idfs, dtype=np.float32),
         }
 
@@ -182,12 +403,7 @@ class EmbedText(Extractor):
             logger.debug(f"missing negtive doc id for qid {qid}")
             return data
 
-        negdoc = self.docid2toks.get(negid, None)
-        if not negdoc:
-            raise MissingDocError(qid, negid)
-
-        negdoc = self._tok2vec(padlist(negdoc, doclen, self.pad_tok))
         data["negdocid"] = negid
-        data["negdoc"] = np.array(negdoc, dtype=np.long)
+        data["negdoc"] = self._docs2matrix([qid], [negid])[0]
 
         return data
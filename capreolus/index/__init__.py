@@ -1,19 +1,32 @@
+import hashlib
+import json
 import logging
 import math
 import os
-import subprocess
+import shutil
+import threading
 
-from capreolus.registry import ModuleBase, RegisterableModule, Dependency, MAX_THREADS
-from capreolus.utils.common import Anserini
+import numpy as np
+
+from capreolus.registry import ModuleBase, RegisterableModule, Dependency
+from capreolus.utils.common import Anserini, hash_file
+from capreolus.utils.exceptions import MissingDocError
+from capreolus.utils.jvm import heap_size, jvm_threads, run_java
 from capreolus.utils.loginit import get_logger
+from capreolus.utils.postings import PostingsSnapshot
 
 logger = get_logger(__name__)  # pylint: disable=invalid-name
 
+# names of the fields used by Anserini's LuceneDocumentGenerator
+FIELD_ID = "id"
+FIELD_BODY = "contents"
+
 
 class Index(ModuleBase, metaclass=RegisterableModule):
     """the module base class"""
 
     module_type = "index"
+    cache_instances = True
     dependencies = {"collection": Dependency(module="collection")}
 
     def get_index_path(self):
@@ -46,9 +59,13 @@ def get_cache_path(self):
     print(self.get_cache_path())
 
 
+def update(self):
+    self.update_index()
+
+
 class AnseriniIndex(Index):
     name = "anserini"
-    commands = {"cache_path": get_cache_path}
+    commands = {"cache_path": get_cache_path, "update": update}
 
     @staticmethod
     def config():
@@ -57,47 +74,204 @@ class AnseriniIndex(Index):
 
     def _create_index(self):
         outdir = self.get_index_path()
-        stops = "-keepStopwords" if self.cfg["indexstops"] else ""
+        collection_path, _, _ = self["collection"].get_path_and_types()
+
+        logger.info("building index %s", outdir)
+        os.makedirs(os.path.basename(outdir), exist_ok=True)
+        self._index_collection(collection_path, outdir)
+        self._write_manifest(self._collection_manifest(collection_path))
 
-        collection_path, document_type, generator_type = self["collection"].get_path_and_types()
+    def _index_collection(self, collection_path, outdir):
+        stops = "-keepStopwords" if self.cfg["indexstops"] else ""
+        _, document_type, generator_type = self["collection"].get_path_and_types()
 
         anserini_fat_jar = Anserini.get_fat_jar()
+        threads = jvm_threads("index")
         if self["collection"].is_large_collection:
-            cmd = f"java -classpath {anserini_fat_jar} -Xms512M -Xmx31G -Dapp.name='IndexCollection' io.anserini.index.IndexCollection -collection {document_type} -generator {generator_type} -threads {MAX_THREADS} -input {collection_path} -index {outdir} -stemmer {self.cfg['stemmer']} {stops}"
+            args = f"-classpath {anserini_fat_jar} -Dapp.name='IndexCollection' io.anserini.index.IndexCollection -collection {document_type} -generator {generator_type} -threads {threads} -input {collection_path} -index {outdir} -stemmer {self.cfg['stemmer']} {stops}"
         else:
-            cmd = f"java -classpath {anserini_fat_jar} -Xms512M -Xmx31G -Dapp.name='IndexCollection' io.anserini.index.IndexCollection -collection {document_type} -generator {generator_type} -threads {MAX_THREADS} -input {collection_path} -index {outdir} -storePositions -storeDocvectors -storeTransformedDocs -stemmer {self.cfg['stemmer']} {stops}"
+            args = f"-classpath {anserini_fat_jar} -Dapp.name='IndexCollection' io.anserini.index.IndexCollection -collection {document_type} -generator {generator_type} -threads {threads} -input {collection_path} -index {outdir} -storePositions -storeDocvectors -storeTransformedDocs -stemmer {self.cfg['stemmer']} {stops}"
 
-        logger.info("building index %s", outdir)
-        logger.debug(cmd)
-        os.makedirs(os.path.basename(outdir), exist_ok=True)
+        # Anserini output is verbose, so ignore DEBUG log lines and send other output through our logger
+        run_java(args.split(), heap_size("index"), lambda line: Anserini.filter_and_log_anserini_output(line, logger))
+
+    def _manifest_path(self):
+        return self.get_index_path() / "manifest.json"
+
+    def _version_path(self):
+        return self.get_index_path() / "manifest.sha256"
+
+    def get_index_version(self):
+        """ Return a digest of the collection files the index was built from, which changes whenever update_index
+            changes the index. Results derived from the index can record it to detect that they are stale. """
+        if not self._version_path().exists():
+            return ""
+
+        with open(self._version_path(), "rt") as f:
+            return f.read().strip()
+
+    def _write_manifest(self, manifest):
+        for path, content in [
+            (self._manifest_path(), json.dumps(manifest)),
+            (self._version_path(), manifest_digest(manifest)),
+        ]:
+            tmp_fn = f"{path}.tmp-{os.getpid()}"
+            with open(tmp_fn, "wt") as outf:
+                outf.write(content)
+            os.replace(tmp_fn, path)
+
+    def _collection_manifest(self, collection_path, previous=None):
+        """ Describe each file in the collection by its size, mtime, hash and the docids indexed from it. Files whose
+            size and mtime match `previous` are assumed to be unchanged and are not read again. """
+        _, document_type, _ = self["collection"].get_path_and_types()
+        previous = previous or {}
+        manifest = {}
+        for root, _, fns in os.walk(collection_path, followlinks=True):
+            for fn in fns:
+                path = os.path.join(root, fn)
+                relpath = os.path.relpath(path, collection_path)
+                stat = os.stat(path)
+                entry = {"size": stat.st_size, "mtime": stat.st_mtime}
+                old_entry = previous.get(relpath)
+                if old_entry and old_entry["size"] == entry["size"] and old_entry["mtime"] == entry["mtime"]:
+                    entry = old_entry
+                else:
+                    entry["sha256"] = hash_file(path)
+                    entry["docids"] = read_file_docids(document_type, path)
+                manifest[relpath] = entry
+
+        return manifest
+
+    def update_index(self):
+        """ Bring an existing index up to date with its collection by indexing only the files that were added or
+            changed since the index was built. The changed files are indexed into a separate index, whose documents
+            are added to this index after deleting the documents previously indexed from changed or removed files. """
+        if not self.exists():
+            self.create_index()
+            return
 
-        app = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, universal_newlines=True)
+        collection_path, _, _ = self["collection"].get_path_and_types()
+        if not self._manifest_path().exists():
+            logger.warning("index %s has no manifest, so only changes made from now on can be detected", self.get_index_path())
+            self._write_manifest(self._collection_manifest(collection_path))
+            return
 
-        # Anserini output is verbose, so ignore DEBUG log lines and send other output through our logger
-        for line in app.stdout:
-            Anserini.filter_and_log_anserini_output(line, logger)
+        with open(self._manifest_path(), "rt") as f:
+            previous = json.load(f)
+        manifest = self._collection_manifest(collection_path, previous=previous)
+
+        changed = sorted(fn for fn, entry in manifest.items() if previous.get(fn, {}).get("sha256") != entry["sha256"])
+        removed = sorted(set(previous) - set(manifest))
+        if changed or removed:
+            logger.info(
+                "updating index %s with %s new or changed files and %s removed files",
+                self.get_index_path(),
+                len(changed),
+                len(removed),
+            )
+            stale_docids = self._stale_docids(previous, changed + removed)
+            # stale documents without a new version in a changed file are indexed again from unchanged files containing them
+            missing = stale_docids.difference(*(manifest[fn]["docids"] for fn in changed))
+            reindexed = [
+                fn for fn, entry in manifest.items() if fn not in changed and not missing.isdisjoint(entry.get("docids", []))
+            ]
+            self._index_delta(collection_path, changed + sorted(reindexed), stale_docids)
+
+        self._write_manifest(manifest)
+
+    def _stale_docids(self, previous, replaced_files):
+        """ Return the docids that were indexed from `replaced_files` according to the `previous` manifest """
+        if any("docids" not in previous[fn] for fn in replaced_files if fn in previous):
+            logger.warning(
+                "the manifest of index %s does not record the docids indexed from each file, so only documents with "
+                "new versions are replaced; rebuild the index to remove the other documents of changed or removed files",
+                self.get_index_path(),
+            )
+            return set()
+
+        return {docid for fn in replaced_files if fn in previous for docid in previous[fn]["docids"]}
+
+    def _index_delta(self, collection_path, changed_files, stale_docids):
+        delta_path = self.get_cache_path() / "index-delta"
+        shutil.rmtree(delta_path, ignore_errors=True)
+
+        delta_index_path = None
+        if changed_files:
+            # link the changed files into a directory with the collection's layout, so Anserini can read them as a collection
+            delta_input = delta_path / "input"
+            for relpath in changed_files:
+                os.makedirs(delta_input / os.path.dirname(relpath), exist_ok=True)
+                try:
+                    os.link(os.path.join(collection_path, relpath), delta_input / relpath)
+                except OSError:
+                    shutil.copy2(os.path.join(collection_path, relpath), delta_input / relpath)
+
+            delta_index_path = (delta_path / "index").as_posix()
+            self._index_collection(delta_input, delta_index_path)
+
+        index_path = self.get_index_path().as_posix()
+        merge_index(index_path, delta_index_path, deleted_docids=stale_docids)
+        refresh_index_reader(index_path)
+        shutil.rmtree(delta_path, ignore_errors=True)
+
+        # pooled searchers would keep searching the old index
+        from capreolus.searcher import close_pooled_searchers
 
-        app.wait()
-        if app.returncode != 0:
-            raise RuntimeError("command failed")
+        close_pooled_searchers(index_path)
+
+        # the postings snapshots and token caches derived from the old index are no longer valid. search runs record
+        # the index version they were computed with (see get_index_version), so they are recomputed when next requested.
+        shutil.rmtree(self.get_cache_path() / "postings", ignore_errors=True)
+        for root, dirs, _ in os.walk(self.get_cache_path()):
+            if "doctoks" in dirs:
+                shutil.rmtree(os.path.join(root, "doctoks"))
+                dirs.remove("doctoks")
 
     def get_docs(self, doc_ids):
+        """ Return the transformed text of each docid in `doc_ids`, or None for docids missing from the index.
+            All docids are resolved to Lucene ids with a single query rather than one lookup per document. """
         # if self.collection.is_large_collection:
         #     return self.get_documents_from_disk(doc_ids)
 
-        return [self.get_doc(doc_id) for doc_id in doc_ids]
+        return fetch_docs(self.reader, doc_ids, field=FIELD_BODY)
 
-    def get_doc(self, docid):
-        try:
-            if not hasattr(self, "index_utils") or self.index_utils is None:
-                self.open()
-            return self.index_utils.getTransformedDocument(docid)
-        except Exception as e:
-            raise
+    def get_doc(self, doc_id):
+        doc = self.get_docs([doc_id])[0]
+        if doc is None:
+            raise MissingDocError(None, doc_id)
+        return doc
+
+    def get_doc_vectors(self, doc_ids):
+        """ Return the indexed terms of each docid in `doc_ids` in document order, or None for missing docids.
+
+            The terms are read from the docvectors stored in the index, so no tokenization is needed. They match the
+            output of an AnseriniTokenizer only if it uses the same stemmer and stopword settings as this index.
+            Docvectors are not stored for large collections, so this method should not be used with them.
+        """
+        lucene_ids = resolve_lucene_docids(self.reader, doc_ids)
+        return [None if lucene_id is None else self._doc_vector(lucene_id) for lucene_id in lucene_ids]
+
+    def _doc_vector(self, lucene_id):
+        terms = self.reader.getTermVector(lucene_id, FIELD_BODY)
+        if terms is None:
+            return []
+
+        positioned_terms = []
+        terms_enum = terms.iterator()
+        bytesref = terms_enum.next()
+        while bytesref is not None:
+            term = bytesref.utf8ToString()
+            postings = terms_enum.postings(None, self.JPostingsEnum.POSITIONS)
+            postings.nextDoc()
+            for _ in range(postings.freq()):
+                positioned_terms.append((postings.nextPosition(), term))
+            bytesref = terms_enum.next()
+
+        return [term for position, term in sorted(positioned_terms)]
 
     def get_df(self, term):
         # returns 0 for missing terms
-        if not hasattr(self, "reader") or self.reader is None:
+        if self._shared_reader is None:
             self.open()
         jterm = self.JTerm("contents", term)
         return self.reader.docFreq(jterm)
@@ -109,17 +283,308 @@ class AnseriniIndex(Index):
         idf = math.log(1 + idf)
         return max(idf, 0)
 
+    def get_postings_snapshot(self, terms):
+        """ Return a PostingsSnapshot with the postings of `terms`. The postings and the collection statistics are
+            exported from the index on first use and cached as numpy arrays under the index's cache path. """
+        self.create_index()
+        terms = sorted(set(terms))
+        postings_path = self.get_cache_path() / "postings"
+        os.makedirs(postings_path, exist_ok=True)
+
+        collection_fn = postings_path / "collection.npz"
+        terms_fn = postings_path / ("terms-" + hashlib.sha256("\n".join(terms).encode("utf-8")).hexdigest() + ".npz")
+        if not collection_fn.exists() or not terms_fn.exists():
+            if not collection_fn.exists():
+                logger.info("exporting document lengths and ids from %s", self.get_index_path())
+                PostingsSnapshot.save_collection(collection_fn, *export_collection_stats(self.reader))
+            if not terms_fn.exists():
+                logger.info("exporting postings for %s terms from %s", len(terms), self.get_index_path())
+                PostingsSnapshot.save_terms(terms_fn, terms, *export_postings(self.reader, terms))
+
+        return PostingsSnapshot.load(terms_fn, collection_fn)
+
+    _shared_reader = None
+
+    @property
+    def reader(self):
+        """ The index's DirectoryReader, which is opened on first use and shared with other modules using this index """
+        if self._shared_reader is None:
+            self.open()
+        return self._shared_reader.reader
+
+    @property
+    def index_utils(self):
+        if self._shared_reader is None:
+            self.open()
+        return self._shared_reader.index_utils
+
+    @property
+    def numdocs(self):
+        if self._shared_reader is None:
+            self.open()
+        return self._shared_reader.numdocs
+
     def open(self):
         from jnius import autoclass
 
-        index_path = self.get_index_path().as_posix()
+        if self._shared_reader is None:
+            self._shared_reader = acquire_index_reader(self.get_index_path().as_posix())
+        self.JTerm = autoclass("org.apache.lucene.index.Term")
+        self.JPostingsEnum = autoclass("org.apache.lucene.index.PostingsEnum")
+
+    def close(self):
+        """ Release this module's reference to the shared reader, which is closed once no module is using it """
+        if self._shared_reader is not None:
+            release_index_reader(self._shared_reader.index_path)
+            self._shared_reader = None
+
 
-        JIndexUtils = autoclass("io.anserini.index.IndexUtils")
-        self.index_utils = JIndexUtils(index_path)
+class SharedIndexReader:
+    """ A Lucene DirectoryReader for one index path, shared by every module reading that index (e.g., the indexes
+        required by a searcher and by an extractor) so that the index is opened once. Obtain instances with
+        acquire_index_reader and give them back with release_index_reader. """
 
-        JFile = autoclass("java.io.File")
-        JFSDirectory = autoclass("org.apache.lucene.store.FSDirectory")
-        fsdir = JFSDirectory.open(JFile(index_path).toPath())
-        self.reader = autoclass("org.apache.lucene.index.DirectoryReader").open(fsdir)
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.reader = open_reader(index_path)
         self.numdocs = self.reader.numDocs()
-        self.JTerm = autoclass("org.apache.lucene.index.Term")
+        self.refcount = 0
+        self._index_utils = None
+
+    @property
+    def index_utils(self):
+        # IndexUtils opens another reader of its own, so it is only created when it is needed
+        if self._index_utils is None:
+            from jnius import autoclass
+
+            self._index_utils = autoclass("io.anserini.index.IndexUtils")(self.index_path)
+        return self._index_utils
+
+    def refresh(self):
+        """ Reopen the reader if the index changed on disk, reusing the segments that did not change """
+        from jnius import autoclass
+
+        new_reader = autoclass("org.apache.lucene.index.DirectoryReader").openIfChanged(self.reader)
+        if new_reader is not None:
+            self.reader.close()
+            self.reader = new_reader
+            self.numdocs = new_reader.numDocs()
+            self._index_utils = None
+
+    def close(self):
+        self.reader.close()
+
+
+_reader_pool = {}
+_reader_pool_lock = threading.Lock()
+
+
+def acquire_index_reader(index_path):
+    """ Return the SharedIndexReader for index_path, opening the index if no module is currently reading it """
+    index_path = str(index_path)
+    with _reader_pool_lock:
+        if index_path not in _reader_pool:
+            _reader_pool[index_path] = SharedIndexReader(index_path)
+        shared = _reader_pool[index_path]
+        shared.refcount += 1
+        return shared
+
+
+def release_index_reader(index_path):
+    """ Drop a reference to the reader for index_path and close it once it is no longer referenced """
+    index_path = str(index_path)
+    with _reader_pool_lock:
+        shared = _reader_pool[index_path]
+        shared.refcount -= 1
+        if shared.refcount <= 0:
+            shared.close()
+            del _reader_pool[index_path]
+
+
+def refresh_index_reader(index_path):
+    """ Make the shared reader for index_path (if it is open) see the index's current contents """
+    with _reader_pool_lock:
+        if str(index_path) in _reader_pool:
+            _reader_pool[str(index_path)].refresh()
+
+
+def open_reader(index_path):
+    """ Open a Lucene DirectoryReader for the index at `index_path` """
+    from jnius import autoclass
+
+    JFile = autoclass("java.io.File")
+    JFSDirectory = autoclass("org.apache.lucene.store.FSDirectory")
+    fsdir = JFSDirectory.open(JFile(index_path).toPath())
+    return autoclass("org.apache.lucene.index.DirectoryReader").open(fsdir)
+
+
+def resolve_lucene_docids(reader, doc_ids):
+    """ Map each docid in `doc_ids` to its internal Lucene id (or None if it is missing) using one TermInSetQuery,
+        rather than issuing a separate TermQuery for every docid as IndexUtils.convertDocidToLuceneDocid does. """
+    from jnius import autoclass
+
+    JArrayList = autoclass("java.util.ArrayList")
+    JBytesRef = autoclass("org.apache.lucene.util.BytesRef")
+    JTermInSetQuery = autoclass("org.apache.lucene.search.TermInSetQuery")
+    JIndexSearcher = autoclass("org.apache.lucene.search.IndexSearcher")
+    JHashSet = autoclass("java.util.HashSet")
+
+    unique_ids = set(doc_ids)
+    if not unique_ids:
+        return []
+
+    terms = JArrayList()
+    for docid in unique_ids:
+        terms.add(JBytesRef(docid))
+
+    id_field = JHashSet()
+    id_field.add(FIELD_ID)
+
+    searcher = JIndexSearcher(reader)
+    topdocs = searcher.search(JTermInSetQuery(FIELD_ID, terms), len(unique_ids))
+    found = {}
+    for scoredoc in topdocs.scoreDocs:
+        found[reader.document(scoredoc.doc, id_field).get(FIELD_ID)] = scoredoc.doc
+
+    return [found.get(docid) for docid in doc_ids]
+
+
+def fetch_docs(reader, doc_ids, field=FIELD_BODY):
+    """ Return the stored `field` of each docid in `doc_ids`, or None for docids missing from the index """
+    from jnius import autoclass
+
+    fields = autoclass("java.util.HashSet")()
+    fields.add(field)
+
+    lucene_ids = resolve_lucene_docids(reader, doc_ids)
+    return [None if lucene_id is None else reader.document(lucene_id, fields).get(field) for lucene_id in lucene_ids]
+
+
+def manifest_digest(manifest):
+    """ Hash the relative path and sha256 of each file in an index manifest """
+    files = sorted((relpath, entry["sha256"]) for relpath, entry in manifest.items())
+    return hashlib.sha256(json.dumps(files).encode("utf-8")).hexdigest()
+
+
+def read_file_docids(collection_type, path):
+    """ Return the docids of the documents that Anserini's `collection_type` (e.g., TrecCollection) reads from the
+        collection file at `path` """
+    from jnius import autoclass
+
+    JFile = autoclass("java.io.File")
+    collection = autoclass(f"io.anserini.collection.{collection_type}")()
+    segment = collection.createFileSegment(JFile(path).toPath())
+    docids = []
+    try:
+        docs = segment.iterator()
+        while docs.hasNext():
+            docids.append(docs.next().id())
+    finally:
+        segment.close()
+
+    return docids
+
+
+def merge_index(index_path, delta_index_path, deleted_docids=()):
+    """ Add the documents in the index at `delta_index_path` (if not None) to the index at `index_path`, first deleting
+        any documents in `index_path` whose docids are in `deleted_docids` or belong to documents in the delta """
+    from jnius import autoclass
+
+    JFile = autoclass("java.io.File")
+    JFSDirectory = autoclass("org.apache.lucene.store.FSDirectory")
+    JIndexWriter = autoclass("org.apache.lucene.index.IndexWriter")
+    JIndexWriterConfig = autoclass("org.apache.lucene.index.IndexWriterConfig")
+    JOpenMode = autoclass("org.apache.lucene.index.IndexWriterConfig$OpenMode")
+    JWhitespaceAnalyzer = autoclass("org.apache.lucene.analysis.core.WhitespaceAnalyzer")
+    JArrayList = autoclass("java.util.ArrayList")
+    JBytesRef = autoclass("org.apache.lucene.util.BytesRef")
+    JTermInSetQuery = autoclass("org.apache.lucene.search.TermInSetQuery")
+
+    deleted_ids = JArrayList()
+    for docid in deleted_docids:
+        deleted_ids.add(JBytesRef(docid))
+
+    if delta_index_path is not None:
+        delta_reader = open_reader(delta_index_path)
+        id_field = autoclass("java.util.HashSet")()
+        id_field.add(FIELD_ID)
+        for i in range(delta_reader.maxDoc()):
+            deleted_ids.add(JBytesRef(delta_reader.document(i, id_field).get(FIELD_ID)))
+        delta_reader.close()
+
+    # documents are added as already analyzed segments, so the writer's analyzer is never used
+    writer_config = JIndexWriterConfig(JWhitespaceAnalyzer()).setOpenMode(JOpenMode.APPEND)
+    writer = JIndexWriter(JFSDirectory.open(JFile(index_path).toPath()), writer_config)
+    try:
+        writer.deleteDocuments([JTermInSetQuery(FIELD_ID, deleted_ids)])
+        if delta_index_path is not None:
+            writer.addIndexes([JFSDirectory.open(JFile(delta_index_path).toPath())])
+        writer.commit()
+    finally:
+        writer.close()
+
+
+def export_collection_stats(reader, field=FIELD_BODY):
+    """ Return (doclens, docids, doc count, sum of term frequencies) for `field`, where doclens[i] is the length of the
+        document with Lucene id i as decoded from its norm and docids[i] is its external docid """
+    from jnius import autoclass
+
+    JMultiDocValues = autoclass("org.apache.lucene.index.MultiDocValues")
+    JSmallFloat = autoclass("org.apache.lucene.util.SmallFloat")
+    no_more_docs = autoclass("org.apache.lucene.search.DocIdSetIterator").NO_MORE_DOCS
+
+    # norms store each length as a byte, which Lucene's similarities decode with SmallFloat.byte4ToInt
+    length_table = np.array([JSmallFloat.byte4ToInt(b if b < 128 else b - 256) for b in range(256)], dtype=np.float32)
+    encoded = np.zeros(reader.maxDoc(), dtype=np.int64)
+    norms = JMultiDocValues.getNormValues(reader, field)
+    if norms is not None:
+        doc = norms.nextDoc()
+        while doc != no_more_docs:
+            encoded[doc] = norms.longValue() & 0xFF
+            doc = norms.nextDoc()
+    doclens = length_table[encoded]
+
+    id_field = autoclass("java.util.HashSet")()
+    id_field.add(FIELD_ID)
+    docids = [reader.document(i, id_field).get(FIELD_ID) or "" for i in range(reader.maxDoc())]
+
+    return doclens, docids, reader.getDocCount(field), reader.getSumTotalTermFreq(field)
+
+
+def export_postings(reader, terms, field=FIELD_BODY):
+    """ Return (offsets, docs, tfs, dfs, ttfs) arrays holding the postings of each term in `terms` in `field` """
+    from jnius import autoclass
+
+    JMultiTerms = autoclass("org.apache.lucene.index.MultiTerms")
+    JBytesRef = autoclass("org.apache.lucene.util.BytesRef")
+    JTerm = autoclass("org.apache.lucene.index.Term")
+    freqs_flag = autoclass("org.apache.lucene.index.PostingsEnum").FREQS
+    no_more_docs = autoclass("org.apache.lucene.search.DocIdSetIterator").NO_MORE_DOCS
+
+    # postings still contain deleted documents (e.g., documents replaced by update_index) until their segments merge
+    live_docs = autoclass("org.apache.lucene.index.MultiBits").getLiveDocs(reader)
+
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    docs, tfs, dfs, ttfs = [], [], [], []
+    for i, term in enumerate(terms):
+        postings = JMultiTerms.getTermPostingsEnum(reader, field, JBytesRef(term), freqs_flag)
+        if postings is not None:
+            doc = postings.nextDoc()
+            while doc != no_more_docs:
+                if live_docs is None or live_docs.get(doc):
+                    docs.append(doc)
+                    tfs.append(postings.freq())
+                doc = postings.nextDoc()
+
+        offsets[i + 1] = len(docs)
+        jterm = JTerm(field, term)
+        dfs.append(reader.docFreq(jterm))
+        ttfs.append(reader.totalTermFreq(jterm))
+
+    return (
+        offsets,
+        np.array(docs, dtype=np.int32),
+        np.array(tfs, dtype=np.int32),
+        np.array(dfs, dtype=np.int64),
+        np.array(ttfs, dtype=np.int64),
+    )
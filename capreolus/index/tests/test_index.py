@@ -1,9 +1,15 @@
+import os
+import shutil
+
 import pytest
 
 from capreolus.collection import Collection, DummyCollection
 from capreolus.index import Index
 from capreolus.index import AnseriniIndex
+from capreolus.searcher import get_pooled_searcher
+from capreolus.tokenizer import AnseriniTokenizer
 from capreolus.tests.common_fixtures import tmpdir_as_cache, dummy_index
+from capreolus.utils.exceptions import MissingDocError
 
 
 def test_anserini_create_index(tmpdir_as_cache):
@@ -32,3 +38,95 @@ def test_anserini_get_df(tmpdir_as_cache, dummy_index):
 def test_anserini_get_idf(tmpdir_as_cache, dummy_index):
     idf = dummy_index.get_idf("hello")
     assert idf == 0.1823215567939546
+
+
+def test_anserini_shared_reader(tmpdir_as_cache, dummy_index):
+    other = AnseriniIndex(dict(dummy_index.cfg))
+    other.modules["collection"] = dummy_index["collection"]
+    assert other.reader is dummy_index.reader
+
+    # the reader stays open until every module using it is closed
+    shared = other._shared_reader
+    assert shared.refcount == 2
+    dummy_index.close()
+    assert shared.refcount == 1
+    assert other.get_df("hello") == 2
+    other.close()
+    assert shared.refcount == 0
+
+
+def test_anserini_get_docs_missing(tmpdir_as_cache, dummy_index):
+    docs = dummy_index.get_docs(["LA010189-0002", "nosuchdoc", "LA010189-0001"])
+    assert docs == [
+        "Dummy LessDummy Hello world, greetings from outer space!",
+        None,
+        "Dummy Dummy Dummy Hello world, greetings from outer space!",
+    ]
+
+
+def test_anserini_get_doc_vectors(tmpdir_as_cache, dummy_index):
+    # the tokenizer must use the same settings as dummy_index for its output to match the docvectors
+    tokenizer = AnseriniTokenizer({"_name": "anserini", "keepstops": False, "stemmer": "porter"})
+    docids = ["LA010189-0001", "nosuchdoc", "LA010189-0002"]
+    vectors = dummy_index.get_doc_vectors(docids)
+
+    assert vectors[1] is None
+    for docid, vector in zip(docids[::2], vectors[::2]):
+        assert vector == tokenizer.tokenize(dummy_index.get_doc(docid))
+
+
+def test_anserini_update_index(tmpdir_as_cache, tmpdir):
+    collection_path = tmpdir / "collection"
+    shutil.copytree(DummyCollection._path, collection_path)
+
+    collection = DummyCollection({"_name": "dummy"})
+    collection._path = str(collection_path)
+    index = AnseriniIndex({"_name": "anserini", "indexstops": False, "stemmer": "porter"})
+    index.modules["collection"] = collection
+    index.create_index()
+    assert index.get_docs(["LA010189-0003"]) == [None]
+    assert index.numdocs == 2
+
+    # add a file with a new document and an updated version of an existing one
+    with open(collection_path / "dummy_trec_doc", "rt") as f:
+        original = f.read()
+    new_doc = original.split("</DOC>")[0] + "</DOC>\n"
+    new_doc += new_doc.replace("LA010189-0001", "LA010189-0003").replace("greetings", "hello")
+    with open(collection_path / "new_trec_doc", "wt") as outf:
+        outf.write(new_doc.replace("Hello world, greetings", "Goodbye world, greetings", 1))
+
+    index.update_index()
+    docs = index.get_docs(["LA010189-0001", "LA010189-0002", "LA010189-0003"])
+    assert "Goodbye" in docs[0]
+    assert docs[1] == "Dummy LessDummy Hello world, greetings from outer space!"
+    assert docs[2] is not None
+    assert index.get_df("goodby") == 1
+    assert index.numdocs == 3
+
+    # documents removed from a changed file are deleted, and are not returned by searchers opened before the update
+    version = index.get_index_version()
+    searcher = get_pooled_searcher(index.get_index_path().as_posix())
+    with open(collection_path / "new_trec_doc", "wt") as outf:
+        outf.write(new_doc.split("</DOC>")[0].replace("Hello world, greetings", "Goodbye world, greetings", 1) + "</DOC>\n")
+
+    index.update_index()
+    assert index.get_index_version() != version
+    assert index.get_docs(["LA010189-0003"]) == [None]
+    assert "Goodbye" in index.get_doc("LA010189-0001")
+    assert index.numdocs == 2
+    assert get_pooled_searcher(index.get_index_path().as_posix()) is not searcher
+
+    # a docid from a removed file that is also in an unchanged file is indexed again from the unchanged file
+    os.remove(collection_path / "new_trec_doc")
+    index.update_index()
+    assert index.get_doc("LA010189-0001") == "Dummy Dummy Dummy Hello world, greetings from outer space!"
+    assert index.get_df("goodby") == 0
+    assert index.numdocs == 2
+
+
+def test_anserini_get_doc(tmpdir_as_cache, dummy_index):
+    assert dummy_index.get_doc("LA010189-0001") == "Dummy Dummy Dummy Hello world, greetings from outer space!"
+
+    with pytest.raises(MissingDocError) as excinfo:
+        dummy_index.get_doc("nosuchdoc")
+    assert excinfo.value.missed_docid == "nosuchdoc"
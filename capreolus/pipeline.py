@@ -1,17 +1,15 @@
 import importlib
-import os
 import sys
 
 from collections import OrderedDict
 from functools import partial
-from glob import glob
 from inspect import isclass
 
 import sacred
 
 sacred.SETTINGS.CONFIG.READ_ONLY_CONFIG = False
 
-from capreolus.registry import PACKAGE_PATH, all_known_modules
+from capreolus.registry import all_known_modules
 from capreolus.task import Task
 from capreolus.utils.loginit import get_logger
 
@@ -36,16 +34,9 @@ class Pipeline:
         self.rewritten_args = rewritten_args
 
         for module in self.task.module_order:
-            # import the base module
+            # import the base module. plugins in the module's other files are imported when they are first looked up
             importlib.import_module(f"capreolus.{module}")
 
-            # attempt to import any files in the module's subdirectory
-            module_path = PACKAGE_PATH / module
-            for fn in glob(os.path.join(module_path, "*.py")):
-                modname = os.path.basename(fn)[:-3]
-                if not (modname.startswith("__") or modname.startswith("flycheck_")):
-                    importlib.import_module(f"capreolus.{module}.{modname}")
-
         # create a sacred experiment to attach config options, ingredients, etc. to
         self.ex = self._create_experiment(self.task.name)
 
@@ -239,6 +230,9 @@ class Notebook:
         If not, `Collection` modules are initialized first, followed by the remaining modules in alphabetical order.
         This is safe as long as Collection is the only required dependency. You will need to set `module_order` if not.
 
+        Index, tokenizer, and searcher instances are shared with earlier pipelines (and notebooks) that used the same module
+        config, so indexes are not reopened when a notebook is re-run. Call `capreolus.registry.clear_module_cache()` to start over.
+
         Args:
             pipeline_description (dict or Task): either a dict describing the desired modules or a Task class whose environment should be created.
             If a Task is provided, it should be provided as a class rather than a class instance. e.g. `Notebook(task.rank.RankTask)`
@@ -1,8 +1,13 @@
+import ast
 import importlib
+import json
 import multiprocessing
 import os
+import threading
 
+from collections import defaultdict
 from functools import partial
+from glob import glob
 from pathlib import Path
 
 # from types import MappingProxyType
@@ -20,6 +25,16 @@ RESULTS_BASE_PATH = Path(os.environ.get("CAPREOLUS_RESULTS", os.path.expanduser(
 MAX_THREADS = int(os.environ.get("CAPREOLUS_THREADS", multiprocessing.cpu_count()))
 CACHE_BASE_PATH = Path(os.environ.get("CAPREOLUS_CACHE", os.path.expanduser("~/.capreolus/cache/")))
 
+# module instances shared across the modules, commands, and notebooks of this process (see instantiate_from_config)
+_module_instances = {}
+_module_instances_lock = threading.RLock()
+
+
+def clear_module_cache():
+    """ Forget the module instances created so far, so that modules are instantiated from scratch on their next use """
+    with _module_instances_lock:
+        _module_instances.clear()
+
 
 class Dependency:
     """ Represents a dependency on another module.
@@ -41,6 +56,97 @@ class Dependency:
         return f"<Dependency {self.module}={self.name} overrides={self.config_overrides}>"
 
 
+def scan_plugin_names(package_path):
+    """ Map the plugin names declared in the files of a module package (e.g., capreolus/reranker/*.py) to the names of
+        the files declaring them. Files are parsed rather than imported, so their (possibly heavy) imports do not run.
+        A plugin is found if its class body assigns a string to `name`. """
+    names = defaultdict(list)
+    for fn in sorted(glob(os.path.join(package_path, "*.py"))):
+        modname = os.path.basename(fn)[:-3]
+        if modname.startswith("__") or modname.startswith("flycheck_"):
+            continue
+
+        with open(fn, "rt") as f:
+            tree = ast.parse(f.read(), filename=fn)
+
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            for stmt in node.body:
+                if isinstance(stmt, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "name" for t in stmt.targets):
+                    try:
+                        value = ast.literal_eval(stmt.value)
+                    except ValueError:
+                        continue
+                    if isinstance(value, str):
+                        names[value].append(modname)
+
+    return dict(names)
+
+
+class LazyPlugins(dict):
+    """ The plugins dict of a module type, which imports plugins on demand.
+
+        Plugins declared in the module type's package are registered when the package is imported. Plugins in the
+        package's other files (e.g., capreolus/reranker/KNRM.py) are found with `scan_plugin_names` and their file is
+        imported the first time the plugin is looked up, which registers the class. Iterating over the dict lists all
+        plugin names without importing them, while `values()` and `items()` import every plugin.
+    """
+
+    def __init__(self, module_type):
+        super().__init__()
+        self.module_type = module_type
+        self._manifest = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = scan_plugin_names(PACKAGE_PATH / self.module_type)
+        return self._manifest
+
+    def _import(self, modnames):
+        for modname in modnames:
+            importlib.import_module(f"capreolus.{self.module_type}.{modname}")
+
+    def load_all(self):
+        self._import(sorted({modname for modnames in self.manifest.values() for modname in modnames}))
+
+    def __missing__(self, name):
+        # fall back to importing every file in case the plugin's name is not a literal the scan could find
+        self._import(self.manifest.get(name, []))
+        if not dict.__contains__(self, name):
+            self.load_all()
+        if not dict.__contains__(self, name):
+            raise KeyError(name)
+        return dict.__getitem__(self, name)
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.manifest
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(sorted(set(dict.keys(self)) | set(self.manifest)))
+
+    def __len__(self):
+        return len(set(dict.keys(self)) | set(self.manifest))
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
+
+
 class RegisterableModule(type):
     """ Metaclass indicating that the subclass is a Capreolus module.
         Modules receive a `self.plugins` dict mapping names to classes.
@@ -50,14 +156,15 @@ class RegisterableModule(type):
         """ Metaclass used to automatically register module implementations """
         if not hasattr(cls, "plugins"):
             # true when module base class is declared (e.g., Collection)
-            cls.plugins = {}
+            cls.plugins = LazyPlugins(cls.module_type)
             all_known_modules[cls.module_type] = cls
         else:
             # class (Robust04) inheriting from the module base class (Collection)
             cls.register_plugin(cls)
 
     def register_plugin(cls, plugin):
-        if cls.plugins.get(plugin.name, plugin) != plugin:
+        # use dict.get so that registering a plugin never triggers a lazy import
+        if dict.get(cls.plugins, plugin.name, plugin) != plugin:
             logger.debug(f"WARNING: replacing entry {cls.plugins[plugin.name]} for {plugin.name} with {plugin}")
         cls.plugins[plugin.name] = plugin
 
@@ -88,19 +195,35 @@ class RegisterableMixIn:
         """ Instantiate this module using a given config.
             config: config dict to use
             module_lookup: a dict to use for module lookups, such as all_known_modules
+
+            Instances of modules with cache_instances = True are cached for the lifetime of the process, so that such
+            modules with identical configs (e.g., an index required by both a searcher and an extractor) are shared
+            across modules, commands, and notebooks rather than being created (and opened) several times. The cache is
+            checked before anything is constructed. Use clear_module_cache to reset the cache.
         """
 
         assert cls.plugins[config["_name"]] == cls, f'{config["_name"]} vs. {str(cls)}'
 
-        self = cls(config)
-        self.modules = {}
-        for k, dependency in cls.dependencies.items():
-            dependency_config = config[k]
-            name = dependency_config["_name"]
-            dependency_cls = module_lookup[dependency.module].plugins[name]
-            self.modules[k] = dependency_cls.instantiate_from_config(dependency_config, module_lookup)
-
-        return self
+        with _module_instances_lock:
+            key = None
+            if cls.cache_instances:
+                # the full config includes the configs of all dependencies, so it identifies the whole module graph
+                key = (cls.module_type, json.dumps(config, sort_keys=True, default=str))
+                cached = _module_instances.get(key)
+                if cached is not None and type(cached) == cls:
+                    return cached
+
+            self = cls(config)
+            self.modules = {}
+            for k, dependency in cls.dependencies.items():
+                dependency_config = config[k]
+                name = dependency_config["_name"]
+                dependency_cls = module_lookup[dependency.module].plugins[name]
+                self.modules[k] = dependency_cls.instantiate_from_config(dependency_config, module_lookup)
+
+            if key is not None:
+                _module_instances[key] = self
+            return self
 
     @classmethod
     def _create_ingredient(cls, module, sub_ingredients, command_list):
@@ -169,6 +292,9 @@ class ModuleBase(RegisterableMixIn):
     commands = {}
     cfg = None
     config_keys_not_in_path = []
+    # whether instances may be shared by pipelines with the same module config (see instantiate_from_config). only
+    # modules whose state is fully determined by their config, such as indexes and searchers, should set this.
+    cache_instances = False
 
     @staticmethod
     def config():
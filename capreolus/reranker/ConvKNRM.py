@@ -60,18 +60,7 @@ class ConvKNRM_class(nn.Module):
         simmats = torch.cat(simmats, dim=1)
 
         # remainder is the same as KNRM
-        kernels = self.kernels(simmats)
-        BATCH, KERNELS, VIEWS, QLEN, DLEN = kernels.shape
-        kernels = kernels.reshape(BATCH, KERNELS * VIEWS, QLEN, DLEN)
-        simmats = (
-            simmats.reshape(BATCH, 1, VIEWS, QLEN, DLEN)
-            .expand(BATCH, KERNELS, VIEWS, QLEN, DLEN)
-            .reshape(BATCH, KERNELS * VIEWS, QLEN, DLEN)
-        )
-        result = kernels.sum(dim=3)  # sum over document
-        mask = simmats.sum(dim=3) != 0.0  # which query terms are not padding?
-        result = torch.where(mask, (result + 1e-6).log(), mask.float())
-        result = result.sum(dim=2)  # sum over query terms
+        result = self.kernels.log_pool(simmats)  # (B, KERNELS * VIEWS)
         scores = self.combine(result)  # linear combination over kernels
         return scores
 
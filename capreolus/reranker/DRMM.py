@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -36,14 +37,42 @@ class DRMM_class(nn.Module):
         nn.init.uniform_(self.ffw[2].weight, -0.1, 0.1)
         nn.init.uniform_(self.gates.weight, -0.01, 0.01)
 
-    def _hist_map(self, queries, documents, d_masks):
+    def _bin_counts(self, sim_matrix):
+        """
+        Count the similarities falling in each histogram bin, in a single pass over the doc axis.
+        Bin i < nbins holds the similarities in [upperbound[i-1], upperbound[i]), where the upperbounds split [-1, 1]
+        into nbins equal bins, and the last bin counts exact matches (similarity ~1). Similarities >= 1 (including
+        <PAD> positions) fall outside the first nbins bins.
+
+        Args:
+            sim_matrix: (B, Tq, Td)
+
+        Returns: (B, Tq, nbins + 1) on sim_matrix's device
+        """
+        bin_upperbounds = torch.linspace(-1, 1, self.nbins + 1, device=sim_matrix.device)[1:]
+        inf = torch.tensor([float("inf")], device=sim_matrix.device)
+        # bin k covers [bounds[k], bounds[k + 1]), with bin nbins collecting the similarities >= 1
+        bounds = torch.cat([-inf, bin_upperbounds, inf])
+
+        # estimate each similarity's bin arithmetically, then correct the estimate against the exact bin bounds,
+        # since (sim + 1) * nbins / 2 can round across a bound
+        bin_idx = ((sim_matrix + 1) * (self.nbins / 2)).floor().clamp(0, self.nbins).long()
+        bin_idx -= (sim_matrix < bounds[bin_idx]).long()
+        bin_idx += (sim_matrix >= bounds[bin_idx + 1]).long()
+
+        hist = sim_matrix.new_zeros(sim_matrix.size(0), sim_matrix.size(1), self.nbins + 1)
+        hist.scatter_add_(2, bin_idx, torch.ones_like(sim_matrix))
+        hist[:, :, -1] = ((sim_matrix > 0.999) & (sim_matrix < 1.001)).sum(dim=-1).to(sim_matrix.dtype)
+        return hist
+
+    def _hist_counts_from_embeddings(self, queries, documents, d_masks):
         """
         Args:
             queries: (B, Tq, H)
             documents: (B, Td, H)
             d_masks: (B, Td)
 
-        Returns: (B, Tq, 6)
+        Returns: (B, Tq, nbins + 1)
         """
 
         # compute cos similarity
@@ -55,18 +84,10 @@ class DRMM_class(nn.Module):
         sim_matrix = sim_matrix / d_norm  # (B, Tq, Td)
 
         sim_matrix += (1 - d_masks[:, None, :]) * 1e7  # assign large number on <PAD> pos
-        hist = torch.zeros([sim_matrix.size(0), sim_matrix.size(1), self.nbins + 1], dtype=torch.float)
-
-        idxs = list(range(self.nbins))
-        bin_upperbounds = torch.linspace(-1, 1, self.nbins + 1)[1:].to(queries.device)
-        for i, bin_upperbound in zip(idxs, bin_upperbounds):
-            hist[:, :, i] = (sim_matrix < bin_upperbound).sum(dim=-1)
-        hist[:, :, -1] = ((sim_matrix > 0.999) * (sim_matrix < 1.001)).sum(dim=-1)
-
-        for i in list(range(self.nbins - 1, 0, -1)):  # exclude idx=config['nbins'] and idx=0
-            hist[:, :, i] -= hist[:, :, i - 1]
+        return self._bin_counts(sim_matrix)
 
-        hist += 1
+    def _normalize_hist(self, hist_counts):
+        hist = hist_counts + 1
 
         if self.hist_type == "NH":
             hist_sum = hist.sum(dim=-1)  # (B, T)
@@ -96,15 +117,25 @@ class DRMM_class(nn.Module):
         gate_prob = F.softmax(gate_prob, dim=1)  # (B, Tq)
         return gate_prob
 
-    def forward(self, sentence, query_sentence, query_idf):
-        query_sent_mask = (query_sentence != 0).to(sentence.device).float()  # (B, Tq)
+    def hist_counts(self, sentence, query_sentence):
+        """ Return the (B, Tq, nbins + 1) matching histogram counts, which only depend on the frozen embeddings """
         sent_mask = (sentence != 0).to(sentence.device).float()  # (B, Td)
 
         x = self.embedding(sentence).to(sentence.device)
         query_x = self.embedding(query_sentence).to(sentence.device).float()
 
-        hist_vec = self._hist_map(query_x, x, sent_mask).to(sentence.device)
-        ffw_vec = self.ffw(hist_vec).squeeze().to(sentence.device)  # (B, T1)
+        return self._hist_counts_from_embeddings(query_x, x, sent_mask)
+
+    def forward(self, sentence, query_sentence, query_idf):
+        return self.score_hist_counts(self.hist_counts(sentence, query_sentence), query_sentence, query_idf)
+
+    def score_hist_counts(self, hist_counts, query_sentence, query_idf):
+        """ Score documents given their matching histogram counts, as returned by hist_counts """
+        query_sent_mask = (query_sentence != 0).to(hist_counts.device).float()  # (B, Tq)
+        query_x = self.embedding(query_sentence).to(hist_counts.device).float()
+
+        hist_vec = self._normalize_hist(hist_counts)
+        ffw_vec = self.ffw(hist_vec).squeeze().to(hist_counts.device)  # (B, T1)
 
         query_idf = query_idf.float()
         w = self._term_gate(query_x, query_idf, query_sent_mask)  # （B, T1）
@@ -119,6 +150,10 @@ class DRMM_class(nn.Module):
 dtype = torch.FloatTensor
 
 
+# float16 represents every integer up to 2048 exactly, which bounds the histogram counts that can be cached
+MAX_CACHED_HIST_COUNT = 2048
+
+
 class DRMM(Reranker):
     name = "DRMM"
     description = """Jiafeng Guo, Yixing Fan, Qingyao Ai, and W. Bruce Croft. 2016. A Deep Relevance Matching Model for Ad-hoc Retrieval. In CIKM'16."""
@@ -130,6 +165,10 @@ class DRMM(Reranker):
         nodes = 5  # hidden layer dimension for feed forward matching network
         histType = "LCH"  # histogram type: 'CH', 'NH' or 'LCH'
         gateType = "IDF"  # term gate type: 'TV' or 'IDF'
+        histcache = False  # cache each (qid, docid) pair's matching histogram, which never changes since embeddings are frozen
+
+    # the cache does not change the scores
+    config_keys_not_in_path = ["histcache"]
 
     # @staticmethod
     # def required_params():
@@ -141,21 +180,44 @@ class DRMM(Reranker):
     #     return DRMM_class
 
     def build(self):
+        if self.cfg["histcache"] and self["extractor"].cfg["maxdoclen"] > MAX_CACHED_HIST_COUNT:
+            raise ValueError(f"histcache requires maxdoclen <= {MAX_CACHED_HIST_COUNT}, since counts are cached as float16")
+
         if not hasattr(self, "model"):
             self.model = DRMM_class(self["extractor"], self.cfg)
         return self.model
 
+    def _score_docs(self, qids, docids, sentence, query_sentence, query_idf):
+        if not self.cfg["histcache"]:
+            return self.model(sentence, query_sentence, query_idf).view(-1)
+
+        batch_rows = {}
+        for row, pair in enumerate(zip(qids, docids)):
+            batch_rows.setdefault(pair, row)
+
+        def compute(missing_qids, missing_docids):
+            rows = [batch_rows[pair] for pair in zip(missing_qids, missing_docids)]
+            with torch.no_grad():
+                return self.model.hist_counts(sentence[rows], query_sentence[rows]).cpu().numpy()
+
+        # counts are integers no larger than maxdoclen, so they are stored exactly as float16 (see build)
+        hist_counts = self["extractor"].get_pair_features(
+            f"drmm-nbins-{self.cfg['nbins']}", qids, docids, query_sentence.cpu().numpy(), sentence.cpu().numpy(), compute
+        )
+        hist_counts = torch.from_numpy(hist_counts.astype(np.float32)).to(sentence.device)
+        return self.model.score_hist_counts(hist_counts, query_sentence, query_idf).view(-1)
+
     def score(self, d):
         query_idf = d["query_idf"]
         query_sentence = d["query"]
         pos_sentence, neg_sentence = d["posdoc"], d["negdoc"]
         return [
-            self.model(pos_sentence, query_sentence, query_idf).view(-1),
-            self.model(neg_sentence, query_sentence, query_idf).view(-1),
+            self._score_docs(d["qid"], d["posdocid"], pos_sentence, query_sentence, query_idf),
+            self._score_docs(d["qid"], d["negdocid"], neg_sentence, query_sentence, query_idf),
         ]
 
     def test(self, d):
         query_idf = d["query_idf"]
         query_sentence = d["query"]
         pos_sentence = d["posdoc"]
-        return self.model(pos_sentence, query_sentence, query_idf).view(-1)
+        return self._score_docs(d["qid"], d["posdocid"], pos_sentence, query_sentence, query_idf)
@@ -64,6 +64,40 @@ class GRUModel2d(nn.Module):
         self.gru_cell = GRUCell2d(input_dim, hidden_dim)
 
     def forward(self, x):
+        """
+        Run the spatial GRU over the (T1, T2) grid one anti-diagonal at a time. The cells on a diagonal only depend on
+        cells on the two previous diagonals, so each diagonal is computed with one batched call to gru_cell rather
+        than one call per cell. The result matches _forward_cells.
+
+        Args:
+            x: (B, T1, T2, input_dim)
+
+        Returns: (B, hidden_dim), the hidden state of the last cell
+        """
+        B, T1, T2, H = x.size()
+
+        # diagonals[s][:, r] holds the hidden state of cell (r, s - r) on the grid padded with a row and column of
+        # zeros at the top and left (so input cell (i, j) is at (i + 1, j + 1)). positions off the grid are zero.
+        zeros = x.new_zeros(B, T1 + 1, self.hidden_dim)
+        prev2, prev1 = zeros, zeros
+        for s in range(2, T1 + T2 + 1):
+            lo, hi = max(1, s - T2), min(T1, s - 1)
+            rows = torch.arange(lo, hi + 1, device=x.device)
+            n = hi - lo + 1
+
+            cell_x = x[:, rows - 1, s - rows - 1, :].reshape(B * n, H)
+            hidden_diag = prev2[:, lo - 1 : hi].reshape(B * n, self.hidden_dim)
+            hidden_top = prev1[:, lo - 1 : hi].reshape(B * n, self.hidden_dim)
+            hidden_left = prev1[:, lo : hi + 1].reshape(B * n, self.hidden_dim)
+
+            hidden = self.gru_cell(cell_x, hidden_diag, hidden_top, hidden_left).view(B, n, self.hidden_dim)
+            current = torch.cat([zeros[:, :lo], hidden, zeros[:, hi + 1 :]], dim=1)
+            prev2, prev1 = prev1, current
+
+        return prev1[:, T1]
+
+    def _forward_cells(self, x):
+        """ Run the spatial GRU one cell at a time, row by row. forward computes the same result much faster. """
         B, T1, T2, H = x.size()
         device = x.device
 
@@ -83,6 +117,38 @@ class GRUModel2d(nn.Module):
         return out
 
 
+# HiNT splits documents into passages of this many terms
+PASSAGE_WINDOW = 100
+
+
+def split_passages(t, passagelen):
+    """ Split the last (doc) axis of t (B, ..., D) into passagelen windows and return them as (passagelen, B, ..., 100).
+        Doc terms after the last window are dropped. """
+    t = t[..., : passagelen * PASSAGE_WINDOW]
+    t = t.reshape(*t.shape[:-1], passagelen, PASSAGE_WINDOW)
+    passage_dim = t.dim() - 2
+    return t.permute(passage_dim, *range(passage_dim), passage_dim + 1)
+
+
+def spatial_gru_input(X_i_passage, Y_j_passage, M_passage, mask_passage):
+    """
+    Stack the query term weights, doc term weights and a similarity matrix into the spatial GRU's input.
+
+    Args:
+        X_i_passage: (P, B, Q)
+        Y_j_passage: (P, B, 100)
+        M_passage: (P, B, Q, 100)
+        mask_passage: (P, B, Q, 100) with 1 on positions to zero out
+
+    Returns: (P, B, Q, 100, 3)
+    """
+    grid_shape = M_passage.shape
+    X_i_grid = X_i_passage.unsqueeze(-1).expand(grid_shape)
+    Y_j_grid = Y_j_passage.unsqueeze(-2).expand(grid_shape)
+    S = torch.stack([X_i_grid, Y_j_grid, M_passage], dim=-1)
+    return S * (1 - mask_passage).unsqueeze(-1)
+
+
 class HiNT(nn.Module):
     def __init__(self, extractor, p):
         super(HiNT, self).__init__()
@@ -104,12 +170,8 @@ class HiNT(nn.Module):
         self.fc = nn.Linear(self.lstm_hidden_dim * self.p["kmax"], 1)
 
     def matrix_inv(self, A):
-        A1 = torch.zeros_like(A).to(A.device)
-        width, height = A.size(1), A.size(2)
-        for i in range(width):
-            for j in range(height):
-                A1[:, i, j, :] = A[:, width - i - 1, 99 - j, :]
-        return A1
+        """ Reverse the query and doc axes of A (N, Q, 100, H), so the spatial GRU runs from the bottom right """
+        return torch.flip(A, dims=[1, 2])
 
     def forward(self, sentence, query_sentence, M_XOR, M_cos, masks):
         """
@@ -120,43 +182,19 @@ class HiNT(nn.Module):
         # self.hidden = self.init_hidden()
 
         maxqlen = self.p["trainer"]["maxqlen"]
-        dtype, device = M_XOR.dtype, M_XOR.device
+        dtype = M_XOR.dtype
         x, query_x = self.embedding(sentence), self.embedding(query_sentence)
 
         X_i = self.Ws(query_x).view(self.batch_size, -1)
         Y_j = self.Ws(x).view(self.batch_size, -1)
 
-        total_passage_level = torch.randn(self.passagelen, self.batch_size, 8).type(dtype).to(device)
-        M_cos_passage = torch.randn(self.passagelen, self.batch_size, maxqlen, 100).type(dtype).to(device)
-        M_XOR_passage = torch.randn(self.passagelen, self.batch_size, maxqlen, 100).type(dtype).to(device)
-        Y_j_passage = torch.randn(self.passagelen, self.batch_size, 100).type(dtype).to(device)
-        X_i_passage = torch.randn(self.passagelen, self.batch_size, maxqlen).type(dtype).to(device)
-
-        mask_passage = torch.randn(self.passagelen, self.batch_size, maxqlen, 100).type(dtype).to(device)
-        for number_window in range(self.passagelen):
-            mask_passage[number_window] = masks[:, :, (number_window * 100):((number_window + 1) * 100)]  # (P, BAT, Q, 100)
-            M_cos_passage[number_window] = M_cos[:, :, (number_window * 100):((number_window + 1) * 100)]  # (P, BAT, Q, 100)
-            M_XOR_passage[number_window] = M_XOR[:, :, (number_window * 100):((number_window + 1) * 100)]  # (P, BAT, Q, 100)
-            Y_j_passage[number_window] = Y_j[:, (number_window * 100):((number_window + 1) * 100)]  # (P, BAT, 100)
-            X_i_passage[number_window] = X_i  # (P, BAT, 100)
-
-        S_cos = torch.randn(self.passagelen, self.batch_size, maxqlen, 100, 3).type(dtype).to(device)  # (P, BAT, Q, 100, 3)
-        S_xor = torch.randn(self.passagelen, self.batch_size, maxqlen, 100, 3).type(dtype).to(device)
-
-        S_cos[:, :, :, :, 0] = X_i_passage.reshape(self.passagelen, self.batch_size, maxqlen, 1).expand(
-            self.passagelen, self.batch_size, maxqlen, 100)
-        S_cos[:, :, :, :, 1] = Y_j_passage.reshape(self.passagelen, self.batch_size, 1, 100).expand(
-            self.passagelen, self.batch_size, maxqlen, 100)
-        S_cos[:, :, :, :, 2] = M_cos_passage
-        S_xor[:, :, :, :, 0] = X_i_passage.reshape(self.passagelen, self.batch_size, maxqlen, 1).expand(
-            self.passagelen, self.batch_size, maxqlen, 100)
-        S_xor[:, :, :, :, 1] = Y_j_passage.reshape(self.passagelen, self.batch_size, 1, 100).expand(
-            self.passagelen, self.batch_size, maxqlen, 100)
-        S_xor[:, :, :, :, 2] = M_XOR_passage
-
-        # add mask on X and Y
-        S_cos = S_cos * (1 - mask_passage).unsqueeze(-1)
-        S_xor = S_xor * (1 - mask_passage).unsqueeze(-1)
+        # split the doc axis into passages: (B, Q, D) -> (P, B, Q, 100) and (B, D) -> (P, B, 100)
+        mask_passage = split_passages(masks.to(dtype), self.passagelen)
+        X_i_passage = X_i.unsqueeze(0).expand(self.passagelen, self.batch_size, maxqlen)  # (P, BAT, Q)
+        Y_j_passage = split_passages(Y_j, self.passagelen)
+
+        S_cos = spatial_gru_input(X_i_passage, Y_j_passage, split_passages(M_cos, self.passagelen), mask_passage)
+        S_xor = spatial_gru_input(X_i_passage, Y_j_passage, split_passages(M_XOR, self.passagelen), mask_passage)
 
         # S_xor, S_cos: (P, B, Q, 100, 3) -> (P*B, Q, 100, 3)
         S_xor1 = S_xor.view(self.passagelen * self.batch_size, maxqlen, 100, 3)
@@ -177,10 +215,7 @@ class HiNT(nn.Module):
 
         e_inv = torch.cat([H_xor_inv, H_cos_inv], dim=-1)  # (P*B, 4)
         passage_level_e = torch.cat([e, e_inv], dim=-1)  # (P*B, 8)
-        for number_window in range(self.passagelen):  # (P, B, 8)
-            total_passage_level[number_window] = passage_level_e[
-                (self.batch_size * number_window) : (self.batch_size * (number_window + 1))
-            ]
+        total_passage_level = passage_level_e.view(self.passagelen, self.batch_size, -1)  # (P, B, 8)
 
         # lstm_out, self.hidden = self.lstm(total_passage_level, self.hidden)
         lstm_out, _ = self.lstm(total_passage_level)
@@ -211,7 +246,7 @@ class HiNT_main(nn.Module):
         self.HiNT1 = HiNT(extractor, p)
 
     def forward(self, sentence, query_sentence, query_idf):
-        x = self.HiNT1.embedding(sentence).cuda()
+        x = self.HiNT1.embedding(sentence)
         query_x = self.HiNT1.embedding(query_sentence)
         BAT = query_sentence.shape[0]
         A = query_sentence.shape[1]
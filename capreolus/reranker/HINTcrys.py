@@ -1,11 +1,10 @@
-import math
-
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
 
 from capreolus.reranker.common import create_emb_layer
+from capreolus.reranker.HINT import GRUModel2d, spatial_gru_input, split_passages
 from capreolus.utils.loginit import get_logger
 from capreolus.reranker import Reranker
 
@@ -16,75 +15,6 @@ dtype = torch.FloatTensor
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 
-class GRUCell2d(nn.Module):
-    def __init__(self, input_size, hidden_size, bias=True):
-        super(GRUCell2d, self).__init__()
-        self.input_size = input_size
-        self.hidden_size = hidden_size
-        self.bias = bias
-        self.Wrz = nn.Linear(3 * hidden_size + input_size, 7 * hidden_size, bias=bias)
-        self.W = nn.Linear(input_size, hidden_size, bias=bias)
-        self.U = nn.Linear(3 * hidden_size, hidden_size, bias=bias)
-
-    def reset_parameters(self):
-        std = 1.0 / math.sqrt(self.hidden_size)
-        for w in self.parameters():
-            w.data.uniform_(-std, std)
-
-    def softmax_by_row(self, zi, zl, zt, zd):
-        zi, zl, zt, zd = zi.view(-1, 1, 2), zl.view(-1, 1, 2), zt.view(-1, 1, 2), zd.view(-1, 1, 2)
-        # each: (B, 1, hidden=2)
-
-        ppp = torch.cat((zi, zl, zt, zd), dim=1)    # (B, 4, hidden)
-
-        pt = F.softmax(ppp, dim=1)                  # (B, 4, hidden)
-
-        zi, zl, zt, zd =  pt.unbind(dim=1)
-        zi, zl, zt, zd = zi.view(-1, 2), zl.view(-1, 2), zt.view(-1, 2), zd.view(-1, 2)
-
-        return zi, zl, zt, zd
-
-    def forward(self, x, hidden_i1_j1, hidden_i1_j, hidden_i_j1):
-        q = torch.cat([hidden_i1_j, hidden_i_j1, hidden_i1_j1, x], dim=-1)  # (B, 3*nhidden+input)
-        r_z = self.Wrz(q)
-        rl, rt, rd, zi, zl, zt, zd = r_z.chunk(7, 1)                        # each: (B, hidden)
-
-        rl, rt, rd = torch.sigmoid(rl), torch.sigmoid(rt), torch.sigmoid(rd)
-        zi, zl, zt, zd = self.softmax_by_row(zi, zl, zt, zd)
-
-        r = torch.cat([rl, rt, rd], dim=-1)
-        t11 = torch.cat([hidden_i1_j, hidden_i_j1, hidden_i1_j1], dim=-1)
-
-        h1 = torch.tanh(self.W(x) + self.U(r * t11))
-        h = (zl * hidden_i_j1) + (zt * hidden_i1_j) + (zd * hidden_i1_j1) + (zi * h1)
-
-        return h
-
-
-class GRUModel2d(nn.Module):
-    def __init__(self, input_dim, hidden_dim, bias=True):
-        super(GRUModel2d, self).__init__()
-        self.hidden_dim = hidden_dim
-        self.gru_cell = GRUCell2d(input_dim, hidden_dim)
-
-    def forward(self, x):
-        B, T1, T2, H = x.size()
-        last_outs = [(torch.zeros(x.size(0), self.hidden_dim).to(device)) for _ in range(T2+1)]
-        for seq in range(T1):
-            outs_row = [(torch.zeros(x.size(0), self.hidden_dim).to(device))]
-            for seq1 in range(1, T2+1):
-                hn = last_outs[seq1 - 1]
-                hn_top = last_outs[seq1]
-                hn_left = outs_row[seq1 - 1]
-
-                hn1 = self.gru_cell(x[:, seq, seq1-1, :], hn, hn_top, hn_left)
-                outs_row.append(hn1)
-
-            last_outs = outs_row
-        out = last_outs[-1]
-        return out
-
-
 class HiNT(nn.Module):
     def __init__(self, extractor, p):
         super(HiNT, self).__init__()
@@ -113,13 +43,8 @@ class HiNT(nn.Module):
         )
 
     def matrix_inv(self, A):
-        maxqlen = self.p["trainer"]["maxqlen"]
-
-        A1 = torch.randn(self.passagelen * self.batch_size, maxqlen, 100, 3).type(torch.FloatTensor).to(device)
-        for i in range(maxqlen):
-            for j in range(100):
-                A1[:, i, j, :] = A[:, maxqlen - i - 1, 99 - j, :]
-        return A1
+        """ Reverse the query and doc axes of A (N, Q, 100, H), so the spatial GRU runs from the bottom right """
+        return torch.flip(A, dims=[1, 2])
 
     def forward(self, sentence, query_sentence, M_XOR, M_cos, masks):
         '''
@@ -132,42 +57,13 @@ class HiNT(nn.Module):
         X_i = self.Ws(query_x).view(self.batch_size, -1)
         Y_j = self.Ws(x).view(self.batch_size, -1)
 
-        total_passage_level = torch.randn(self.passagelen, self.batch_size, 8).type(dtype).to(device)
-        M_cos_passage = torch.randn(self.passagelen, self.batch_size, maxqlen, 100).type(dtype).to(device)
-        M_XOR_passage = torch.randn(self.passagelen, self.batch_size, maxqlen, 100).type(dtype).to(device)
-        Y_j_passage = torch.randn(self.passagelen, self.batch_size, 100).type(dtype).to(device)
-        X_i_passage = torch.randn(self.passagelen, self.batch_size, maxqlen).type(dtype).to(device)
-
-        mask_passage = torch.randn(self.passagelen, self.batch_size, maxqlen, 100).type(dtype).to(device)
-
-        for number_window in range(self.passagelen):
-            mask_passage[number_window] = masks[:, :, (number_window * 100) : ((number_window + 1) * 100)]   # (P, BAT, Q, 100)
-
-            M_cos_passage[number_window] = M_cos[:, :, (number_window * 100) : ((number_window + 1) * 100)]  # (P, BAT, Q, 100)
-            M_XOR_passage[number_window] = M_XOR[:, :, (number_window * 100) : ((number_window + 1) * 100)]  # (P, BAT, Q, 100)
-            Y_j_passage[number_window] = Y_j[:, (number_window * 100) : ((number_window + 1) * 100)]         # (P, BAT, 100)
-            X_i_passage[number_window] = X_i                                                                 # (P, BAT, 100)
-
-        S_cos = torch.randn(self.passagelen, self.batch_size, maxqlen, 100, 3).type(dtype).to(device) # (P, BAT, Q, 100, 3)
-        S_xor = torch.randn(self.passagelen, self.batch_size, maxqlen, 100, 3).type(dtype).to(device)
-        S_cos[:, :, :, :, 0] = X_i_passage.reshape(self.passagelen, self.batch_size, maxqlen, 1).expand(
-            self.passagelen, self.batch_size, maxqlen, 100
-        )
-        S_cos[:, :, :, :, 1] = Y_j_passage.reshape(self.passagelen, self.batch_size, 1, 100).expand(
-            self.passagelen, self.batch_size, maxqlen, 100
-        )
-        S_cos[:, :, :, :, 2] = M_cos_passage
-        S_xor[:, :, :, :, 0] = X_i_passage.reshape(self.passagelen, self.batch_size, maxqlen, 1).expand(
-            self.passagelen, self.batch_size, maxqlen, 100
-        )
-        S_xor[:, :, :, :, 1] = Y_j_passage.reshape(self.passagelen, self.batch_size, 1, 100).expand(
-            self.passagelen, self.batch_size, maxqlen, 100
-        )
-        S_xor[:, :, :, :, 2] = M_XOR_passage
+        # split the doc axis into passages: (B, Q, D) -> (P, B, Q, 100) and (B, D) -> (P, B, 100)
+        mask_passage = split_passages(masks.to(M_XOR.dtype), self.passagelen)
+        X_i_passage = X_i.unsqueeze(0).expand(self.passagelen, self.batch_size, maxqlen)  # (P, BAT, Q)
+        Y_j_passage = split_passages(Y_j, self.passagelen)
 
-        # add mask on X and Y
-        S_cos = S_cos * (1 - mask_passage).unsqueeze(-1)
-        S_xor = S_xor * (1 - mask_passage).unsqueeze(-1)
+        S_cos = spatial_gru_input(X_i_passage, Y_j_passage, split_passages(M_cos, self.passagelen), mask_passage)
+        S_xor = spatial_gru_input(X_i_passage, Y_j_passage, split_passages(M_XOR, self.passagelen), mask_passage)
 
         # S_xor, S_cos: (P, B, Q, 100, 3) -> (P*B, Q, 100, 3)
         S_xor1 = S_xor.view(self.passagelen * self.batch_size, maxqlen, 100, 3)
@@ -188,10 +84,7 @@ class HiNT(nn.Module):
 
         e_inv = torch.cat([H_xor_inv, H_cos_inv], dim=-1)       # (P*B, 4)
         passage_level_e = torch.cat([e, e_inv], dim=-1)         # (P*B, 8)
-        for number_window in range(self.passagelen):            # (P, B, 8)
-            total_passage_level[number_window] = passage_level_e[
-                (self.batch_size * number_window) : (self.batch_size * (number_window + 1))
-            ]
+        total_passage_level = passage_level_e.view(self.passagelen, self.batch_size, -1)  # (P, B, 8)
 
         lstm_out, self.hidden = self.lstm(total_passage_level, self.hidden)
         # lstm_out: (P, B, 2 * self.hidden), where P is the timestep dimension
@@ -229,8 +122,8 @@ class HiNT_main(nn.Module):
         pos_sentence = pos_sentence.to(device)
         neg_sentence = neg_sentence.to(device)
 
-        x = self.HiNT1.embedding(pos_sentence).cuda()
-        query_x = self.HiNT1.embedding(query_sentence).cuda()
+        x = self.HiNT1.embedding(pos_sentence)
+        query_x = self.HiNT1.embedding(query_sentence)
         BAT = query_sentence.shape[0]
         A = query_sentence.shape[1]
         B = pos_sentence.shape[1]
@@ -258,8 +151,8 @@ class HiNT_main(nn.Module):
         pos_scores = self.HiNT1(pos_sentence, query_sentence, XOR_matrix_pos, M_cos_pos, pos_masks)
 
         self.HiNT1.hidden = self.HiNT1.init_hidden()
-        x = self.HiNT1.embedding(neg_sentence).cuda()
-        query_x = self.HiNT1.embedding(query_sentence).cuda()
+        x = self.HiNT1.embedding(neg_sentence)
+        query_x = self.HiNT1.embedding(query_sentence)
         BAT = query_sentence.shape[0]
         A = query_sentence.shape[1]
         B = neg_sentence.shape[1]
@@ -295,8 +188,8 @@ class HiNT_main(nn.Module):
         query_idf = query_idf.to(device)
         pos_sentence = pos_sentence.to(device)
 
-        x = self.HiNT1.embedding(pos_sentence).cuda()
-        query_x = self.HiNT1.embedding(query_sentence).cuda()
+        x = self.HiNT1.embedding(pos_sentence)
+        query_x = self.HiNT1.embedding(query_sentence)
         BAT = query_sentence.shape[0]
         A = query_sentence.shape[1]
         B = pos_sentence.shape[1]
@@ -37,18 +37,7 @@ class KNRM_class(nn.Module):
 
         # query = torch.rand_like(query)  # debug
         simmat = self.simmat(query, doc, querytoks, doctoks)
-        kernels = self.kernels(simmat)
-        BATCH, KERNELS, VIEWS, QLEN, DLEN = kernels.shape
-        kernels = kernels.reshape(BATCH, KERNELS * VIEWS, QLEN, DLEN)
-        simmat = (
-            simmat.reshape(BATCH, 1, VIEWS, QLEN, DLEN)
-            .expand(BATCH, KERNELS, VIEWS, QLEN, DLEN)
-            .reshape(BATCH, KERNELS * VIEWS, QLEN, DLEN)
-        )
-        result = kernels.sum(dim=3)  # sum over document
-        mask = simmat.sum(dim=3) != 0.0  # which query terms are not padding?
-        result = torch.where(mask, (result + 1e-6).log(), mask.float())
-        result = result.sum(dim=2)  # sum over query terms
+        result = self.kernels.log_pool(simmat)  # (B, KERNELS * VIEWS)
         scores = self.combine(result)  # linear combination over kernels
         return scores
 
@@ -85,7 +74,7 @@ class KNRM(Reranker):
         return self.model(pos_sentence, query_sentence, query_idf).view(-1)
 
     def query(self, query, docids):
-        if not hasattr(self["extractor"], "docid2toks"):
+        if getattr(self["extractor"], "doc_store", None) is None:
             raise RuntimeError("reranker's extractor has not been created yet. try running the task's train() method first.")
 
         results = []
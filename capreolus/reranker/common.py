@@ -1,4 +1,5 @@
 import torch
+from torch.utils.checkpoint import checkpoint
 
 
 _hinge_loss = torch.nn.MarginRankingLoss(margin=1, reduction="mean")
@@ -64,12 +65,19 @@ class RbfKernel(torch.nn.Module):
         return torch.exp(-0.5 * adj * adj / self.sigma / self.sigma)
 
 
+def _rbf_doc_sum(simmat, mus, sigmas):
+    """ Apply K kernels with mus and sigmas of shape (1, K, 1, 1, 1) to simmat (B, V, Q, D) and sum over the doc axis """
+    adj = simmat.unsqueeze(1) - mus
+    return torch.exp(-0.5 * adj * adj / sigmas / sigmas).sum(dim=-1)  # (B, K, V, Q)
+
+
 class RbfKernelBank(torch.nn.Module):
     # based on KNRMRbfKernelBank from https://github.com/Georgetown-IR-Lab/cedr/blob/master/modeling_util.py
     # which is copyright (c) 2019 Georgetown Information Retrieval Lab, MIT license
-    def __init__(self, mus=None, sigmas=None, dim=1, requires_grad=True):
+    def __init__(self, mus=None, sigmas=None, dim=1, requires_grad=True, doc_chunk=64):
         super().__init__()
         self.dim = dim
+        self.doc_chunk = doc_chunk
         kernels = [RbfKernel(m, s, requires_grad=requires_grad) for m, s in zip(mus, sigmas)]
         self.kernels = torch.nn.ModuleList(kernels)
 
@@ -79,6 +87,36 @@ class RbfKernelBank(torch.nn.Module):
     def forward(self, data):
         return torch.stack([k(data) for k in self.kernels], dim=self.dim)
 
+    def log_pool(self, simmat):
+        """
+        KNRM's kernel pooling: apply every kernel to the similarities, sum over the doc axis, take the log for query
+        terms that are not padding, and sum over the query axis. All kernels are applied with one broadcast, and the
+        doc axis is processed doc_chunk terms at a time, so the (B, K, V, Q, D) kernel tensor is never materialized.
+        When gradients are needed, each chunk is recomputed during the backward pass rather than kept in memory.
+
+        Args:
+            simmat: (B, V, Q, D)
+
+        Returns: (B, K * V), ordered like forward's (B, K, V, Q, D) output
+        """
+        shape = (1, self.count(), 1, 1, 1)
+        mus = torch.stack([k.mu for k in self.kernels]).to(simmat.dtype).view(shape)
+        sigmas = torch.stack([k.sigma for k in self.kernels]).to(simmat.dtype).view(shape)
+        checkpointed = torch.is_grad_enabled() and any(t.requires_grad for t in (simmat, mus, sigmas))
+
+        pooled = 0
+        for start in range(0, simmat.size(-1), self.doc_chunk):
+            chunk = simmat[..., start : start + self.doc_chunk]
+            if checkpointed:
+                pooled = pooled + checkpoint(_rbf_doc_sum, chunk, mus, sigmas)
+            else:
+                pooled = pooled + _rbf_doc_sum(chunk, mus, sigmas)
+
+        BATCH, KERNELS, VIEWS, QLEN = pooled.shape
+        mask = (simmat.sum(dim=-1) != 0.0).unsqueeze(1).expand(BATCH, KERNELS, VIEWS, QLEN)  # which query terms are not padding?
+        result = torch.where(mask, (pooled + 1e-6).log(), mask.to(pooled.dtype))
+        return result.sum(dim=-1).reshape(BATCH, KERNELS * VIEWS)  # sum over query terms
+
 
 def create_emb_layer(weights, non_trainable=True):
     layer = torch.nn.Embedding(*weights.shape)
@@ -0,0 +1,177 @@
+import numpy as np
+import pytest
+import torch
+
+from capreolus.extractor import EmbedText
+from capreolus.reranker.common import RbfKernelBank
+from capreolus.reranker.DRMM import DRMM, DRMM_class
+from capreolus.reranker.HINT import GRUModel2d, HiNT_main, split_passages
+
+
+class FakeExtractor:
+    def __init__(self, vocab_size=20, emb_dim=8, cache_path=None, maxdoclen=30):
+        self.embeddings = np.random.RandomState(0).normal(size=(vocab_size, emb_dim)).astype(np.float32)
+        self.cache_path = cache_path
+        self.cfg = {"maxqlen": 4, "maxdoclen": maxdoclen}
+
+    def _get_embedding_cache_path(self):
+        return self.cache_path
+
+    get_pair_features = EmbedText.get_pair_features
+
+
+def loop_bin_counts(sim_matrix, nbins):
+    """ the original per-bin implementation of DRMM's histogram """
+    hist = torch.zeros([sim_matrix.size(0), sim_matrix.size(1), nbins + 1], dtype=torch.float)
+    bin_upperbounds = torch.linspace(-1, 1, nbins + 1)[1:]
+    for i, bin_upperbound in enumerate(bin_upperbounds):
+        hist[:, :, i] = (sim_matrix < bin_upperbound).sum(dim=-1)
+    hist[:, :, -1] = ((sim_matrix > 0.999) * (sim_matrix < 1.001)).sum(dim=-1)
+
+    for i in range(nbins - 1, 0, -1):
+        hist[:, :, i] -= hist[:, :, i - 1]
+    return hist
+
+
+@pytest.mark.parametrize("nbins", [1, 5, 29, 30])
+def test_drmm_bin_counts(nbins):
+    model = DRMM_class(FakeExtractor(), {"nbins": nbins, "nodes": 5, "histType": "LCH", "gateType": "IDF"})
+
+    torch.manual_seed(0)
+    sim_matrix = torch.rand(3, 4, 50) * 2 - 1
+    # include similarities exactly on the bin bounds, exact matches, and <PAD> positions
+    sim_matrix[:, :, :nbins] = torch.linspace(-1, 1, nbins + 1)[1:]
+    sim_matrix[:, :, -3] = 1.0
+    sim_matrix[:, :, -2] = -1.0
+    sim_matrix[:, :, -1] = 1e7
+
+    assert torch.equal(model._bin_counts(sim_matrix), loop_bin_counts(sim_matrix, nbins))
+
+
+def test_drmm_histcache(tmpdir):
+    cfg = {"_name": "DRMM", "nbins": 29, "nodes": 5, "histType": "LCH", "gateType": "TV", "histcache": False}
+    reranker = DRMM(cfg)
+    reranker.modules["extractor"] = FakeExtractor(cache_path=tmpdir)
+    reranker.build()
+
+    cached_reranker = DRMM(dict(cfg, histcache=True))
+    cached_reranker.modules["extractor"] = reranker["extractor"]
+    cached_reranker.model = reranker.model
+
+    torch.manual_seed(0)
+    batch = {
+        "qid": ["1", "1", "2"],
+        "posdocid": ["a", "b", "a"],
+        "query": torch.randint(1, 20, (3, 4)),
+        "posdoc": torch.randint(0, 20, (3, 30)),
+        "query_idf": torch.rand(3, 4),
+    }
+
+    expected = reranker.test(batch)
+    assert torch.allclose(cached_reranker.test(batch), expected)
+    # the second call reads the histograms from the cache
+    assert torch.allclose(cached_reranker.test(batch), expected)
+
+    # the same qids and docids with different token ids (e.g., from another tokenizer) do not reuse cached histograms
+    batch["posdoc"] = torch.randint(0, 20, (3, 30))
+    assert torch.allclose(cached_reranker.test(batch), reranker.test(batch))
+    assert not torch.allclose(reranker.test(batch), expected)
+
+
+def test_drmm_histcache_maxdoclen(tmpdir):
+    cfg = {"_name": "DRMM", "nbins": 29, "nodes": 5, "histType": "LCH", "gateType": "TV", "histcache": True}
+    reranker = DRMM(cfg)
+    reranker.modules["extractor"] = FakeExtractor(cache_path=tmpdir, maxdoclen=4096)
+    with pytest.raises(ValueError):
+        reranker.build()
+
+
+@pytest.mark.parametrize("shape", [(2, 3, 7), (3, 1, 5), (2, 6, 2), (1, 1, 1)])
+def test_spatial_gru_wavefront(shape):
+    torch.manual_seed(0)
+    model = GRUModel2d(3, 2)
+    x = torch.randn(*shape, 3, requires_grad=True)
+
+    out = model(x)
+    expected = model._forward_cells(x)
+    assert out.shape == expected.shape
+    assert torch.allclose(out, expected, atol=1e-6)
+
+    grad = torch.autograd.grad(out.sum(), x)[0]
+    expected_grad = torch.autograd.grad(expected.sum(), x)[0]
+    assert torch.allclose(grad, expected_grad, atol=1e-6)
+
+
+def test_hint_split_passages():
+    t = torch.randn(2, 3, 250)
+    passages = split_passages(t, 2)
+    assert passages.shape == (2, 2, 3, 100)
+    for window in range(2):
+        assert torch.equal(passages[window], t[:, :, window * 100 : (window + 1) * 100])
+
+
+def test_hint_cpu_forward():
+    torch.manual_seed(0)
+    cfg = {"spatialGRU": 2, "LSTMdim": 6, "kmax": 2, "trainer": {"maxdoclen": 200, "maxqlen": 3, "batch": 4}}
+    model = HiNT_main(FakeExtractor(), cfg)
+
+    A = torch.randn(2, 3, 100, 3)
+    expected = torch.zeros_like(A)
+    for i in range(3):
+        for j in range(100):
+            expected[:, i, j, :] = A[:, 3 - i - 1, 99 - j, :]
+    assert torch.equal(model.HiNT1.matrix_inv(A), expected)
+
+    sentence = torch.randint(1, 20, (2, 200))
+    sentence[:, 150:] = 0
+    query_sentence = torch.randint(1, 20, (2, 3))
+    scores = model(sentence, query_sentence, torch.rand(2, 3))
+    assert scores.shape == (2,)
+    assert torch.isfinite(scores).all()
+
+
+def unfused_log_pool(kernel_bank, simmat):
+    """ KNRM's original kernel pooling, which materializes the (B, K, V, Q, D) kernel tensor """
+    kernels = kernel_bank(simmat)
+    BATCH, KERNELS, VIEWS, QLEN, DLEN = kernels.shape
+    kernels = kernels.reshape(BATCH, KERNELS * VIEWS, QLEN, DLEN)
+    simmat = (
+        simmat.reshape(BATCH, 1, VIEWS, QLEN, DLEN)
+        .expand(BATCH, KERNELS, VIEWS, QLEN, DLEN)
+        .reshape(BATCH, KERNELS * VIEWS, QLEN, DLEN)
+    )
+    result = kernels.sum(dim=3)
+    mask = simmat.sum(dim=3) != 0.0
+    result = torch.where(mask, (result + 1e-6).log(), mask.float())
+    return result.sum(dim=2)
+
+
+@pytest.mark.parametrize("doc_chunk", [7, 64, 1000])
+def test_rbf_kernel_bank_log_pool(doc_chunk):
+    mus = [-0.9, -0.7, -0.5, -0.3, -0.1, 0.1, 0.3, 0.5, 0.7, 0.9, 1.0]
+    sigmas = [0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.001]
+    kernel_bank = RbfKernelBank(mus, sigmas, dim=1, requires_grad=True, doc_chunk=doc_chunk)
+
+    torch.manual_seed(0)
+    simmat = torch.rand(2, 3, 4, 50) * 2 - 1
+    simmat[:, :, -1, :] = 0  # a padding query term
+    simmat[:, :, :, 40:] = 0  # padding doc terms
+    simmat.requires_grad_()
+
+    result = kernel_bank.log_pool(simmat)
+    expected = unfused_log_pool(kernel_bank, simmat)
+    assert result.shape == (2, 11 * 3)
+    assert torch.allclose(result, expected, atol=1e-4)
+
+    # checkpointing does not support torch.autograd.grad, so gradients are compared after calling backward
+    params = [simmat] + list(kernel_bank.parameters())
+    result.sum().backward()
+    grads = [param.grad.clone() for param in params]
+    for param in params:
+        param.grad = None
+    expected.sum().backward()
+    for grad, param in zip(grads, params):
+        assert torch.allclose(grad, param.grad, rtol=1e-3, atol=1e-3)
+
+    with torch.no_grad():
+        assert torch.allclose(kernel_bank.log_pool(simmat), expected, atol=1e-4)
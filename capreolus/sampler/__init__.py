@@ -9,13 +9,29 @@ from capreolus.utils.loginit import get_logger
 logger = get_logger(__name__)
 
 
+def get_worker_shard():
+    """ Return (worker id, number of workers) for the current DataLoader worker, or (0, 1) in the main process """
+    worker_info = torch.utils.data.get_worker_info()
+    if worker_info is None:
+        return 0, 1
+    return worker_info.id, worker_info.num_workers
+
+
 class TrainDataset(torch.utils.data.IterableDataset):
     """
     Samples training data. Intended to be used with a pytorch DataLoader
+
+    If batch_size is given and the extractor provides ids2batch, whole batches are built at once and the DataLoader
+    should be created with batch_size=None.
+
+    When used with several DataLoader workers, each worker samples from its own share of the qids. If seed is given,
+    each worker uses its own RNG seeded from it, so sampling is reproducible for a fixed number of workers.
     """
 
-    def __init__(self, qid_docid_to_rank, qrels, extractor):
+    def __init__(self, qid_docid_to_rank, qrels, extractor, batch_size=None, seed=None):
         self.extractor = extractor
+        self.batch_size = batch_size if hasattr(extractor, "ids2batch") else None
+        self.seed = seed
         self.iterations = 0
         self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
@@ -55,72 +71,141 @@ class TrainDataset(torch.utils.data.IterableDataset):
         else:
             logger.info(log)
 
-    def generator_func(self):
-        # Convert each query and doc id to the corresponding feature/embedding and yield
-        while True:
-            all_qids = sorted(self.qid_to_reldocs)
-            if len(all_qids) == 0:
-                raise RuntimeError("TrainDataset has no valid qids")
+    def sample_triples(self):
+        # sample (qid, posdocid, negdocid) training triples forever, visiting qids in a new random order each pass
+        worker_id, num_workers = get_worker_shard()
+        rng = random if self.seed is None else random.Random(self.seed + worker_id)
+
+        all_qids = sorted(self.qid_to_reldocs)
+        if len(all_qids) == 0:
+            raise RuntimeError("TrainDataset has no valid qids")
+
+        # workers sample from disjoint subsets of the qids, unless there are too few qids to go around
+        if len(all_qids) >= num_workers:
+            all_qids = all_qids[worker_id::num_workers]
 
-            random.shuffle(all_qids)
+        while True:
+            rng.shuffle(all_qids)
 
             for qid in all_qids:
-                posdocid = random.choice(self.qid_to_reldocs[qid])
-                negdocid = random.choice(self.qid_to_negdocs[qid])
+                posdocid = rng.choice(self.qid_to_reldocs[qid])
+                negdocid = rng.choice(self.qid_to_negdocs[qid])
+                yield qid, posdocid, negdocid
 
-                try:
-                    yield self.extractor.id2vec(qid, posdocid, negdocid)
-                except MissingDocError:
-                    # at training time we warn but ignore on missing docs
-                    logger.warning(
-                        "skipping training pair with missing features: qid=%s posid=%s negid=%s", qid, posdocid, negdocid
-                    )
+    def generator_func(self):
+        # Convert each query and doc id to the corresponding feature/embedding and yield
+        for qid, posdocid, negdocid in self.sample_triples():
+            try:
+                yield self.extractor.id2vec(qid, posdocid, negdocid)
+            except MissingDocError:
+                # at training time we warn but ignore on missing docs
+                logger.warning(
+                    "skipping training pair with missing features: qid=%s posid=%s negid=%s", qid, posdocid, negdocid
+                )
+
+    def batch_generator_func(self):
+        # Convert batch_size triples at a time to features and yield the whole batch
+        triples = []
+        for triple in self.sample_triples():
+            triples.append(triple)
+            if len(triples) < self.batch_size:
+                continue
+
+            qids, posdocids, negdocids = zip(*triples)
+            triples = []
+            try:
+                yield self.extractor.ids2batch(qids, posdocids, negdocids)
+            except MissingDocError as e:
+                # at training time we warn but ignore on missing docs
+                logger.warning(
+                    "skipping training batch with missing features: qid=%s docid=%s", e.related_qid, e.missed_docid
+                )
 
     def __iter__(self):
         """
         Returns: Triplets of the form (query_feature, posdoc_feature, negdoc_feature)
         """
 
+        if self.batch_size:
+            return iter(self.batch_generator_func())
         return iter(self.generator_func())
 
 
 class PredDataset(torch.utils.data.IterableDataset):
     """
     Creates a Dataset for evaluation (test) data to be used with a pytorch DataLoader
+
+    When used with several DataLoader workers, each worker yields the documents of its own share of the qids.
     """
 
-    def __init__(self, qid_docid_to_rank, extractor, qrels=None, mode="val"):
+    def __init__(self, qid_docid_to_rank, extractor, qrels=None, mode="val", batch_size=None):
         self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
         self.mode = mode  # val / test
+        self.batch_size = batch_size if hasattr(extractor, "ids2batch") else None
         if mode == "val" and not qrels:
             raise ValueError("qrels must be provide for validation data generator")
 
-        def genf():
-            for qid, docids in qid_docid_to_rank.items():
-                if mode == "val":
-                    if qid not in qrels:
-                        logger.warning(f"skipping query {qid} that was missing from the qrel")
-                        continue
+        # the docids to predict on for each qid, which also tells consumers how many predictions to expect per query.
+        # when validating, queries that cannot be evaluated and docs that are missing from the extractor are skipped.
+        self.qid_to_docids = {}
+        for qid, docids in qid_docid_to_rank.items():
+            if mode == "val":
+                if qid not in qrels:
+                    logger.warning(f"skipping query {qid} that was missing from the qrel")
+                    continue
 
-                    posdocs = [docid for docid in docids if qrels[qid].get(docid, 0) > 0 and extractor.has_doc(docid)]
-                    negdocs = [docid for docid in docids if qrels[qid].get(docid, 0) == 0 and extractor.has_doc(docid)]
+                posdocs = [docid for docid in docids if qrels[qid].get(docid, 0) > 0 and extractor.has_doc(docid)]
+                negdocs = [docid for docid in docids if qrels[qid].get(docid, 0) == 0 and extractor.has_doc(docid)]
 
-                    if len(posdocs) == 0 or len(negdocs) == 0:
-                        logger.warning("removing validation qid=%s with %s positive docs and %s negative docs", qid,
-                                       len(posdocs), len(negdocs))
-                        continue
+                if len(posdocs) == 0 or len(negdocs) == 0:
+                    logger.warning("removing validation qid=%s with %s positive docs and %s negative docs", qid,
+                                   len(posdocs), len(negdocs))
+                    continue
 
                 for docid in docids:
-                    try:
-                        yield extractor.id2vec(qid, docid)
-                    except MissingDocError:
-                        # when predictiong we raise an exception on missing docs, as this may invalidate results
-                        if mode == "test":
-                            logger.error("got none features for prediction: qid=%s posid=%s", qid, docid)
-                            raise
+                    if not extractor.has_doc(docid):
                         logger.warning("got none features for prediction: qid=%s posid=%s", qid, docid)
+                docids = [docid for docid in docids if extractor.has_doc(docid)]
+
+            self.qid_to_docids[qid] = list(docids)
+
+        def pairs():
+            worker_id, num_workers = get_worker_shard()
+            for qidx, (qid, docids) in enumerate(self.qid_to_docids.items()):
+                if qidx % num_workers != worker_id:
+                    continue
 
-        self.generator_func = genf
+                for docid in docids:
+                    yield qid, docid
+
+        def genf():
+            for qid, docid in pairs():
+                try:
+                    yield extractor.id2vec(qid, docid)
+                except MissingDocError:
+                    # when predictiong we raise an exception on missing docs, as this may invalidate results
+                    if mode == "test":
+                        logger.error("got none features for prediction: qid=%s posid=%s", qid, docid)
+                        raise
+                    logger.warning("got none features for prediction: qid=%s posid=%s", qid, docid)
+
+        def batch_genf():
+            batch = []
+            for qid, docid in pairs():
+                # when predictiong we raise an exception on missing docs, as this may invalidate results
+                if not extractor.has_doc(docid):
+                    logger.error("got none features for prediction: qid=%s posid=%s", qid, docid)
+                    raise MissingDocError(qid, docid)
+
+                batch.append((qid, docid))
+                if len(batch) == self.batch_size:
+                    yield extractor.ids2batch(*zip(*batch))
+                    batch = []
+
+            if batch:
+                yield extractor.ids2batch(*zip(*batch))
+
+        self.generator_func = batch_genf if self.batch_size else genf
 
     def __iter__(self):
         """
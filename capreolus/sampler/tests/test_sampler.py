@@ -3,6 +3,8 @@ import torch
 import torch.utils.data
 import numpy as np
 
+import capreolus.sampler
+
 from capreolus.benchmark import DummyBenchmark
 from capreolus.extractor import EmbedText
 from capreolus.sampler import TrainDataset, PredDataset
@@ -55,3 +57,103 @@ def test_pred_sampler(monkeypatch, tmpdir):
         assert np.array_equal(batch["query"][1], np.array([1, 2, 3, 4]))
         assert np.array_equal(batch["posdoc"][0], np.array([1, 1, 1, 1]))
         assert np.array_equal(batch["posdoc"][1], np.array([1, 1, 1, 1]))
+
+
+def test_train_sampler_batches(monkeypatch, tmpdir):
+    benchmark = DummyBenchmark({"fold": "s1", "rundocsonly": True})
+    extractor = EmbedText({"keepstops": True})
+    monkeypatch.setattr(EmbedText, "has_doc", lambda self, docid: True)
+    training_judgments = benchmark.qrels.copy()
+    train_dataset = TrainDataset(training_judgments, training_judgments, extractor, batch_size=8)
+
+    def mock_ids2batch(self, qids, posids, negids):
+        assert len(qids) == len(posids) == len(negids) == 8
+        return {"query": np.ones((8, 4)), "posdoc": np.ones((8, 4)), "negdoc": np.zeros((8, 4)), "qid": list(qids)}
+
+    monkeypatch.setattr(EmbedText, "ids2batch", mock_ids2batch)
+    dataloader = torch.utils.data.DataLoader(train_dataset, batch_size=None)
+    for idx, batch in enumerate(dataloader):
+        assert batch["query"].shape == (8, 4)
+        assert batch["negdoc"].shape == (8, 4)
+        assert batch["qid"] == ["301"] * 8
+
+        if idx > 3:
+            break
+
+
+def test_pred_sampler_batches(monkeypatch, tmpdir):
+    search_run = {"301": {"LA010189-0001": 50, "LA010189-0002": 100, "LA010189-0003": 10}}
+    extractor = EmbedText({"keepstops": True})
+    pred_dataset = PredDataset(search_run, extractor, mode="test", batch_size=2)
+
+    def mock_ids2batch(self, qids, posids):
+        return {"query": np.ones((len(qids), 4)), "posdoc": np.ones((len(qids), 4)), "posdocid": list(posids)}
+
+    monkeypatch.setattr(EmbedText, "has_doc", lambda self, docid: True)
+    monkeypatch.setattr(EmbedText, "ids2batch", mock_ids2batch)
+    batches = list(torch.utils.data.DataLoader(pred_dataset, batch_size=None))
+    assert [batch["posdocid"] for batch in batches] == [["LA010189-0001", "LA010189-0002"], ["LA010189-0003"]]
+
+
+def sharding_qrels(nqids=10):
+    return {str(qid): {f"{qid}-rel": 1, f"{qid}-nonrel": 0} for qid in range(nqids)}
+
+
+def test_train_sampler_worker_shards(monkeypatch):
+    qrels = sharding_qrels()
+    extractor = EmbedText({"keepstops": True})
+    monkeypatch.setattr(EmbedText, "has_doc", lambda self, docid: True)
+    train_dataset = TrainDataset(qrels, qrels, extractor, seed=123)
+
+    num_workers = 3
+    shard_qids = []
+    for worker_id in range(num_workers):
+        monkeypatch.setattr(capreolus.sampler, "get_worker_shard", lambda: (worker_id, num_workers))
+        triples = train_dataset.sample_triples()
+        # each pass over a worker's shard visits each of its qids once
+        first_pass = [next(triples)[0] for _ in range(len(range(worker_id, len(qrels), num_workers)))]
+        assert len(first_pass) == len(set(first_pass))
+        shard_qids.append(set(first_pass))
+
+    assert sorted(qid for qids in shard_qids for qid in qids) == sorted(qrels)
+
+
+def test_pred_sampler_worker_shards(monkeypatch):
+    qrels = sharding_qrels()
+    extractor = EmbedText({"keepstops": True})
+    monkeypatch.setattr(EmbedText, "has_doc", lambda self, docid: True)
+    monkeypatch.setattr(EmbedText, "id2vec", lambda self, qid, docid: {"qid": qid, "posdocid": docid})
+    pred_dataset = PredDataset(qrels, extractor, mode="test")
+
+    num_workers = 3
+    pairs = []
+    for worker_id in range(num_workers):
+        monkeypatch.setattr(capreolus.sampler, "get_worker_shard", lambda: (worker_id, num_workers))
+        pairs.extend((instance["qid"], instance["posdocid"]) for instance in pred_dataset)
+
+    # every (qid, docid) pair is predicted by exactly one worker
+    assert sorted(pairs) == sorted((qid, docid) for qid, docids in qrels.items() for docid in docids)
+
+
+def test_train_sampler_worker_seeding(monkeypatch):
+    qrels = sharding_qrels()
+    extractor = EmbedText({"keepstops": True})
+    monkeypatch.setattr(EmbedText, "has_doc", lambda self, docid: True)
+
+    def mock_ids2batch(self, qids, posids, negids):
+        return {"query": np.ones((len(qids), 4)), "qid": list(qids), "posdocid": list(posids)}
+
+    monkeypatch.setattr(EmbedText, "ids2batch", mock_ids2batch)
+
+    def sample_batches(seed, num_workers=2, nbatches=8):
+        train_dataset = TrainDataset(qrels, qrels, extractor, batch_size=4, seed=seed)
+        dataloader = torch.utils.data.DataLoader(train_dataset, batch_size=None, num_workers=num_workers)
+        batches = []
+        for batch in dataloader:
+            batches.append(list(zip(batch["qid"], batch["posdocid"])))
+            if len(batches) == nbatches:
+                break
+        return batches
+
+    assert sample_batches(seed=123) == sample_batches(seed=123)
+    assert sample_batches(seed=123) != sample_batches(seed=456)
@@ -1,13 +1,16 @@
 import os
-import subprocess
-from collections import defaultdict, OrderedDict
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
-from pyserini.search import pysearch
 from capreolus.registry import ModuleBase, RegisterableModule, Dependency, MAX_THREADS, PACKAGE_PATH
 from capreolus.utils.common import Anserini
+from capreolus.utils.jvm import heap_size, jvm_threads, run_java
 from capreolus.utils.loginit import get_logger
+from capreolus.tokenizer import AnseriniTokenizer
+from capreolus.utils.trec import load_binary_run, load_trec_topics, parse_trec_run, write_binary_run
 
 logger = get_logger(__name__)  # pylint: disable=invalid-name
 
@@ -20,22 +23,22 @@ class Searcher(ModuleBase, metaclass=RegisterableModule):
     """the module base class"""
 
     module_type = "searcher"
+    cache_instances = True
 
     @staticmethod
     def load_trec_run(fn):
-        run = defaultdict(dict)
-        with open(fn, "rt") as f:
-            for line in f:
-                line = line.strip()
-                if len(line) > 0:
-                    qid, _, docid, rank, score, desc = line.split(" ")
-                    run[qid][docid] = float(score)
-        return run
+        return parse_trec_run(fn)
 
     @staticmethod
-    def write_trec_run(preds, outfn):
+    def load_binary_run(fn):
+        """ Load the TREC run `fn` as a memory-mapped BinaryRun, creating the binary version on first read """
+        return load_binary_run(fn)
+
+    @staticmethod
+    def write_trec_run(preds, outfn, mode="wt"):
+        """ Write `preds` to `outfn` in TREC format. Use mode="at" to append to an existing run file. """
         count = 0
-        with open(outfn, "wt") as outf:
+        with open(outfn, mode) as outf:
             for qid in sorted(preds):
                 rank = 1
                 for docid, score in sorted(preds[qid].items(), key=lambda x: x[1], reverse=True):
@@ -43,23 +46,223 @@ class Searcher(ModuleBase, metaclass=RegisterableModule):
                     rank += 1
                     count += 1
 
+    @staticmethod
+    def convert_trec_runs(run_dir):
+        """ Create binary versions of the TREC runs in `run_dir`, so that later reads do not need to parse them """
+        for fn in os.listdir(run_dir):
+            runfn = os.path.join(run_dir, fn)
+            if fn != "done" and not os.path.isdir(runfn):
+                load_binary_run(runfn)
+
+    def _is_done(self, donefn):
+        """ Return whether `donefn` marks runs searched on the current version of the index """
+        if not os.path.exists(donefn):
+            return False
+
+        with open(donefn, "rt") as f:
+            return f.read().strip() == self["index"].get_index_version()
+
+    def _write_done(self, donefn):
+        # the index version changes when the index is updated, which makes the runs stale
+        with open(donefn, "wt") as donef:
+            print(self["index"].get_index_version(), file=donef)
+
+
+class PooledSearcher:
+    """ A pyserini SimpleSearcher that is kept open for an index path and shared by all Searcher modules using that index.
+        The similarity and RM3 settings are applied on every call while holding a lock, so modules with different
+        parameters can safely share it. Searchers with and without RM3 are pooled separately, so that an RM3 reranker
+        set by one module can never affect queries from a module without RM3. """
+
+    def __init__(self, index_path, rm3=False):
+        from pyserini.search import pysearch
+
+        self.searcher = pysearch.SimpleSearcher(index_path)
+        self.rm3 = rm3
+        self.lock = threading.Lock()
+
+    def _configure(self, bm25=None, qld=None, rm3=None):
+        if (rm3 is not None) != self.rm3:
+            raise ValueError(f"this searcher was pooled with rm3={self.rm3}; use get_pooled_searcher(..., rm3={not self.rm3})")
+
+        if bm25 is not None:
+            self.searcher.set_bm25_similarity(*bm25)
+        elif qld is not None:
+            self.searcher.set_lm_dirichlet_similarity(qld)
+
+        if rm3 is not None:
+            self.searcher.set_rm3_reranker(**rm3)
+
+    def search(self, query, k=10, **similarity):
+        """ Return an OrderedDict {docid: score} with the top k documents for query. `similarity` contains one of
+            bm25=(k1, b) or qld=mu and optionally rm3={"fb_terms": .., "fb_docs": .., "original_query_weight": ..} """
+        with self.lock:
+            self._configure(**similarity)
+            hits = self.searcher.search(query, k)
+        return OrderedDict({hit.docid: hit.score for hit in hits})
+
+    def batch_search(self, queries, k=10, threads=MAX_THREADS, **similarity):
+        """ Search for every query in the dict `queries` ({qid: query}) and return {qid: OrderedDict({docid: score})} """
+        qids = list(queries)
+        with self.lock:
+            self._configure(**similarity)
+            if hasattr(self.searcher, "batch_search"):
+                qid2hits = self.searcher.batch_search([queries[qid] for qid in qids], qids, k, threads)
+            else:
+                # older pyserini releases have no batch search, but we still avoid reopening the index
+                qid2hits = {qid: self.searcher.search(queries[qid], k) for qid in qids}
+
+        return {qid: OrderedDict({hit.docid: hit.score for hit in qid2hits[qid]}) for qid in qids}
+
+    def close(self):
+        if hasattr(self.searcher, "close"):
+            self.searcher.close()
+
+
+_searcher_pool = {}
+_searcher_pool_lock = threading.Lock()
+
+
+def get_pooled_searcher(index_path, rm3=False):
+    """ Return the PooledSearcher for index_path (with or without RM3), opening the index the first time it is requested """
+    key = (str(index_path), rm3)
+    with _searcher_pool_lock:
+        if key not in _searcher_pool:
+            _searcher_pool[key] = PooledSearcher(*key)
+        return _searcher_pool[key]
+
+
+def close_pooled_searchers(index_path=None):
+    """ Close the pooled searchers for index_path (or all pooled searchers), e.g. after an index is updated """
+    with _searcher_pool_lock:
+        for key in list(_searcher_pool):
+            if index_path is None or key[0] == str(index_path):
+                _searcher_pool.pop(key).close()
+
+
+# set CAPREOLUS_ANSERINI_SUBPROCESS=1 to search with SearchCollection in a separate JVM rather than in this process
+ANSERINI_SUBPROCESS = os.environ.get("CAPREOLUS_ANSERINI_SUBPROCESS", "0") == "1"
+_search_collection_lock = threading.Lock()
+_searcher_jobs = threading.local()
+
+
+def run_searcher_jobs(jobs, max_workers=MAX_THREADS):
+    """ Run searcher.query_from_file(topicsfn, output_path) for each (searcher, topicsfn, output_path) tuple in `jobs`
+        concurrently. Anserini searches run in separate JVMs, and the JVM memory budget (see capreolus.utils.jvm)
+        limits how many of them run at once. Returns the output paths in the order of `jobs`. """
+
+    def run_job(job):
+        searcher, topicsfn, output_path = job
+        _searcher_jobs.use_subprocess = True
+        return searcher.query_from_file(topicsfn, output_path)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run_job, jobs))
+
+
+def run_search_collection(args):
+    """ Run Anserini's SearchCollection with the command line arguments `args` in this process's JVM, which skips the
+        JVM startup of launching a JVM per run. SearchCollection opens (and closes) its own reader of the index on
+        every run, since it cannot be given one; searchers use it only for indexes the pooled searchers cannot search. """
+    from jnius import autoclass, JavaException
+
+    JSearchArgs = autoclass("io.anserini.search.SearchArgs")
+    JCmdLineParser = autoclass("org.kohsuke.args4j.CmdLineParser")
+    JSearchCollection = autoclass("io.anserini.search.SearchCollection")
+
+    logger.debug("SearchCollection %s", " ".join(args))
+    with _search_collection_lock:
+        try:
+            search_args = JSearchArgs()
+            JCmdLineParser(search_args).parseArgument(args)
+            search_collection = JSearchCollection(search_args)
+            try:
+                search_collection.runTopics()
+            finally:
+                search_collection.close()
+        except JavaException as e:
+            raise RuntimeError(f"SearchCollection failed: {e}") from e
+
+
+def write_anserini_run(run, runfn):
+    """ Write `run` ({qid: OrderedDict({docid: score})} in rank order) to `runfn` in the format of SearchCollection """
+    with open(runfn, "wt") as outf:
+        for qid, docs in run.items():
+            for rank, (docid, score) in enumerate(docs.items(), start=1):
+                print(f"{qid} Q0 {docid} {rank} {score:.6f} Anserini", file=outf)
+
 
 class AnseriniSearcherMixIn:
-    """ MixIn for searchers that use Anserini's SearchCollection script """
+    """ MixIn for searchers that search an Anserini index. Runs are searched with the PooledSearcher kept open for
+        the index, or with Anserini's SearchCollection if the pooled searcher cannot analyze queries like the index. """
+
+    def _search_collection_subprocess(self, search_args):
+        anserini_fat_jar = Anserini.get_fat_jar()
+        args = f"-classpath {anserini_fat_jar} -Dapp.name=SearchCollection io.anserini.search.SearchCollection {search_args}"
+        heap = heap_size("searcher", self["index"].get_index_path())
+
+        # Anserini output is verbose, so ignore DEBUG log lines and send other output through our logger
+        run_java(args.split(), heap, lambda line: Anserini.filter_and_log_anserini_output(line, logger))
 
-    def _anserini_query_from_file(self, topicsfn, anserini_param_str, output_base_path):
+    def _pooled_searcher(self, rm3=False):
+        self["index"].create_index()
+        return get_pooled_searcher(self["index"].get_index_path().as_posix(), rm3=rm3)
+
+    @staticmethod
+    def _anserini_runs(similarities, rm3s=None):
+        """ Combine `similarities` ({tag: bm25 or qld setting}) with the optional `rm3s` ({tag: rm3 setting}) into
+            {run name: search settings}, where runs are named like SearchCollection names its output files """
+        rm3s = rm3s or {None: None}
+        runs = {}
+        for sim_tag, similarity in similarities.items():
+            for rm3_tag, rm3 in rm3s.items():
+                name = "searcher"
+                if len(similarities) > 1:
+                    name += f"_{sim_tag}"
+                if len(rm3s) > 1:
+                    name += f"_{rm3_tag}"
+                runs[name] = dict(similarity, rm3=rm3) if rm3 else dict(similarity)
+
+        return runs
+
+    def _pooled_search_supported(self):
+        # pyserini's SimpleSearcher analyzes queries with Lucene's EnglishAnalyzer (Porter stemming, stopwords removed)
+        return self["index"].cfg["stemmer"] == "porter" and not self["index"].cfg["indexstops"]
+
+    def _pooled_query_from_file(self, topicsfn, runs, output_base_path):
+        """ Search for the topics with each of the search settings in `runs` ({run name: settings}), using the pooled
+            searcher that keeps the index open across calls and searcher modules """
+        qid2query = load_trec_topics(topicsfn)["title"]
+        threads = jvm_threads("searcher")
+        logger.info("writing %s runs to %s", len(runs), output_base_path)
+        for run_name, settings in runs.items():
+            searcher = self._pooled_searcher(rm3="rm3" in settings)
+            run = searcher.batch_search(qid2query, self.cfg["hits"], threads, **settings)
+            runfn = os.path.join(output_base_path, run_name)
+            write_anserini_run(run, runfn)
+            write_binary_run(run, runfn)
+
+    def _anserini_query_from_file(self, topicsfn, anserini_param_str, output_base_path, runs):
+        """ Write the runs for the search settings in `runs` ({run name: settings}), which `anserini_param_str`
+            describes as SearchCollection arguments """
         if not os.path.exists(topicsfn):
             raise IOError(f"could not find topics file: {topicsfn}")
 
         donefn = os.path.join(output_base_path, "done")
-        if os.path.exists(donefn):
-            logger.debug(f"skipping Anserini SearchCollection call because path already exists: {donefn}")
+        if self._is_done(donefn):
+            logger.debug(f"skipping Anserini search because path already exists: {donefn}")
             return
 
         # create index if it does not exist. the call returns immediately if the index does exist.
         self["index"].create_index()
 
         os.makedirs(output_base_path, exist_ok=True)
+        use_subprocess = ANSERINI_SUBPROCESS or getattr(_searcher_jobs, "use_subprocess", False)
+        if not use_subprocess and self._pooled_search_supported():
+            self._pooled_query_from_file(topicsfn, runs, output_base_path)
+            self._write_done(donefn)
+            return
+
         output_path = os.path.join(output_base_path, "searcher")
 
         # add stemmer and stop options to match underlying index
@@ -68,23 +271,54 @@ class AnseriniSearcherMixIn:
             indexopts += " -keepstopwords"
 
         index_path = self["index"].get_index_path()
-        anserini_fat_jar = Anserini.get_fat_jar()
-        cmd = f"java -classpath {anserini_fat_jar} -Xms512M -Xmx31G -Dapp.name=SearchCollection io.anserini.search.SearchCollection -topicreader Trec -index {index_path} {indexopts} -topics {topicsfn} -output {output_path} -inmem -threads {MAX_THREADS} {anserini_param_str}"
+        search_args = f"-topicreader Trec -index {index_path} {indexopts} -topics {topicsfn} -output {output_path} -inmem -threads {jvm_threads('searcher')} {anserini_param_str}"
         logger.info("Anserini writing runs to %s", output_path)
-        logger.debug(cmd)
 
-        app = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, universal_newlines=True)
+        if use_subprocess:
+            self._search_collection_subprocess(search_args)
+        else:
+            run_search_collection(search_args.split())
 
-        # Anserini output is verbose, so ignore DEBUG log lines and send other output through our logger
-        for line in app.stdout:
-            Anserini.filter_and_log_anserini_output(line, logger)
+        Searcher.convert_trec_runs(output_base_path)
+        self._write_done(donefn)
 
-        app.wait()
-        if app.returncode != 0:
-            raise RuntimeError("command failed")
 
-        with open(donefn, "wt") as donef:
-            print("done", file=donef)
+class PostingsSearcherMixIn:
+    """ MixIn for searchers that score queries with numpy over a PostingsSnapshot exported from the index once,
+        rather than with Anserini. This makes sweeping over many parameter settings cheap. """
+
+    def _query_postings(self, qid2query):
+        """ Return a {qid: QueryPostings} dict for the queries in `qid2query`, analyzed like the index's documents """
+        index_cfg = self["index"].cfg
+        tokenizer_cfg = {"_name": "anserini", "stemmer": index_cfg["stemmer"], "keepstops": index_cfg["indexstops"]}
+        tokenizer = AnseriniTokenizer(tokenizer_cfg)
+        qid2terms = {qid: tokenizer.tokenize(query) for qid, query in qid2query.items()}
+
+        snapshot = self["index"].get_postings_snapshot(term for terms in qid2terms.values() for term in terms)
+        return {qid: snapshot.query_postings(terms) for qid, terms in qid2terms.items()}
+
+    def _postings_query_from_file(self, topicsfn, run_scorers, output_base_path):
+        """ Write one run per entry in the dict `run_scorers`, which maps run file names to functions returning the
+            document scores for a QueryPostings """
+        donefn = os.path.join(output_base_path, "done")
+        if self._is_done(donefn):
+            logger.debug(f"skipping postings search because path already exists: {donefn}")
+            return
+
+        qid2postings = self._query_postings(load_trec_topics(topicsfn)["title"])
+        os.makedirs(output_base_path, exist_ok=True)
+        logger.info("writing %s runs to %s", len(run_scorers), output_base_path)
+        for run_name, scorer in run_scorers.items():
+            run = {qid: postings.topk(scorer(postings), self.cfg["hits"]) for qid, postings in qid2postings.items()}
+            runfn = os.path.join(output_base_path, run_name)
+            Searcher.write_trec_run(run, runfn)
+            write_binary_run(run, runfn)
+
+        self._write_done(donefn)
+
+    def _postings_query(self, query, scorer):
+        postings = self._query_postings({"query": query})["query"]
+        return OrderedDict(postings.topk(scorer(postings), self.cfg["hits"]))
 
 
 class BM25(Searcher, AnseriniSearcherMixIn):
@@ -115,17 +349,17 @@ class BM25(Searcher, AnseriniSearcherMixIn):
         k1str = " ".join(str(x) for x in k1s)
         hits = self.cfg["hits"]
         anserini_param_str = f"-bm25 -b {bstr} -k1 {k1str} -hits {hits}"
-        self._anserini_query_from_file(topicsfn, anserini_param_str, output_path)
+        runs = self._anserini_runs({f"k1={k1},b={b}": {"bm25": (float(k1), float(b))} for k1 in k1s for b in bs})
+        self._anserini_query_from_file(topicsfn, anserini_param_str, output_path, runs)
 
         return output_path
 
     def query(self, query):
-        self["index"].create_index()
-        searcher = pysearch.SimpleSearcher(self["index"].get_index_path().as_posix())
-        searcher.set_bm25_similarity(self.cfg["k1"], self.cfg["b"])
+        return self._pooled_searcher().search(query, bm25=(self.cfg["k1"], self.cfg["b"]))
 
-        hits = searcher.search(query)
-        return OrderedDict({hit.docid: hit.score for hit in hits})
+    def batch_query(self, queries, k=None, threads=MAX_THREADS):
+        """ Search for every query in the dict `queries` ({qid: query}), returning the top k (default: hits) docs per qid """
+        return self._pooled_searcher().batch_search(queries, k or self.cfg["hits"], threads, bm25=(self.cfg["k1"], self.cfg["b"]))
 
 
 class BM25Grid(Searcher, AnseriniSearcherMixIn):
@@ -147,18 +381,18 @@ class BM25Grid(Searcher, AnseriniSearcherMixIn):
         k1str = " ".join(str(x) for x in k1s)
         hits = self.cfg["hits"]
         anserini_param_str = f"-bm25 -b {bstr} -k1 {k1str} -hits {hits}"
+        runs = self._anserini_runs({f"k1={k1},b={b}": {"bm25": (float(k1), float(b))} for k1 in k1s for b in bs})
 
-        self._anserini_query_from_file(topicsfn, anserini_param_str, output_path)
+        self._anserini_query_from_file(topicsfn, anserini_param_str, output_path, runs)
 
         return output_path
 
     def query(self, query, b, k1):
-        self["index"].create_index()
-        searcher = pysearch.SimpleSearcher(self["index"].get_index_path().as_posix())
-        searcher.set_bm25_similarity(k1, b)
+        return self._pooled_searcher().search(query, bm25=(k1, b))
 
-        hits = searcher.search(query)
-        return OrderedDict({hit.docid: hit.score for hit in hits})
+    def batch_query(self, queries, b, k1, k=None, threads=MAX_THREADS):
+        """ Search for every query in the dict `queries` ({qid: query}), returning the top k (default: hits) docs per qid """
+        return self._pooled_searcher().batch_search(queries, k or self.cfg["hits"], threads, bm25=(k1, b))
 
 
 class BM25RM3(Searcher, AnseriniSearcherMixIn):
@@ -187,18 +421,32 @@ class BM25RM3(Searcher, AnseriniSearcherMixIn):
             + " ".join(f"-{k} {paras[k]}" for k in ["k1", "b"])
             + f" -hits {hits}"
         )
-        self._anserini_query_from_file(topicsfn, anserini_param_str, output_path)
+
+        values = {k: self.cfg[k].split("-") for k in paras}
+        similarities = {f"k1={k1},b={b}": {"bm25": (float(k1), float(b))} for k1 in values["k1"] for b in values["b"]}
+        rm3s = {
+            f"fbTerms:{terms},fbDocs:{docs},originalQueryWeight:{ow}": {
+                "fb_terms": int(terms),
+                "fb_docs": int(docs),
+                "original_query_weight": float(ow),
+            }
+            for terms in values["fbTerms"]
+            for docs in values["fbDocs"]
+            for ow in values["originalQueryWeight"]
+        }
+        runs = self._anserini_runs(similarities, rm3s)
+        self._anserini_query_from_file(topicsfn, anserini_param_str, output_path, runs)
 
         return output_path
 
     def query(self, query, b, k1, fbterms, fbdocs, ow):
-        self["index"].create_index()
-        searcher = pysearch.SimpleSearcher(self["index"].get_index_path().as_posix())
-        searcher.set_bm25_similarity(k1, b)
-        searcher.set_rm3_reranker(fb_terms=fbterms, fb_docs=fbdocs, original_query_weight=ow)
+        rm3 = {"fb_terms": fbterms, "fb_docs": fbdocs, "original_query_weight": ow}
+        return self._pooled_searcher(rm3=True).search(query, bm25=(k1, b), rm3=rm3)
 
-        hits = searcher.search(query)
-        return OrderedDict({hit.docid: hit.score for hit in hits})
+    def batch_query(self, queries, b, k1, fbterms, fbdocs, ow, k=None, threads=MAX_THREADS):
+        """ Search for every query in the dict `queries` ({qid: query}), returning the top k (default: hits) docs per qid """
+        rm3 = {"fb_terms": fbterms, "fb_docs": fbdocs, "original_query_weight": ow}
+        return self._pooled_searcher(rm3=True).batch_search(queries, k or self.cfg["hits"], threads, bm25=(k1, b), rm3=rm3)
 
 
 class StaticBM25RM3Rob04Yang19(Searcher):
@@ -247,14 +495,63 @@ class DirichletQL(Searcher, AnseriniSearcherMixIn):
         mustr = " ".join(str(x) for x in mus)
         hits = self.cfg["hits"]
         anserini_param_str = f"-qld -mu {mustr} -hits {hits}"
-        self._anserini_query_from_file(topicsfn, anserini_param_str, output_path)
+        runs = self._anserini_runs({f"mu={mu}": {"qld": float(mu)} for mu in mus})
+        self._anserini_query_from_file(topicsfn, anserini_param_str, output_path, runs)
 
         return output_path
 
     def query(self, query):
-        self["index"].create_index()
-        searcher = pysearch.SimpleSearcher(self["index"].get_index_path().as_posix())
-        searcher.set_lm_dirichlet_similarity(self.cfg["mu"])
+        return self._pooled_searcher().search(query, qld=self.cfg["mu"])
 
-        hits = searcher.search(query)
-        return OrderedDict({hit.docid: hit.score for hit in hits})
+    def batch_query(self, queries, k=None, threads=MAX_THREADS):
+        """ Search for every query in the dict `queries` ({qid: query}), returning the top k (default: hits) docs per qid """
+        return self._pooled_searcher().batch_search(queries, k or self.cfg["hits"], threads, qld=self.cfg["mu"])
+
+
+class BM25PostingsGrid(Searcher, PostingsSearcherMixIn):
+    """ BM25 with a grid search for k1 and b like BM25Grid, but scored with numpy over postings exported from the index.
+        Scores follow Lucene's BM25, so the runs match BM25Grid's up to the order of tied documents. """
+
+    name = "BM25PostingsGrid"
+    dependencies = {"index": Dependency(module="index", name="anserini")}
+
+    @staticmethod
+    def config():
+        k1max = 1.0  # maximum k1 value to include in grid search (starting at 0.1)
+        bmax = 1.0  # maximum b value to include in grid search (starting at 0.1)
+        hits = 1000
+
+    def query_from_file(self, topicsfn, output_path):
+        bs = np.around(np.arange(0.1, self.cfg["bmax"] + 0.1, 0.1), 1)
+        k1s = np.around(np.arange(0.1, self.cfg["k1max"] + 0.1, 0.1), 1)
+        run_scorers = {
+            f"searcher_k1={k1},b={b}": (lambda postings, k1=k1, b=b: postings.bm25(k1, b)) for k1 in k1s for b in bs
+        }
+        self._postings_query_from_file(topicsfn, run_scorers, output_path)
+
+        return output_path
+
+    def query(self, query, b, k1):
+        return self._postings_query(query, lambda postings: postings.bm25(k1, b))
+
+
+class DirichletQLPostingsGrid(Searcher, PostingsSearcherMixIn):
+    """ Dirichlet QL with a grid search over mu, scored with numpy over postings exported from the index """
+
+    name = "DirichletQLPostingsGrid"
+    dependencies = {"index": Dependency(module="index", name="anserini")}
+
+    @staticmethod
+    def config():
+        mu = list2str([500, 1000, 1500, 2000, 2500, 3000])  # mu smoothing parameters to search, concatenated with '-'
+        hits = 1000
+
+    def query_from_file(self, topicsfn, output_path):
+        mus = str(self.cfg["mu"]).split("-")
+        run_scorers = {f"searcher_mu={mu}": (lambda postings, mu=float(mu): postings.dirichlet(mu)) for mu in mus}
+        self._postings_query_from_file(topicsfn, run_scorers, output_path)
+
+        return output_path
+
+    def query(self, query, mu):
+        return self._postings_query(query, lambda postings: postings.dirichlet(mu))
@@ -1,10 +1,15 @@
 import os
+import pathlib
+from collections import OrderedDict
+
 import numpy as np
 import pytest
 from sacred.config import ConfigScope
 
 from capreolus.benchmark import DummyBenchmark
-from capreolus.searcher import BM25, BM25Grid
+from capreolus.index import AnseriniIndex
+from capreolus import searcher as searcher_module
+from capreolus.searcher import BM25, BM25Grid, BM25PostingsGrid, BM25RM3
 from capreolus.tests.common_fixtures import tmpdir_as_cache, dummy_index
 
 
@@ -41,3 +46,144 @@ def test_searcher_bm25_grid(tmpdir_as_cache, tmpdir, dummy_index):
         for b in bs:
             assert os.path.exists(os.path.join(output_fn, "searcher_k1={0},b={1}".format(k1, b)))
     assert os.path.exists(os.path.join(output_fn, "done"))
+
+
+def test_searcher_bm25_batch_query(tmpdir_as_cache, tmpdir, dummy_index):
+    searcher_config = ConfigScope(BM25.config)()
+    searcher_config["_name"] = BM25.name
+    searcher = BM25(searcher_config)
+    searcher.modules["index"] = dummy_index
+
+    results = searcher.batch_query({"301": "dummy doc", "302": "dummy"}, k=2, threads=2)
+    assert set(results) == {"301", "302"}
+    assert results["301"] == searcher.query("dummy doc")
+    assert list(results["301"]) == ["LA010189-0001", "LA010189-0002"]
+
+    # the same open searcher is reused for later calls
+    assert searcher._pooled_searcher() is searcher._pooled_searcher()
+
+
+def test_searcher_bm25_after_rm3_query(tmpdir_as_cache, tmpdir, dummy_index):
+    from pyserini.search import pysearch
+
+    rm3_config = ConfigScope(BM25RM3.config)()
+    rm3_config["_name"] = BM25RM3.name
+    rm3_searcher = BM25RM3(rm3_config)
+    rm3_searcher.modules["index"] = dummy_index
+
+    searcher_config = ConfigScope(BM25.config)()
+    searcher_config["_name"] = BM25.name
+    searcher = BM25(searcher_config)
+    searcher.modules["index"] = dummy_index
+
+    rm3_searcher.query("dummy doc", b=0.4, k1=0.9, fbterms=10, fbdocs=1, ow=0.5)
+    results = searcher.query("dummy doc")
+
+    # the BM25 query must not be expanded with RM3 by the searcher used for the previous query
+    fresh_searcher = pysearch.SimpleSearcher(dummy_index.get_index_path().as_posix())
+    fresh_searcher.set_bm25_similarity(searcher.cfg["k1"], searcher.cfg["b"])
+    expected = {hit.docid: hit.score for hit in fresh_searcher.search("dummy doc", 10)}
+    assert results == expected
+    assert searcher._pooled_searcher() is not rm3_searcher._pooled_searcher(rm3=True)
+
+
+def test_searcher_bm25_postings_grid(tmpdir_as_cache, tmpdir, dummy_index):
+    searcher_config = ConfigScope(BM25PostingsGrid.config)()
+    searcher_config["_name"] = BM25PostingsGrid.name
+    searcher = BM25PostingsGrid(searcher_config)
+    searcher.modules["index"] = dummy_index
+    topics_fn = DummyBenchmark.topic_file
+
+    output_fn = searcher.query_from_file(topics_fn, os.path.join(searcher.get_cache_path(), DummyBenchmark.name))
+    assert os.path.exists(os.path.join(output_fn, "done"))
+
+    # scores should match Anserini's BM25 run for k1=0.9,b=0.4 (see test_searcher_bm25)
+    results = searcher.query("Dummy doc", b=0.4, k1=0.9)
+    assert list(results) == ["LA010189-0001", "LA010189-0002"]
+    assert np.allclose(list(results.values()), [0.1395, 0.097], atol=1e-4)
+    assert os.path.exists(os.path.join(output_fn, "searcher_k1=0.9,b=0.4"))
+
+
+def test_searcher_done_marker_records_index_version(tmpdir, monkeypatch):
+    searcher_config = ConfigScope(BM25.config)()
+    searcher_config["_name"] = BM25.name
+    searcher = BM25(searcher_config)
+    searcher.modules["index"] = AnseriniIndex({"_name": "anserini", "indexstops": False, "stemmer": "porter"})
+    monkeypatch.setattr(searcher["index"], "get_index_version", lambda: "v1")
+
+    donefn = str(tmpdir / "done")
+    assert not searcher._is_done(donefn)
+    searcher._write_done(donefn)
+    assert searcher._is_done(donefn)
+
+    # runs searched before the index was updated are stale
+    monkeypatch.setattr(searcher["index"], "get_index_version", lambda: "v2")
+    assert not searcher._is_done(donefn)
+
+
+def test_close_pooled_searchers_for_index_path(monkeypatch):
+    class FakeSearcher:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    pool = {("a", False): FakeSearcher(), ("a", True): FakeSearcher(), ("b", False): FakeSearcher()}
+    monkeypatch.setattr(searcher_module, "_searcher_pool", dict(pool))
+
+    searcher_module.close_pooled_searchers("a")
+    assert list(searcher_module._searcher_pool) == [("b", False)]
+    assert pool[("a", False)].closed and pool[("a", True)].closed and not pool[("b", False)].closed
+
+
+def test_searcher_bm25_grid_uses_pooled_searcher(tmpdir, monkeypatch):
+    class FakeIndex:
+        cfg = {"stemmer": "porter", "indexstops": False}
+
+        def create_index(self):
+            pass
+
+        def get_index_path(self):
+            return pathlib.Path(tmpdir / "index")
+
+        def get_index_version(self):
+            return "v1"
+
+    class FakePooledSearcher:
+        def __init__(self):
+            self.settings = []
+
+        def batch_search(self, queries, k, threads, **settings):
+            self.settings.append(settings)
+            k1, b = settings["bm25"]
+            return {qid: OrderedDict([("doc1", k1 + b), ("doc2", b)]) for qid in queries}
+
+    pooled = FakePooledSearcher()
+    monkeypatch.setattr(searcher_module, "get_pooled_searcher", lambda index_path, rm3=False: pooled)
+    monkeypatch.setattr(searcher_module, "ANSERINI_SUBPROCESS", False)
+
+    searcher_config = ConfigScope(BM25Grid.config)()
+    searcher_config.update({"_name": BM25Grid.name, "k1max": 0.2, "bmax": 0.1})
+    searcher = BM25Grid(searcher_config)
+    searcher.modules["index"] = FakeIndex()
+
+    output_fn = searcher.query_from_file(DummyBenchmark.topic_file, str(tmpdir / "runs"))
+    k1s = np.around(np.arange(0.1, 0.2 + 0.1, 0.1), 1)
+    assert pooled.settings == [{"bm25": (k1, 0.1)} for k1 in k1s]
+    with open(os.path.join(output_fn, "searcher_k1=0.2,b=0.1"), "rt") as f:
+        assert f.readlines() == ["301 Q0 doc1 1 0.300000 Anserini\n", "301 Q0 doc2 2 0.100000 Anserini\n"]
+    assert searcher._is_done(os.path.join(output_fn, "done"))
+
+    # runs are only searched again once the index changes
+    searcher.query_from_file(DummyBenchmark.topic_file, output_fn)
+    assert len(pooled.settings) == len(k1s)
+
+
+def test_anserini_run_names():
+    runs = BM25RM3._anserini_runs({"k1=0.9,b=0.4": {"bm25": (0.9, 0.4)}})
+    assert runs == {"searcher": {"bm25": (0.9, 0.4)}}
+
+    rm3s = {f"fbTerms:{terms},fbDocs:10,originalQueryWeight:0.5": {"fb_terms": terms} for terms in [10, 20]}
+    runs = BM25RM3._anserini_runs({"k1=0.9,b=0.4": {"bm25": (0.9, 0.4)}}, rm3s)
+    assert runs["searcher_fbTerms:20,fbDocs:10,originalQueryWeight:0.5"] == {"bm25": (0.9, 0.4), "rm3": {"fb_terms": 20}}
+    assert len(runs) == 2
@@ -1,7 +1,4 @@
-import importlib
 import json
-import os
-from glob import glob
 
 from capreolus.registry import RegisterableModule
 
@@ -40,11 +37,3 @@ class Task(metaclass=RegisterableModule):
         print("\n")
 
         print("\n\nresults path:", output_path)
-
-
-# import all tasks so that the classes are always registered
-pwd = os.path.dirname(__file__)
-for fn in glob(os.path.join(pwd, "*.py")):
-    modname = os.path.basename(fn)[:-3]
-    if not (modname.startswith("__") or modname.startswith("flycheck_")):
-        importlib.import_module(f"capreolus.task.{modname}")
@@ -59,8 +59,17 @@ def train(config, modules):
         dev_run = {qid: docs for qid, docs in benchmark.qrels.items() if qid in benchmark.folds[fold]["predict"]["dev"]}
 
     reranker.build()
-    train_dataset = TrainDataset(qid_docid_to_rank=train_run, qrels=benchmark.qrels, extractor=reranker["extractor"])
-    dev_dataset = PredDataset(qid_docid_to_rank=dev_run, qrels=benchmark.qrels, extractor=reranker["extractor"], mode="val")
+    batch_size = reranker["trainer"].cfg["batch"]
+    train_dataset = TrainDataset(
+        qid_docid_to_rank=train_run,
+        qrels=benchmark.qrels,
+        extractor=reranker["extractor"],
+        batch_size=batch_size,
+        seed=config["seed"],
+    )
+    dev_dataset = PredDataset(
+        qid_docid_to_rank=dev_run, qrels=benchmark.qrels, extractor=reranker["extractor"], mode="val", batch_size=batch_size
+    )
 
     train_output_path = _pipeline_path(config, modules)
     dev_output_path = train_output_path / "pred" / "dev"
@@ -94,7 +103,9 @@ def evaluate(config, modules):
         reranker["trainer"].load_best_model(reranker, train_output_path)
 
         test_run = {qid: docs for qid, docs in best_search_run.items() if qid in benchmark.folds[fold]["predict"]["test"]}
-        test_dataset = PredDataset(qid_docid_to_rank=test_run, extractor=reranker["extractor"], mode="test")
+        test_dataset = PredDataset(
+            qid_docid_to_rank=test_run, extractor=reranker["extractor"], mode="test", batch_size=reranker["trainer"].cfg["batch"]
+        )
 
         test_preds = reranker["trainer"].predict(reranker, test_dataset, test_output_path)
 
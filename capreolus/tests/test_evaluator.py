@@ -0,0 +1,47 @@
+import math
+import random
+
+import numpy as np
+import pytrec_eval
+
+from capreolus import evaluator
+from capreolus.utils.trec import BinaryRun
+
+
+def test_evaluate_per_query_matches_trec_eval_rules():
+    qrels = {"q1": {"d1": 1, "d2": 0, "d3": 2, "d5": 1}, "q2": {"d1": 0}, "q3": {"d1": 1}}
+    # d1 and d3 are tied in q1, so d3 is ranked first by decreasing docid
+    runs = {"q1": {"d1": 0.5, "d2": 0.9, "d3": 0.5, "d4": 0.1}, "q2": {"d1": 1.0}, "q9": {"d1": 1.0}}
+    metrics = ["P_5", "map", "map_cut_5", "Rprec", "recip_rank", "set_recall", "ndcg_cut_5"]
+
+    for run in [runs, BinaryRun.from_dict(runs)]:
+        qids, per_query = evaluator.evaluate_per_query(run, qrels, metrics)
+        assert qids == ["q1", "q2"]
+
+        q1 = {metric: scores[0] for metric, scores in per_query.items()}
+        assert q1["P_5"] == 2 / 5
+        assert math.isclose(q1["map"], (1 / 2 + 2 / 3) / 3)
+        assert math.isclose(q1["map_cut_5"], (1 / 2 + 2 / 3) / 3)
+        assert math.isclose(q1["Rprec"], 2 / 3)
+        assert q1["recip_rank"] == 0.5
+        assert math.isclose(q1["set_recall"], 2 / 3)
+        dcg = 2 / math.log2(3) + 1 / math.log2(4)
+        idcg = 2 + 1 / math.log2(3) + 1 / math.log2(4)
+        assert math.isclose(q1["ndcg_cut_5"], dcg / idcg)
+
+        assert all(scores[1] == 0 for scores in per_query.values())
+
+    assert math.isclose(evaluator.eval_runs(runs, qrels, "recip_rank")["recip_rank"], 0.25)
+
+
+def test_eval_runs_matches_pytrec_eval():
+    rng = random.Random(123)
+    qrels = {str(q): {f"d{d}": rng.choice([0, 0, 1, 2]) for d in rng.sample(range(50), 20)} for q in range(20)}
+    runs = {str(q): {f"d{d}": round(rng.random(), 2) for d in rng.sample(range(50), 30)} for q in range(25)}
+    metrics = ["P_5", "P_20", "map", "map_cut_10", "ndcg_cut_10", "ndcg_cut_20", "Rprec", "recip_rank", "set_recall"]
+
+    trec_eval = pytrec_eval.RelevanceEvaluator(qrels, {"P", "map", "map_cut", "ndcg_cut", "Rprec", "recip_rank", "set_recall"})
+    expected = trec_eval.evaluate(runs)
+    scores = evaluator.eval_runs(runs, qrels, metrics)
+    for metric in metrics:
+        assert np.isclose(scores[metric], np.mean([results[metric] for results in expected.values()]))
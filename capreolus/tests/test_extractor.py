@@ -1,3 +1,6 @@
+from pathlib import Path
+
+import numpy as np
 from pymagnitude import Magnitude, MagnitudeUtils
 
 from capreolus.collection import DummyCollection
@@ -126,3 +129,100 @@ def test_embedtext_id2vec():
 
 def fake_sampler():
     pass
+
+
+def test_embedtext_ids2batch():
+    extractor_cfg = {
+        "_name": "embedtext",
+        "index": "anserini",
+        "tokenizer": "anserini",
+        "embeddings": "glove6b",
+        "zerounk": True,
+        "calcidf": True,
+        "maxqlen": MAXQLEN,
+        "maxdoclen": MAXDOCLEN,
+    }
+    extractor = EmbedText(extractor_cfg)
+
+    benchmark = DummyBenchmark({"_fold": "s1", "rundocsonly": False})
+    index = AnseriniIndex({"_name": "anserini", "indexstops": False, "stemmer": "porter"})
+    index.modules["collection"] = DummyCollection({"_name": "dummy"})
+    extractor.modules["index"] = index
+    extractor.modules["tokenizer"] = AnseriniTokenizer({"_name": "anserini", "keepstops": True, "stemmer": "none"})
+
+    qid = list(benchmark.qrels.keys())[0]
+    docids = list(benchmark.qrels[qid].keys())
+    extractor.create([qid], docids, benchmark.topics[benchmark.query_type])
+
+    docid1, docid2 = docids[0], docids[1]
+    batch = extractor.ids2batch([qid, qid], [docid1, docid2], [docid2, docid1])
+    for i, (posid, negid) in enumerate([(docid1, docid2), (docid2, docid1)]):
+        data = extractor.id2vec(qid, posid, negid)
+        for k in ["query", "posdoc", "negdoc", "idfs", "query_idf"]:
+            assert (batch[k][i] == data[k]).all()
+
+    assert batch["qid"] == [qid, qid]
+    assert batch["posdocid"] == [docid1, docid2]
+
+
+class FakeMagnitude:
+    dim = 3
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.queries = 0
+
+    def __contains__(self, term):
+        return term in self.vectors
+
+    def query(self, terms):
+        self.queries += 1
+        return np.array([self.vectors[term] for term in terms])
+
+
+def test_embedtext_embedding_matrix_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr("capreolus.extractor.CACHE_BASE_PATH", Path(tmpdir))
+    monkeypatch.setattr("capreolus.extractor.EMBEDDING_LOOKUP_BATCH_SIZE", 2)
+    magnitude = FakeMagnitude({"hello": [1, 2, 3], "world": [4, 5, 6], "space": [7, 8, 9]})
+    monkeypatch.setattr(EmbedText, "_get_pretrained_emb", lambda self: magnitude)
+
+    extractor_cfg = {"_name": "embedtext", "embeddings": "glove6b", "zerounk": True}
+    extractor = EmbedText(extractor_cfg)
+    extractor.stoi = {"<pad>": 0, "world": 1, "missing": 2, "hello": 3, "space": 4}
+    extractor._build_embedding_matrix()
+
+    expected = np.array([[0, 0, 0], [4, 5, 6], [0, 0, 0], [1, 2, 3], [7, 8, 9]], dtype=np.float32)
+    assert np.array_equal(extractor.embeddings, expected)
+    assert magnitude.queries == 2
+
+    # a second extractor with the same vocabulary loads the matrix from the cache without using the model
+    monkeypatch.setattr(EmbedText, "_get_pretrained_emb", lambda self: None)
+    extractor2 = EmbedText(extractor_cfg)
+    extractor2.stoi = dict(extractor.stoi)
+    extractor2._build_embedding_matrix()
+    assert isinstance(extractor2.embeddings, np.memmap)
+    assert np.array_equal(extractor2.embeddings, expected)
+
+
+def test_embedtext_embedding_matrix_cache_random_unk(tmpdir, monkeypatch):
+    monkeypatch.setattr("capreolus.extractor.CACHE_BASE_PATH", Path(tmpdir))
+    magnitude = FakeMagnitude({"hello": [1, 2, 3], "world": [4, 5, 6]})
+    monkeypatch.setattr(EmbedText, "_get_pretrained_emb", lambda self: magnitude)
+    stoi = {"<pad>": 0, "world": 1, "missing": 2, "hello": 3}
+
+    def build(seed):
+        np.random.seed(seed)
+        extractor = EmbedText({"_name": "embedtext", "embeddings": "glove6b", "zerounk": False})
+        extractor.stoi = dict(stoi)
+        extractor._build_embedding_matrix()
+        return extractor.embeddings
+
+    uncached = build(seed=1)
+    cached = build(seed=1)
+    assert magnitude.queries == 1
+    assert np.array_equal(cached, uncached)
+
+    # missing terms get random vectors from each run's own seed, while the other rows come from the cache
+    other_seed = build(seed=2)
+    assert not np.array_equal(other_seed[2], uncached[2])
+    assert np.array_equal(np.delete(other_seed, 2, axis=0), np.delete(uncached, 2, axis=0))
@@ -0,0 +1,83 @@
+import multiprocessing
+
+import numpy as np
+
+from capreolus.utils import featurecache
+from capreolus.utils.featurecache import PairFeatureCache
+
+
+def test_pair_feature_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(featurecache, "INITIAL_CAPACITY", 2)
+    computed = []
+
+    def compute(qids, docids):
+        computed.extend(zip(qids, docids))
+        return np.array([[[int(qid), int(docid)]] for qid, docid in zip(qids, docids)])
+
+    path = str(tmpdir / "cache")
+    cache = PairFeatureCache(path)
+    features = cache.get(["1", "1", "2"], ["10", "11", "10"], compute)
+    assert features.dtype == np.float16
+    assert features.tolist() == [[[1, 10]], [[1, 11]], [[2, 10]]]
+
+    # only missing pairs are computed, once each, and the array grows past its initial capacity
+    features = cache.get(["2", "3", "3", "1"], ["10", "12", "12", "11"], compute)
+    assert features.tolist() == [[[2, 10]], [[3, 12]], [[3, 12]], [[1, 11]]]
+    assert computed == [("1", "10"), ("1", "11"), ("2", "10"), ("3", "12")]
+
+    # the cache is persistent
+    cache = PairFeatureCache(path)
+    assert len(cache) == 4 and ("3", "12") in cache
+    assert cache.get(["3"], ["12"], compute).tolist() == [[[3, 12]]]
+    assert len(computed) == 4
+
+
+def test_pair_feature_cache_ignores_incomplete_pair(tmpdir):
+    path = str(tmpdir / "cache")
+    cache = PairFeatureCache(path)
+    cache.get(["1"], ["10"], lambda qids, docids: np.ones((1, 2)))
+    with open(cache.pairs_fn, "at") as outf:
+        outf.write("2\t1")
+
+    cache = PairFeatureCache(path)
+    assert len(cache) == 1
+    assert cache.get(["2"], ["10"], lambda qids, docids: np.zeros((1, 2))).tolist() == [[0, 0]]
+    assert PairFeatureCache(path).pair2row == {("1", "10"): 0, ("2", "10"): 1}
+
+
+def test_pair_feature_cache_fingerprints(tmpdir):
+    path = str(tmpdir / "cache")
+    cache = PairFeatureCache(path)
+    assert cache.get(["1"], ["10"], lambda qids, docids: np.ones((1, 2)), fingerprints=["a"]).tolist() == [[1, 1]]
+
+    # a pair with a new fingerprint is computed again, while the old fingerprint keeps its features
+    assert cache.get(["1"], ["10"], lambda qids, docids: np.zeros((1, 2)), fingerprints=["b"]).tolist() == [[0, 0]]
+    cache = PairFeatureCache(path)
+    assert cache.pair2row == {("1", "10", "a"): 0, ("1", "10", "b"): 1}
+    assert cache.get(["1", "1"], ["10", "10"], None, fingerprints=["b", "a"]).tolist() == [[0, 0], [1, 1]]
+
+
+def _add_pairs_to_shared_cache(path, worker):
+    cache = PairFeatureCache(path)
+    for start in range(0, 40, 4):
+        qids = [str(i) for i in range(start, start + 4)]
+        docids = [str(worker + i % 3) for i in range(start, start + 4)]
+        cache.get(qids, docids, lambda qids, docids: np.array([[int(q), int(d)] for q, d in zip(qids, docids)]))
+
+
+def test_pair_feature_cache_shared_by_processes(tmpdir, monkeypatch):
+    monkeypatch.setattr(featurecache, "INITIAL_CAPACITY", 2)
+    path = str(tmpdir / "cache")
+    workers = [multiprocessing.Process(target=_add_pairs_to_shared_cache, args=(path, worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    # every pair is cached once, with its own features, even though the processes extended the cache concurrently
+    cache = PairFeatureCache(path)
+    pairs = sorted(cache.pair2row)
+    assert len(pairs) == len(set((str(i), str(worker + i % 3)) for i in range(40) for worker in range(4)))
+    features = cache.get([qid for qid, _ in pairs], [docid for _, docid in pairs], None)
+    assert features.tolist() == [[int(qid), int(docid)] for qid, docid in pairs]
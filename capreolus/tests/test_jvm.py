@@ -0,0 +1,62 @@
+import threading
+import time
+
+from capreolus.utils.jvm import MemoryBudget, heap_options, heap_size, parse_size
+
+
+def test_parse_size():
+    assert parse_size("512M") == 512 * 1024 ** 2
+    assert parse_size("31g") == 31 * 1024 ** 3
+    assert parse_size("1.5G") == int(1.5 * 1024 ** 3)
+    assert parse_size(2048) == 2048
+    assert heap_options(parse_size("8G")) == ["-Xms512M", "-Xmx8192M"]
+
+
+def test_heap_size_overrides(monkeypatch):
+    monkeypatch.setenv("CAPREOLUS_JVM_HEAP", "4G")
+    monkeypatch.setenv("CAPREOLUS_JVM_HEAP_SEARCHER", "2G")
+    assert heap_size("searcher") == parse_size("2G")
+    assert heap_size("index") == parse_size("4G")
+
+    monkeypatch.delenv("CAPREOLUS_JVM_HEAP")
+    assert parse_size("1G") <= heap_size("index") <= parse_size("31G")
+
+
+def test_memory_budget_limits_concurrent_jobs():
+    budget = MemoryBudget(10)
+    running, max_running = [0], [0]
+    lock = threading.Lock()
+
+    def job():
+        with budget.reserve(4):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=job) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max_running[0] == 2
+    assert budget.used == 0
+
+    # a job larger than the budget still runs, alone
+    with budget.reserve(20):
+        assert budget.used == 10
+
+
+def test_jnius_heap_size(monkeypatch):
+    for key in ["CAPREOLUS_JVM_HEAP", "CAPREOLUS_JVM_HEAP_JNIUS", "CAPREOLUS_JVM_HEAP_SEARCHER"]:
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setattr("capreolus.utils.jvm.available_memory", lambda: parse_size("16G"))
+
+    # the in-process JVM defaults to the heap a searcher gets when the index size is unknown
+    assert heap_size("jnius") == heap_size("searcher") == parse_size("8G")
+
+    monkeypatch.setenv("CAPREOLUS_JVM_HEAP_JNIUS", "3G")
+    assert heap_size("jnius") == parse_size("3G")
@@ -2,6 +2,8 @@ import pytest
 
 from collections import namedtuple
 from capreolus.pipeline import Pipeline, Notebook
+from capreolus.registry import clear_module_cache
+from capreolus.searcher import BM25
 
 
 class DummyPipeline(Pipeline):
@@ -76,3 +78,27 @@ def test_task_construction_failure_on_bad_config():
     # and still fails if the module and module class are valid but the combination is not
     with pytest.raises(KeyError):
         nb = Notebook(module_defaults, config_string="searcher=robust04")
+
+
+def test_module_instances_are_shared(monkeypatch):
+    clear_module_cache()
+    module_defaults = {"searcher": "BM25", "collection": "robust04", "benchmark": "wsdm20demo"}
+    nb = Notebook(module_defaults)
+
+    # searchers are reused when a pipeline with the same config is created again, without being constructed again
+    monkeypatch.setattr(BM25, "__init__", lambda self, cfg: pytest.fail("a cached searcher was constructed again"))
+    nb2 = Notebook(module_defaults)
+    assert nb2.modules["searcher"] is nb.modules["searcher"]
+    monkeypatch.undo()
+
+    # modules without cache_instances, whose state may depend on more than their config, are never shared
+    assert nb2.modules["benchmark"] is not nb.modules["benchmark"]
+
+    # and searchers are not reused when their configs differ, though the index they require still is
+    nb3 = Notebook(module_defaults, config_string="searcher.hits=5")
+    assert nb3.modules["searcher"] is not nb.modules["searcher"]
+    assert nb3.modules["searcher"]["index"] is nb.modules["searcher"]["index"]
+
+    clear_module_cache()
+    nb4 = Notebook(module_defaults)
+    assert nb4.modules["searcher"] is not nb.modules["searcher"]
@@ -0,0 +1,33 @@
+import math
+
+import numpy as np
+
+from capreolus.utils.postings import PostingsSnapshot
+
+
+def test_postings_snapshot_scores(tmpdir):
+    # three documents with lengths 4, 10 and 6; "b" occurs in docs 0 and 2 and "c" only in doc 1
+    terms = ["b", "c"]
+    offsets, docs, tfs = np.array([0, 2, 3]), np.array([0, 2, 1]), np.array([2, 1, 3])
+    dfs, ttfs = np.array([2, 1]), np.array([3, 3])
+    terms_fn, collection_fn = str(tmpdir / "terms.npz"), str(tmpdir / "collection.npz")
+    PostingsSnapshot.save_terms(terms_fn, terms, offsets, docs, tfs, dfs, ttfs)
+    PostingsSnapshot.save_collection(collection_fn, np.array([4, 10, 6]), ["d0", "d1", "d2"], 3, 20)
+    snapshot = PostingsSnapshot.load(terms_fn, collection_fn)
+
+    postings = snapshot.query_postings(["b", "b", "missing"])
+    assert postings.docs.tolist() == [0, 2]
+
+    k1, b, avgdl = 0.9, 0.4, 20 / 3
+    idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+    expected = [2 * idf * tf / (tf + k1 * (1 - b + b * dl / avgdl)) for tf, dl in [(2, 4), (1, 6)]]
+    assert np.allclose(postings.bm25(k1, b), expected)
+    assert list(postings.topk(postings.bm25(k1, b), 1)) == ["d0"]
+
+    mu = 5
+    expected = [max(0, 2 * (math.log(1 + tf / (mu * 4 / 21)) + math.log(mu / (dl + mu)))) for tf, dl in [(2, 4), (1, 6)]]
+    assert np.allclose(postings.dirichlet(mu), expected)
+
+    ranked = snapshot.query_postings(["b", "c"]).topk(snapshot.query_postings(["b", "c"]).bm25(k1, b), 10)
+    assert sorted(ranked) == ["d0", "d1", "d2"]
+    assert list(ranked.values()) == sorted(ranked.values(), reverse=True)
@@ -0,0 +1,19 @@
+from capreolus.registry import PACKAGE_PATH, scan_plugin_names
+
+
+def test_scan_plugin_names(tmpdir):
+    with open(tmpdir / "__init__.py", "wt") as f:
+        f.write('class Base:\n    name = "base"\n')
+    with open(tmpdir / "one.py", "wt") as f:
+        f.write('import notinstalled\n\n\nclass One(Base):\n    name = "one"\n\n\nclass Helper:\n    name = None\n')
+    with open(tmpdir / "two.py", "wt") as f:
+        f.write('class Two:\n    name = "two"\n\n    def f(self):\n        name = "inner"\n')
+
+    # files are parsed rather than imported, so the missing import in one.py does not matter
+    assert scan_plugin_names(str(tmpdir)) == {"one": ["one"], "two": ["two"]}
+
+
+def test_scan_plugin_names_finds_rerankers():
+    names = scan_plugin_names(PACKAGE_PATH / "reranker")
+    assert names["KNRM"] == ["KNRM"]
+    assert names["DRMM"] == ["DRMM"]
@@ -0,0 +1,72 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from capreolus.utils.tokenstore import TokenStore, TokenCache
+
+
+def test_tokenstore_save_and_load(tmpdir):
+    store = TokenStore.from_sequences([("doc1", [1, 2, 3]), ("doc2", []), ("doc3", [4])])
+    assert len(store) == 3
+    assert "doc2" in store and "doc4" not in store
+
+    store.save(tmpdir / "store")
+    loaded = TokenStore.load(tmpdir / "store")
+    assert loaded.docids == ["doc1", "doc2", "doc3"]
+    assert np.array_equal(loaded.get("doc1"), [1, 2, 3])
+    assert len(loaded.get("doc2")) == 0
+    assert np.array_equal(loaded.get("doc3"), [4])
+
+    merged = loaded.merge(TokenStore.from_sequences([("doc3", [5]), ("doc4", [6, 7])]))
+    assert merged.docids == ["doc1", "doc2", "doc3", "doc4"]
+    assert np.array_equal(merged.get("doc3"), [4])
+    assert np.array_equal(merged.get("doc4"), [6, 7])
+
+
+def test_tokencache_persists_new_docs(tmpdir):
+    cache = TokenCache(tmpdir / "doctoks")
+    assert "doc1" not in cache
+
+    cache.add({"doc1": ["hello", "world"], "doc2": []})
+    cache.add({"doc3": ["world", "from", "space"]})
+
+    reloaded = TokenCache(tmpdir / "doctoks")
+    assert len(reloaded) == 3
+    assert reloaded.get("doc1") == ["hello", "world"]
+    assert reloaded.get("doc2") == []
+    assert reloaded.get("doc3") == ["world", "from", "space"]
+    assert reloaded.vocab == ["hello", "world", "from", "space"]
+    # each add writes a new segment rather than rewriting the documents already cached
+    assert sorted(os.listdir(tmpdir / "doctoks" / "segments")) == ["000000", "000001"]
+
+    # documents that are already cached are not added again
+    reloaded.add({"doc1": ["other"], "doc4": ["hello"]})
+    assert len(reloaded.store.segments) == 3
+    assert reloaded.store.segments[-1].docids == ["doc4"]
+    assert reloaded.get("doc1") == ["hello", "world"]
+
+
+def _add_docs_to_shared_cache(path, worker):
+    cache = TokenCache(path)
+    for start in range(0, 20, 4):
+        cache.add({f"doc{i}": [f"tok{i}", f"worker{worker}", f"tok{i + 1}"] for i in range(start, start + 4)})
+
+
+def test_tokencache_shared_by_processes(tmpdir):
+    path = str(tmpdir / "doctoks")
+    workers = [multiprocessing.Process(target=_add_docs_to_shared_cache, args=(path, worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    # every doc is cached once and decodes to the tokens of the worker that added it, even though the processes
+    # extended the vocab concurrently
+    cache = TokenCache(path)
+    assert len(cache) == 20
+    assert len(cache.vocab) == len(set(cache.vocab))
+    for i in range(20):
+        toks = cache.get(f"doc{i}")
+        assert toks[0] == f"tok{i}" and toks[1].startswith("worker") and toks[2] == f"tok{i + 1}"
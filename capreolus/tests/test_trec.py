@@ -0,0 +1,39 @@
+import os
+
+from capreolus.utils.trec import BinaryRun, binary_run_path, load_binary_run, parse_trec_run
+
+
+def test_binary_run_matches_text_run(tmpdir):
+    runfn = os.path.join(tmpdir, "searcher")
+    with open(runfn, "wt") as outf:
+        outf.write("301 Q0 LA010189-0001 1 4.5 run\n")
+        outf.write("301 Q0 LA010189-0002 2 3.25 run\n")
+        outf.write("302 Q0 LA010189-0002 1 -1.5 run\n")
+
+    binrun = load_binary_run(runfn)
+    assert os.path.isdir(binary_run_path(runfn))
+    assert binrun.to_dict() == parse_trec_run(runfn)
+    assert len(binrun) == 2 and "302" in binrun and "303" not in binrun
+
+    docids, scores = binrun.query("301")
+    assert docids == ["LA010189-0001", "LA010189-0002"]
+    assert scores.tolist() == [4.5, 3.25]
+
+    # the cached binary version is used until the text run changes
+    assert isinstance(load_binary_run(runfn), BinaryRun)
+    with open(runfn, "at") as outf:
+        outf.write("303 Q0 LA010189-0003 1 1.0 run\n")
+    assert load_binary_run(runfn).to_dict()["303"] == {"LA010189-0003": 1.0}
+
+
+def test_binary_run_keeps_exact_scores(tmpdir):
+    runfn = os.path.join(tmpdir, "searcher")
+    with open(runfn, "wt") as outf:
+        outf.write("301 Q0 LA010189-0001 1 0.1 run\n")
+        outf.write("301 Q0 LA010189-0002 2 0.09999999999999999 run\n")
+
+    # these scores differ as float64 but would tie (and could be reordered) as float32
+    docids, scores = load_binary_run(runfn).query("301")
+    assert docids == ["LA010189-0001", "LA010189-0002"]
+    assert scores.tolist() == [0.1, 0.09999999999999999]
+    assert load_binary_run(runfn).to_dict() == parse_trec_run(runfn)
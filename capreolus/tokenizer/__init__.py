@@ -5,6 +5,7 @@ class Tokenizer(ModuleBase, metaclass=RegisterableModule):
     """the module base class"""
 
     module_type = "tokenizer"
+    cache_instances = True
 
 
 class AnseriniTokenizer(Tokenizer):
@@ -1,4 +1,5 @@
 import os
+import inspect
 import json
 
 import numpy as np
@@ -9,10 +10,15 @@ from capreolus.reranker.common import pair_hinge_loss, pair_softmax_loss
 from capreolus.searcher import Searcher
 from capreolus.utils.loginit import get_logger
 from capreolus.utils.common import plot_metrics, plot_loss
+from capreolus.utils.trec import write_binary_run
 from capreolus import evaluator
 
 logger = get_logger(__name__)  # pylint: disable=invalid-name
 
+# DataLoader only accepts a prefetch_factor from PyTorch 1.7. earlier versions prefetch DEFAULT_PREFETCH batches per worker
+DATALOADER_PREFETCH = "prefetch_factor" in inspect.signature(torch.utils.data.DataLoader.__init__).parameters
+DEFAULT_PREFETCH = 2
+
 
 class Trainer(ModuleBase, metaclass=RegisterableModule):
     module_type = "trainer"
@@ -21,7 +27,7 @@ class Trainer(ModuleBase, metaclass=RegisterableModule):
 class PytorchTrainer(Trainer):
     name = "pytorch"
     dependencies = {}
-    config_keys_not_in_path = ["niters"]
+    config_keys_not_in_path = ["niters", "numworkers", "prefetch", "predflush"]
 
     @staticmethod
     def config():
@@ -38,6 +44,9 @@ class PytorchTrainer(Trainer):
         softmaxloss = False  # True to use softmax loss (over pairs) or False to use hinge loss
 
         interactive = False  # True for training with Notebook or False for command line environment
+        numworkers = 0  # number of DataLoader worker processes building instances (0 builds them in the main process)
+        prefetch = 2  # number of batches each DataLoader worker prepares in advance (needs numworkers > 0 and PyTorch >= 1.7)
+        predflush = 0  # if > 0, stream predictions to disk every predflush completed queries rather than keeping them all
 
         # sanity checks
         if batch < 1:
@@ -55,12 +64,51 @@ class PytorchTrainer(Trainer):
         if lr <= 0:
             raise ValueError("lr must be > 0")
 
-    def single_train_iteration(self, reranker, train_dataloader):
-        """Train model for one iteration using instances from train_dataloader.
+        if numworkers < 0:
+            raise ValueError("numworkers must be >= 0")
+
+        if prefetch < 1:
+            raise ValueError("prefetch must be >= 1")
+
+        if predflush < 0:
+            raise ValueError("predflush must be >= 0")
+
+    def create_dataloader(self, dataset):
+        """Create a DataLoader for `dataset`. Datasets that build whole batches themselves (i.e., that have a batch_size)
+        are loaded without the DataLoader's automatic batching.
+
+        Args:
+           dataset (IterableDataset): a TrainDataset or PredDataset
+
+        Returns:
+            DataLoader: a PyTorch DataLoader yielding batches of cfg["batch"] instances
+
+        """
+
+        kwargs = {"pin_memory": True, "num_workers": self.cfg["numworkers"]}
+        if self.cfg["numworkers"] > 0 and DATALOADER_PREFETCH:
+            # prefetch_factor is only accepted when workers are used
+            kwargs["prefetch_factor"] = self.cfg["prefetch"]
+        elif self.cfg["numworkers"] > 0 and self.cfg["prefetch"] != DEFAULT_PREFETCH:
+            logger.warning(
+                "ignoring prefetch=%s: PyTorch %s always prefetches %s batches per worker (prefetch requires PyTorch >= 1.7)",
+                self.cfg["prefetch"],
+                torch.__version__,
+                DEFAULT_PREFETCH,
+            )
+
+        if getattr(dataset, "batch_size", None):
+            return torch.utils.data.DataLoader(dataset, batch_size=None, **kwargs)
+
+        return torch.utils.data.DataLoader(dataset, batch_size=self.cfg["batch"], **kwargs)
+
+    def single_train_iteration(self, reranker, train_batches):
+        """Train model for one iteration using instances from train_batches.
 
         Args:
            model (Reranker): a PyTorch Reranker
-           train_dataloader (DataLoader): a PyTorch DataLoader that iterates over training instances
+           train_batches (iterator): an iterator over a PyTorch DataLoader that yields batches of training instances.
+                                     The same iterator is reused across iterations, so DataLoader workers persist.
 
         Returns:
             float: average loss over the iteration
@@ -72,7 +120,7 @@ class PytorchTrainer(Trainer):
         batches_per_epoch = self.cfg["itersize"] // self.cfg["batch"]
         batches_per_step = self.cfg["gradacc"]
 
-        for bi, batch in enumerate(train_dataloader):
+        for bi, batch in enumerate(train_batches):
             # TODO make sure _prepare_batch_with_strings equivalent is happening inside the sampler
             batch = {k: v.to(self.device) if not isinstance(v, list) else v for k, v in batch.items()}
             doc_scores = reranker.score(batch)
@@ -196,9 +244,8 @@ class PytorchTrainer(Trainer):
         initial_iter = self.fastforward_training(reranker, weights_output_path, loss_fn)
         logger.info("starting training from iteration %s/%s", initial_iter, self.cfg["niters"])
 
-        train_dataloader = torch.utils.data.DataLoader(
-            train_dataset, batch_size=self.cfg["batch"], pin_memory=True, num_workers=0
-        )
+        train_dataloader = self.create_dataloader(train_dataset)
+        train_batches = iter(train_dataloader)
 
         train_loss = []
         # are we resuming training?
@@ -210,7 +257,7 @@ class PytorchTrainer(Trainer):
                 logger.debug("fastforwarding train_dataloader to iteration %s", initial_iter)
                 batches_per_epoch = self.cfg["itersize"] // self.cfg["batch"]
                 for niter in range(initial_iter):
-                    for bi, batch in enumerate(train_dataloader):
+                    for bi, batch in enumerate(train_batches):
                         if (bi + 1) % batches_per_epoch == 0:
                             break
 
@@ -218,7 +265,7 @@ class PytorchTrainer(Trainer):
         for niter in range(initial_iter, self.cfg["niters"]):
             model.train()
 
-            iter_loss_tensor = self.single_train_iteration(reranker, train_dataloader)
+            iter_loss_tensor = self.single_train_iteration(reranker, train_batches)
 
             train_loss.append(iter_loss_tensor.item())
             logger.info("iter = %d loss = %f", niter, train_loss[-1])
@@ -259,13 +306,16 @@ class PytorchTrainer(Trainer):
     def predict(self, reranker, pred_data, pred_fn):
         """Predict query-document scores on `pred_data` using `model` and write a corresponding run file to `pred_fn`
 
+        If cfg["predflush"] > 0, predictions are streamed to `pred_fn` as queries are completed and only the path is
+        returned. Otherwise, all predictions are kept in memory and written when prediction is done.
+
         Args:
            model (Reranker): a PyTorch Reranker
            pred_data (IterableDataset): data to predict on
            pred_fn (Path): path to write the prediction run file to
 
         Returns:
-           TREC Run 
+           TREC Run, or the path to the run file when streaming predictions
 
         """
 
@@ -273,19 +323,54 @@ class PytorchTrainer(Trainer):
         # save to pred_fn
         model = reranker.model.to(self.device)
         model.eval()
+        os.makedirs(os.path.dirname(pred_fn), exist_ok=True)
+
+        if self.cfg["predflush"] > 0:
+            return self._predict_streaming(reranker, pred_data, pred_fn)
 
         preds = {}
-        pred_dataloader = torch.utils.data.DataLoader(pred_data, batch_size=self.cfg["batch"], pin_memory=True, num_workers=0)
+        for qid, docid, score in self._predict_scores(reranker, pred_data):
+            preds.setdefault(qid, {})[docid] = score
+
+        Searcher.write_trec_run(preds, pred_fn)
+        write_binary_run(preds, pred_fn)
+
+        return preds
+
+    def _predict_scores(self, reranker, pred_data):
+        """ Yield a (qid, docid, score) tuple for every instance in `pred_data` """
+        pred_dataloader = self.create_dataloader(pred_data)
         with torch.autograd.no_grad():
             for bi, batch in enumerate(pred_dataloader):
                 batch = {k: v.to(self.device) if not isinstance(v, list) else v for k, v in batch.items()}
                 scores = reranker.test(batch)
-                scores = scores.view(-1).cpu().numpy()
+                scores = scores.view(-1).cpu().tolist()
                 for qid, docid, score in zip(batch["qid"], batch["posdocid"], scores):
-                    # Need to use float16 because pytrec_eval's c function call crashes with higher precision floats
-                    preds.setdefault(qid, {})[docid] = score.astype(np.float16).item()
-
-        os.makedirs(os.path.dirname(pred_fn), exist_ok=True)
-        Searcher.write_trec_run(preds, pred_fn)
-
-        return preds
+                    yield qid, docid, score
+
+    def _predict_streaming(self, reranker, pred_data, pred_fn):
+        """ Predict on `pred_data` while holding only incomplete queries and up to cfg["predflush"] completed queries
+            in memory. A query is complete once scores for all of its docids in `pred_data.qid_to_docids` arrived. """
+
+        expected_counts = {qid: len(docids) for qid, docids in pred_data.qid_to_docids.items()}
+        pending, completed = {}, {}
+
+        # write to a temporary file, so that an interrupted prediction does not leave a partial run at pred_fn
+        tmp_fn = f"{pred_fn}.tmp"
+        open(tmp_fn, "wt").close()
+        for qid, docid, score in self._predict_scores(reranker, pred_data):
+            pending.setdefault(qid, {})[docid] = score
+            if len(pending[qid]) == expected_counts[qid]:
+                completed[qid] = pending.pop(qid)
+
+                if len(completed) >= self.cfg["predflush"]:
+                    Searcher.write_trec_run(completed, tmp_fn, mode="at")
+                    completed = {}
+
+        # pending is normally empty here, but may contain queries with duplicate docids
+        completed.update(pending)
+        Searcher.write_trec_run(completed, tmp_fn, mode="at")
+        # the binary version of the run is created by load_binary_run when the run is first read (e.g., by the evaluator)
+        os.replace(tmp_fn, pred_fn)
+
+        return pred_fn
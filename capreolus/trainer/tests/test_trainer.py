@@ -0,0 +1,70 @@
+import torch
+
+import capreolus.trainer
+
+from capreolus.extractor import EmbedText
+from capreolus.sampler import PredDataset
+from capreolus.searcher import Searcher
+from capreolus.trainer import PytorchTrainer
+
+
+class FakeReranker:
+    def __init__(self):
+        self.model = torch.nn.Linear(1, 1)
+
+    def test(self, batch):
+        return batch["posdoc"]
+
+
+def make_trainer(predflush):
+    return PytorchTrainer({"_name": "pytorch", "batch": 3, "numworkers": 0, "prefetch": 2, "predflush": predflush})
+
+
+def make_pred_data(monkeypatch, nqids=7, ndocs=5):
+    def mock_ids2batch(self, qids, posids):
+        scores = [(int(qid) * 31 + int(docid.split("-")[1]) * 17) % 11 / 7 for qid, docid in zip(qids, posids)]
+        return {"qid": list(qids), "posdocid": list(posids), "posdoc": torch.tensor(scores)}
+
+    monkeypatch.setattr(EmbedText, "has_doc", lambda self, docid: True)
+    monkeypatch.setattr(EmbedText, "ids2batch", mock_ids2batch)
+    run = {str(qid): {f"doc{qid}-{docid}": 0 for docid in range(ndocs)} for qid in range(nqids)}
+    return PredDataset(run, EmbedText({"keepstops": True}), mode="test", batch_size=3)
+
+
+def test_streaming_predict_matches_predict(monkeypatch, tmpdir):
+    pred_data = make_pred_data(monkeypatch)
+    preds = make_trainer(predflush=0).predict(FakeReranker(), pred_data, tmpdir / "inmemory" / "pred.run")
+
+    # record how many completed queries are written (and were therefore held in memory) at each flush
+    flushed = []
+    write_trec_run = Searcher.write_trec_run
+
+    def mock_write_trec_run(preds, outfn, mode="wt"):
+        flushed.append(len(preds))
+        write_trec_run(preds, outfn, mode=mode)
+
+    monkeypatch.setattr(Searcher, "write_trec_run", mock_write_trec_run)
+    pred_fn = make_trainer(predflush=2).predict(FakeReranker(), pred_data, tmpdir / "streamed" / "pred.run")
+
+    assert pred_fn == tmpdir / "streamed" / "pred.run"
+    assert sum(flushed) == len(preds)
+    assert max(flushed) <= 2
+    assert Searcher.load_trec_run(pred_fn) == preds
+    with open(pred_fn, "rt") as f, open(tmpdir / "inmemory" / "pred.run", "rt") as inmemoryf:
+        assert f.read() == inmemoryf.read()
+
+
+def test_prefetch_requires_dataloader_support(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(capreolus.trainer.logger, "warning", lambda *args: warnings.append(args))
+    dataset = torch.utils.data.TensorDataset(torch.zeros(4, 1))
+    trainer = PytorchTrainer({"_name": "pytorch", "batch": 2, "numworkers": 1, "prefetch": 4, "predflush": 0})
+
+    monkeypatch.setattr(capreolus.trainer, "DATALOADER_PREFETCH", False)
+    trainer.create_dataloader(dataset)
+    assert len(warnings) == 1
+
+    # the default prefetch is what older DataLoaders do anyway
+    trainer = PytorchTrainer({"_name": "pytorch", "batch": 2, "numworkers": 1, "prefetch": 2, "predflush": 0})
+    trainer.create_dataloader(dataset)
+    assert len(warnings) == 1
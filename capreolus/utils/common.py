@@ -7,7 +7,6 @@ from glob import glob
 
 import numpy as np
 from tqdm import tqdm
-import matplotlib.pyplot as plt
 
 from capreolus.utils.loginit import get_logger
 
@@ -110,6 +109,8 @@ def padlist(list_to_pad, padlen, pad_token=0):
 
 
 def plot_loss(history, outfn, interactive=False):
+    import matplotlib.pyplot as plt
+
     # epochs, losses = zip(*history)
     losses = history
     epochs = list(range(0, len(history)))
@@ -127,6 +128,8 @@ def plot_loss(history, outfn, interactive=False):
 
 
 def plot_metrics(metrics, outfn, interactive=False, show={"map", "P_20", "ndcg_cut_20"}):
+    import matplotlib.pyplot as plt
+
     title = "maxs: "
     fig = plt.figure()
     for metric, xys in metrics.items():
@@ -0,0 +1,137 @@
+import fcntl
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# rows to allocate when the first features are added; the array doubles in size whenever it fills up
+INITIAL_CAPACITY = 1024
+
+
+class PairFeatureCache:
+    """ Persistent mapping of (qid, docid) pairs to fixed-shape feature arrays, such as a reranker's matching histograms.
+
+        Features are stored as one memory-mapped float16 array, where the features of the pair on line `i` of
+        pairs.tsv are in row `i`. Features are computed for the pairs missing from the cache when they are requested
+        and appended to the cache, so each pair is only computed once. Like TokenCache, the cache only grows.
+        Processes sharing a cache take an exclusive lock on its lock file while reading or extending it, and pick up
+        the pairs added by other processes whenever they take the lock.
+
+        Pairs may also be keyed by a fingerprint of the inputs their features are computed from, so that a pair whose
+        query or document changed (e.g., because it was tokenized differently) is not given stale features.
+    """
+
+    def __init__(self, path, dtype=np.float16):
+        self.path = str(path)
+        self.features_fn = os.path.join(self.path, "features.npy")
+        self.pairs_fn = os.path.join(self.path, "pairs.tsv")
+        self.lock_fn = os.path.join(self.path, "lock")
+        self.dtype = dtype
+        self.lock = threading.Lock()
+
+        self.pair2row = {}
+        self.features = None
+        self._pairs_size = 0
+        os.makedirs(self.path, exist_ok=True)
+        with self._file_lock():
+            self._reload()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_fn, "a") as lockf:
+            fcntl.flock(lockf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockf, fcntl.LOCK_UN)
+
+    def _reload(self):
+        """ Read the pairs added to the cache since it was last read. Must be called while holding the file lock. """
+        if not os.path.exists(self.pairs_fn) or os.path.getsize(self.pairs_fn) == self._pairs_size:
+            return
+
+        with open(self.pairs_fn, "rt") as f:
+            lines = f.read().split("\n")
+
+        # the last line is incomplete if a previous process stopped while appending to the file
+        if lines[-1]:
+            with open(self.pairs_fn, "wt") as outf:
+                outf.write("".join(line + "\n" for line in lines[:-1]))
+
+        self.pair2row = {}
+        for line in lines[:-1]:
+            self.pair2row[tuple(line.split("\t"))] = len(self.pair2row)
+        self._pairs_size = os.path.getsize(self.pairs_fn)
+        # another process may have replaced features.npy with a larger array
+        self.features = np.load(self.features_fn, mmap_mode="r+") if self.pair2row else None
+
+    def __len__(self):
+        return len(self.pair2row)
+
+    def __contains__(self, pair):
+        return pair in self.pair2row
+
+    def get(self, qids, docids, compute, fingerprints=None):
+        """ Return an array with the features of each (qid, docid) pair, calling `compute(qids, docids)` to obtain
+            an array with the features of any pairs missing from the cache. If `fingerprints` are given, each pair is
+            keyed by (qid, docid, fingerprint) rather than (qid, docid). """
+        pairs = list(zip(qids, docids) if fingerprints is None else zip(qids, docids, fingerprints))
+        with self.lock:
+            with self._file_lock():
+                self._reload()
+                missing = list(OrderedDict.fromkeys(pair for pair in pairs if pair not in self.pair2row))
+
+            # features are computed without holding the file lock, so other processes are not blocked meanwhile
+            if missing:
+                features = np.asarray(compute([pair[0] for pair in missing], [pair[1] for pair in missing]))
+                if features.shape[0] != len(missing):
+                    raise ValueError(f"received features for {features.shape[0]} pairs but expected {len(missing)}")
+
+            with self._file_lock():
+                self._reload()
+                if missing:
+                    # another process may have added some of the pairs in the meantime
+                    added = [i for i, pair in enumerate(missing) if pair not in self.pair2row]
+                    if added:
+                        self._add([missing[i] for i in added], features[added])
+
+                return np.asarray(self.features[[self.pair2row[pair] for pair in pairs]])
+
+    def _add(self, pairs, features):
+        """ Append features for new pairs. Must be called while holding the file lock. """
+        features = np.asarray(features, dtype=self.dtype)
+        start = len(self.pair2row)
+        self._reserve(start + len(pairs), features.shape[1:])
+        self.features[start : start + len(pairs)] = features
+        self.features.flush()
+
+        # pairs are appended once their features are on disk, so every pair in pairs.tsv has features
+        with open(self.pairs_fn, "at") as outf:
+            for pair in pairs:
+                print("\t".join(pair), file=outf)
+
+        for pair in pairs:
+            self.pair2row[pair] = len(self.pair2row)
+        self._pairs_size = os.path.getsize(self.pairs_fn)
+
+    def _reserve(self, nrows, shape):
+        if self.features is not None and self.features.shape[1:] != shape:
+            raise ValueError(f"features with shape {shape} do not match the cached shape {self.features.shape[1:]}")
+        if self.features is not None and len(self.features) >= nrows:
+            return
+
+        capacity = max(nrows, INITIAL_CAPACITY, 2 * len(self.features) if self.features is not None else 0)
+        tmp_fn = f"{self.features_fn}.tmp-{os.getpid()}.npy"
+        new_features = open_memmap(tmp_fn, mode="w+", dtype=self.dtype, shape=(capacity,) + tuple(shape))
+        if self.features is not None:
+            new_features[: len(self.pair2row)] = self.features[: len(self.pair2row)]
+        new_features.flush()
+        del new_features
+
+        os.replace(tmp_fn, self.features_fn)
+        if not os.path.exists(self.pairs_fn):
+            open(self.pairs_fn, "wt").close()
+        self.features = np.load(self.features_fn, mmap_mode="r+")
@@ -0,0 +1,130 @@
+import os
+import re
+import subprocess
+import threading
+from contextlib import contextmanager
+
+from capreolus.registry import MAX_THREADS
+from capreolus.utils.loginit import get_logger
+
+logger = get_logger(__name__)  # pylint: disable=invalid-name
+
+GB = 1024 ** 3
+MIN_HEAP = GB
+MAX_HEAP = 31 * GB  # stay below the limit for compressed object pointers
+
+
+def parse_size(size):
+    """ Convert a JVM-style size such as "512M" or "31G" (or a number of bytes) to bytes """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kKmMgGtT]?)[bB]?\s*", str(size))
+    if not match:
+        raise ValueError(f"invalid memory size: {size}")
+
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " KMGT".index(unit.upper() or " "))
+
+
+def format_size(nbytes):
+    return f"{max(1, nbytes // 1024 ** 2)}M"
+
+
+def available_memory():
+    """ Return the memory available for new processes in bytes, using MemAvailable from /proc/meminfo if possible """
+    try:
+        with open("/proc/meminfo", "rt") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+
+def directory_size(path):
+    total = 0
+    for root, _, fns in os.walk(path):
+        for fn in fns:
+            total += os.path.getsize(os.path.join(root, fn))
+    return total
+
+
+def heap_size(module_type, index_path=None):
+    """ Choose the maximum heap size in bytes for a JVM run by `module_type` (e.g., "index" or "searcher").
+
+        The environment variables CAPREOLUS_JVM_HEAP_<MODULE_TYPE> (e.g., CAPREOLUS_JVM_HEAP_SEARCHER=8G) and
+        CAPREOLUS_JVM_HEAP override the heap size, in this order. Otherwise the size is derived from the available
+        memory: indexing and capreolus's own (pyjnius) JVM use up to half of it, while searching uses 1G plus a tenth of
+        the index size, since Anserini reads the index through memory-mapped files that live outside the heap.
+    """
+    for key in [f"CAPREOLUS_JVM_HEAP_{module_type.upper()}", "CAPREOLUS_JVM_HEAP"]:
+        if os.environ.get(key):
+            return parse_size(os.environ[key])
+
+    limit = min(MAX_HEAP, max(MIN_HEAP, available_memory() // 2))
+    if module_type == "searcher" and index_path is not None and os.path.exists(index_path):
+        return min(limit, MIN_HEAP + directory_size(index_path) // 10)
+    return limit
+
+
+def jvm_threads(module_type):
+    """ Number of worker threads a JVM run by `module_type` should use, overridable with CAPREOLUS_JVM_THREADS_<TYPE> """
+    return int(os.environ.get(f"CAPREOLUS_JVM_THREADS_{module_type.upper()}", MAX_THREADS))
+
+
+def heap_options(heap):
+    return [f"-Xms{format_size(min(heap, 512 * 1024 ** 2))}", f"-Xmx{format_size(heap)}"]
+
+
+class MemoryBudget:
+    """ Limits the total heap of the JVM subprocesses started by this process, so that several jobs can run at
+        once without exceeding the machine's memory. A job reserves its heap size before starting and blocks until
+        enough of the budget is free. A job larger than the whole budget runs alone. """
+
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        nbytes = min(nbytes, self.total)
+        with self.condition:
+            self.condition.wait_for(lambda: self.used + nbytes <= self.total)
+            self.used += nbytes
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.used -= nbytes
+                self.condition.notify_all()
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_memory_budget():
+    """ The process-wide MemoryBudget, set by CAPREOLUS_JVM_BUDGET or to 80% of the memory available at first use """
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            budget = os.environ.get("CAPREOLUS_JVM_BUDGET")
+            _budget = MemoryBudget(parse_size(budget) if budget else int(available_memory() * 0.8))
+        return _budget
+
+
+def run_java(args, heap, output_handler=None):
+    """ Run `java <heap options> <args>` once `heap` bytes of the memory budget are free.
+        Each line of output is passed to output_handler. Raises a RuntimeError if the command fails. """
+    cmd = ["java"] + heap_options(heap) + list(args)
+    with get_memory_budget().reserve(heap):
+        logger.debug(" ".join(cmd))
+        app = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+        for line in app.stdout:
+            if output_handler:
+                output_handler(line)
+
+        app.wait()
+        if app.returncode != 0:
+            raise RuntimeError("command failed")
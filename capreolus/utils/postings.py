@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+
+
+class PostingsSnapshot:
+    """ The postings of a set of terms exported from a Lucene index, along with the document lengths and collection
+        statistics needed to reproduce Lucene 8's BM25 and Dirichlet LM scores with numpy.
+
+        The postings of the term in row `i` are `docs[offsets[i]:offsets[i + 1]]` (Lucene ids) and the matching `tfs`.
+        `doclens` holds each document's length as decoded from its (lossy) Lucene norm, which is what Lucene scores with.
+    """
+
+    def __init__(self, terms, offsets, docs, tfs, dfs, ttfs, doclens, docids, doc_count, sum_ttf):
+        self.terms = list(terms)
+        self.term2row = {term: row for row, term in enumerate(self.terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.dfs = dfs
+        self.ttfs = ttfs
+        self.doclens = doclens
+        self.docids = docids
+        self.doc_count = int(doc_count)
+        self.sum_ttf = int(sum_ttf)
+        self.avgdl = self.sum_ttf / self.doc_count
+
+    def query_postings(self, query_terms):
+        """ Return the QueryPostings for a list of analyzed query terms, which may contain repeated terms """
+        weights = {}
+        for term in query_terms:
+            if term in self.term2row:
+                weights[term] = weights.get(term, 0) + 1
+        return QueryPostings(self, weights)
+
+    @staticmethod
+    def save_terms(fn, terms, offsets, docs, tfs, dfs, ttfs):
+        tmp_fn = f"{fn}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_fn, terms=np.array(terms, dtype=str), offsets=offsets, docs=docs, tfs=tfs, dfs=dfs, ttfs=ttfs)
+        os.replace(tmp_fn, fn)
+
+    @staticmethod
+    def save_collection(fn, doclens, docids, doc_count, sum_ttf):
+        tmp_fn = f"{fn}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_fn, doclens=doclens, docids=np.array(docids, dtype=str), stats=np.array([doc_count, sum_ttf]))
+        os.replace(tmp_fn, fn)
+
+    @classmethod
+    def load(cls, terms_fn, collection_fn):
+        with np.load(terms_fn) as term_data, np.load(collection_fn) as collection_data:
+            doc_count, sum_ttf = collection_data["stats"].tolist()
+            return cls(
+                term_data["terms"].tolist(),
+                term_data["offsets"],
+                term_data["docs"],
+                term_data["tfs"],
+                term_data["dfs"],
+                term_data["ttfs"],
+                collection_data["doclens"],
+                collection_data["docids"],
+                doc_count,
+                sum_ttf,
+            )
+
+
+class QueryPostings:
+    """ The postings of one query's terms, gathered once so that scoring with many parameter settings is cheap.
+        Scores are returned for the documents in `self.docs` (sorted Lucene ids) that match at least one query term. """
+
+    def __init__(self, snapshot, weights):
+        self.snapshot = snapshot
+        rows = [snapshot.term2row[term] for term in weights]
+        starts, ends = snapshot.offsets[rows], snapshot.offsets[np.array(rows, dtype=np.int64) + 1]
+
+        posting_rows = np.repeat(np.arange(len(rows)), ends - starts)
+        posting_idx = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)]) if rows else []
+        posting_idx = np.asarray(posting_idx, dtype=np.int64)
+
+        self.docs, self.posting_docs = np.unique(snapshot.docs[posting_idx], return_inverse=True)
+        self.tfs = snapshot.tfs[posting_idx].astype(np.float64)
+        self.doclens = snapshot.doclens[snapshot.docs[posting_idx]].astype(np.float64)
+        self.weights = np.array(list(weights.values()), dtype=np.float64)[posting_rows]
+        self.dfs = snapshot.dfs[rows].astype(np.float64)[posting_rows]
+        self.ttfs = snapshot.ttfs[rows].astype(np.float64)[posting_rows]
+
+    def _sum_by_doc(self, contributions):
+        return np.bincount(self.posting_docs, weights=contributions, minlength=len(self.docs))
+
+    def bm25(self, k1, b):
+        """ Lucene 8 BM25: idf * tf / (tf + k1 * (1 - b + b * dl / avgdl)) summed over the query terms """
+        snapshot = self.snapshot
+        idf = np.log(1 + (snapshot.doc_count - self.dfs + 0.5) / (self.dfs + 0.5))
+        norm = k1 * (1 - b + b * self.doclens / snapshot.avgdl)
+        return self._sum_by_doc(self.weights * idf * self.tfs / (self.tfs + norm))
+
+    def dirichlet(self, mu):
+        """ Lucene 8 LMDirichlet: log(1 + tf / (mu * p(t|C))) + log(mu / (dl + mu)) per term, clipped at 0 """
+        collection_prob = (self.ttfs + 1) / (self.snapshot.sum_ttf + 1)
+        scores = self.weights * (np.log(1 + self.tfs / (mu * collection_prob)) + np.log(mu / (self.doclens + mu)))
+        return self._sum_by_doc(np.maximum(scores, 0))
+
+    def topk(self, scores, k):
+        """ Return an {docid: score} dict with the k highest scores, breaking ties by docid """
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+
+        docids = self.snapshot.docids[self.docs[top]]
+        order = np.lexsort((docids, -scores[top]))
+        return dict(zip(docids[order].tolist(), scores[top][order].tolist()))
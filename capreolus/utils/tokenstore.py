@@ -0,0 +1,208 @@
+import fcntl
+import json
+import os
+import shutil
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class TokenStore:
+    """ Stores token id sequences for a set of documents as one flat int32 array and an offsets table.
+
+        The ids for the document in row `i` are `ids[offsets[i]:offsets[i + 1]]`. A store can be saved to a directory
+        and loaded back with its arrays memory-mapped, so loading is fast and processes reading the same store share it.
+    """
+
+    def __init__(self, docids, offsets, ids):
+        self.docids = list(docids)
+        self.docid2row = {docid: row for row, docid in enumerate(self.docids)}
+        self.offsets = offsets
+        self.ids = ids
+
+    @classmethod
+    def from_sequences(cls, docid_ids_pairs):
+        """ Build a store from an iterable of (docid, token ids) pairs """
+        docids, lengths, chunks = [], [], []
+        for docid, ids in docid_ids_pairs:
+            docids.append(docid)
+            lengths.append(len(ids))
+            chunks.append(np.asarray(ids, dtype=np.int32))
+
+        offsets = np.zeros(len(docids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+        return cls(docids, offsets, ids)
+
+    def __len__(self):
+        return len(self.docids)
+
+    def __contains__(self, docid):
+        return docid in self.docid2row
+
+    def get(self, docid):
+        row = self.docid2row[docid]
+        return self.ids[self.offsets[row] : self.offsets[row + 1]]
+
+    def items(self):
+        for docid in self.docids:
+            yield docid, self.get(docid)
+
+    def merge(self, other):
+        """ Return a new store containing this store's documents followed by any documents in `other` that it lacks """
+        new_docids = [docid for docid in other.docids if docid not in self]
+        return TokenStore.from_sequences(
+            list(self.items()) + [(docid, other.get(docid)) for docid in new_docids]
+        )
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "docids.json"))
+
+    def save(self, path):
+        """ Write the store to the directory `path`, replacing any store already there """
+        path = str(path)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        old_path = f"{path}.old-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+
+        np.save(os.path.join(tmp_path, "ids.npy"), np.asarray(self.ids, dtype=np.int32))
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.asarray(self.offsets, dtype=np.int64))
+        with open(os.path.join(tmp_path, "docids.json"), "wt") as outf:
+            json.dump(self.docids, outf)
+
+        # swap the complete new directory into place so that readers never see a partially written store
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = "r" if mmap else None
+        ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mmap_mode)
+        offsets = np.load(os.path.join(path, "offsets.npy"))
+        with open(os.path.join(path, "docids.json"), "rt") as f:
+            docids = json.load(f)
+
+        return cls(docids, offsets, ids)
+
+
+class SegmentedTokenStore:
+    """ Read-only view of several TokenStores, such as the segments of a TokenCache, as one store.
+
+        A docid present in more than one segment is read from the first segment containing it.
+    """
+
+    def __init__(self, segments=()):
+        self.segments = []
+        self.docid2segment = {}
+        for segment in segments:
+            self.append(segment)
+
+    def append(self, segment):
+        self.segments.append(segment)
+        for docid in segment.docids:
+            self.docid2segment.setdefault(docid, segment)
+
+    def __len__(self):
+        return len(self.docid2segment)
+
+    def __contains__(self, docid):
+        return docid in self.docid2segment
+
+    def get(self, docid):
+        return self.docid2segment[docid].get(docid)
+
+    def items(self):
+        for docid, segment in self.docid2segment.items():
+            yield docid, segment.get(docid)
+
+
+class TokenCache:
+    """ Persistent mapping of docids to token lists, stored as TokenStore segments plus the vocabulary of cached tokens.
+
+        The cache only grows: `add` writes the new documents as a new segment and appends new tokens to the vocabulary,
+        and ids assigned to existing tokens never change. Processes sharing a cache take an exclusive lock on its lock
+        file while reading or extending it, and pick up the segments added by other processes whenever they take the lock.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.vocab_fn = os.path.join(self.path, "vocab.json")
+        self.segments_path = os.path.join(self.path, "segments")
+        self.lock_fn = os.path.join(self.path, "lock")
+
+        self.vocab = []
+        self.tok2id = {}
+        self.store = SegmentedTokenStore()
+        os.makedirs(self.segments_path, exist_ok=True)
+        with self._file_lock():
+            self._reload()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_fn, "a") as lockf:
+            fcntl.flock(lockf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockf, fcntl.LOCK_UN)
+
+    def _segment_names(self):
+        # segments are saved through temporary directories, which are skipped here
+        return sorted(name for name in os.listdir(self.segments_path) if name.isdigit())
+
+    def _reload(self):
+        """ Read the vocab and segments added since the cache was last read. Must be called while holding the file lock. """
+        names = self._segment_names()
+        if len(names) == len(self.store.segments):
+            return
+
+        # the vocab only grows, so it covers every token id used by the segments on disk
+        with open(self.vocab_fn, "rt") as f:
+            self.vocab = json.load(f)
+        self.tok2id = {tok: idx for idx, tok in enumerate(self.vocab)}
+
+        for name in names[len(self.store.segments) :]:
+            self.store.append(TokenStore.load(os.path.join(self.segments_path, name)))
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, docid):
+        return docid in self.store
+
+    def get(self, docid):
+        vocab = self.vocab
+        return [vocab[idx] for idx in self.store.get(docid).tolist()]
+
+    def _encode(self, toks):
+        ids = []
+        for tok in toks:
+            if tok not in self.tok2id:
+                self.tok2id[tok] = len(self.vocab)
+                self.vocab.append(tok)
+            ids.append(self.tok2id[tok])
+        return ids
+
+    def add(self, docid2toks):
+        """ Add the documents in the dict `docid2toks` to the cache and write them to disk as a new segment """
+        with self._file_lock():
+            # another process may have added some of the documents, and extended the vocab, in the meantime
+            self._reload()
+            docid2toks = {docid: toks for docid, toks in docid2toks.items() if docid not in self.store}
+            if not docid2toks:
+                return
+
+            segment = TokenStore.from_sequences((docid, self._encode(toks)) for docid, toks in docid2toks.items())
+
+            # the vocab is written first, so a segment on disk never refers to token ids missing from the vocab on disk
+            tmp_fn = f"{self.vocab_fn}.tmp-{os.getpid()}"
+            with open(tmp_fn, "wt") as outf:
+                json.dump(self.vocab, outf)
+            os.replace(tmp_fn, self.vocab_fn)
+
+            segment_path = os.path.join(self.segments_path, "%06d" % len(self.store.segments))
+            segment.save(segment_path)
+            self.store.append(TokenStore.load(segment_path))
@@ -1,8 +1,12 @@
 import gzip
+import json
 import os
+import shutil
 import xml.etree.ElementTree as ET
 from collections import defaultdict
 
+import numpy as np
+
 
 def load_ntcir_topics(fn):
     topics = {}
@@ -134,3 +138,130 @@ def anserini_index_to_trec_docs(index_dir, output_dir, expected_doc_count):
 
     for handle in output_handles:
         handle.close()
+
+
+class BinaryRun:
+    """ A run stored as arrays: a qid table, a docid dictionary, and each query's docids and float64 scores sorted by
+        decreasing score. The documents of the query in row `i` are stored at `qid_offsets[i]:qid_offsets[i + 1]`. """
+
+    def __init__(self, qids, qid_offsets, docids, docidx, scores):
+        self.qids = qids
+        self.qid_offsets = qid_offsets
+        self.docids = docids
+        self.docidx = docidx
+        self.scores = scores
+        self.qid2row = {qid: row for row, qid in enumerate(qids.tolist())}
+
+    def __len__(self):
+        return len(self.qid2row)
+
+    def __contains__(self, qid):
+        return qid in self.qid2row
+
+    def query(self, qid):
+        """ Return the docids and scores retrieved for qid, in rank order """
+        row = self.qid2row[qid]
+        start, end = self.qid_offsets[row], self.qid_offsets[row + 1]
+        return self.docids[self.docidx[start:end]].tolist(), self.scores[start:end]
+
+    def to_dict(self):
+        """ Convert to the {qid: {docid: score}} format used by Searcher.load_trec_run """
+        docids, docidx, scores = self.docids.tolist(), self.docidx.tolist(), self.scores.tolist()
+        offsets = self.qid_offsets.tolist()
+
+        run = defaultdict(dict)
+        for row, qid in enumerate(self.qids.tolist()):
+            start, end = offsets[row], offsets[row + 1]
+            run[qid] = dict(zip([docids[idx] for idx in docidx[start:end]], scores[start:end]))
+        return run
+
+    @classmethod
+    def from_dict(cls, run):
+        qids = sorted(run)
+        docid_table = {}
+        qid_offsets = np.zeros(len(qids) + 1, dtype=np.int64)
+        docidx, scores = [], []
+        for row, qid in enumerate(qids):
+            ranked = sorted(run[qid].items(), key=lambda x: x[1], reverse=True)
+            docidx.extend(docid_table.setdefault(docid, len(docid_table)) for docid, _ in ranked)
+            scores.extend(score for _, score in ranked)
+            qid_offsets[row + 1] = len(docidx)
+
+        return cls(
+            np.array(qids, dtype=str),
+            qid_offsets,
+            np.array(list(docid_table), dtype=str),
+            np.array(docidx, dtype=np.int32),
+            np.array(scores, dtype=np.float64),
+        )
+
+    def save(self, path, source_stat=None):
+        """ Write the run to the directory `path`. `source_stat` records the text run the binary run was made from. """
+        path = str(path)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        old_path = f"{path}.old-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+
+        for name in ["qids", "qid_offsets", "docids", "docidx", "scores"]:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, "source.json"), "wt") as outf:
+            json.dump(source_stat, outf)
+
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path):
+        arrays = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ["qids", "qid_offsets", "docids"]]
+        arrays += [np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ["docidx", "scores"]]
+        return cls(*arrays)
+
+
+def binary_run_path(runfn):
+    """ The directory where the binary version of the text run `runfn` is cached """
+    return f"{runfn}.bin"
+
+
+# recorded with each binary run, so that binary runs cached in an older format can be rebuilt if the format changes
+BINARY_RUN_VERSION = 1
+
+
+def _stat_run(runfn):
+    stat = os.stat(runfn)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "version": BINARY_RUN_VERSION}
+
+
+def load_binary_run(runfn):
+    """ Load the text run `runfn` as a BinaryRun, converting and caching it first if no up-to-date binary version exists """
+    binfn = binary_run_path(runfn)
+    source_fn = os.path.join(binfn, "source.json")
+    if os.path.exists(source_fn):
+        with open(source_fn, "rt") as f:
+            if json.load(f) == _stat_run(runfn):
+                return BinaryRun.load(binfn)
+
+    return write_binary_run(parse_trec_run(runfn), runfn)
+
+
+def write_binary_run(run, runfn):
+    """ Cache a binary version of the text run `runfn`, whose contents are given by `run` ({qid: {docid: score}}) """
+    binrun = BinaryRun.from_dict(run)
+    try:
+        binrun.save(binary_run_path(runfn), source_stat=_stat_run(runfn))
+    except OSError:
+        # the run's directory may not be writable; the binary version is only a cache
+        pass
+    return binrun
+
+
+def parse_trec_run(runfn):
+    run = defaultdict(dict)
+    with open(runfn, "rt") as f:
+        for line in f:
+            line = line.strip()
+            if len(line) > 0:
+                qid, _, docid, rank, score, desc = line.split(" ")
+                run[qid][docid] = float(score)
+    return run
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+""" Compare the speed of HiNT's spatial GRU computed one anti-diagonal at a time (GRUModel2d.forward) with the
+    original cell-by-cell loop (GRUModel2d._forward_cells), for inputs shaped like HiNT's (B, Q, 100, 3) passages.
+    HiNT runs its GRUs on both similarity matrices of every passage at once, so B is 2 * passages * batch size: the
+    default of 512 corresponds to maxdoclen=800 (8 passages) and batch=32.
+
+    Usage: python scripts/benchmark_spatial_gru.py [--batch B] [--qlen Q] [--runs N] [--device cpu|cuda]
+"""
+
+import argparse
+import time
+
+import torch
+
+from capreolus.reranker.HINT import GRUModel2d
+
+
+def time_forward(forward, x, runs, backward):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = forward(x)
+        if backward:
+            out.sum().backward()
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=512)
+    parser.add_argument("--qlen", type=int, default=4)
+    parser.add_argument("--doclen", type=int, default=100)
+    parser.add_argument("--hidden", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = GRUModel2d(3, args.hidden).to(args.device)
+    x = torch.randn(args.batch, args.qlen, args.doclen, 3, device=args.device, requires_grad=True)
+    assert torch.allclose(model(x), model._forward_cells(x), atol=1e-5)
+
+    for backward in [False, True]:
+        cells = time_forward(model._forward_cells, x, args.runs, backward)
+        wavefront = time_forward(model.forward, x, args.runs, backward)
+        mode = "forward+backward" if backward else "forward"
+        print(f"{mode}: cell loop {cells * 1000:.1f}ms, wavefront {wavefront * 1000:.1f}ms, speedup {cells / wavefront:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+""" Time how long the capreolus CLI takes to start by running a cheap command (rank.describe by default) repeatedly.
+
+    Usage: python scripts/benchmark_startup.py [--runs N] [capreolus args ...]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+def time_command(cmd):
+    start = time.perf_counter()
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("args", nargs="*", default=["rank.describe"])
+    args = parser.parse_args()
+
+    cmd = [sys.executable, "-m", "capreolus.run"] + args.args
+    # the first run also pays for compiling bytecode and warming the OS cache, so it is reported separately
+    first = time_command(cmd)
+    times = [time_command(cmd) for _ in range(args.runs)]
+
+    print(f"{' '.join(args.args)}: first run {first:.2f}s, median {statistics.median(times):.2f}s over {args.runs} runs")
+    print("slowest imports can be listed with: python -X importtime -m capreolus.run " + " ".join(args.args))
+
+
+if __name__ == "__main__":
+    main()
@@ -66,7 +66,7 @@ setuptools.setup(
         "scipy==1.3.0",
     ],
     classifiers=["Programming Language :: Python :: 3", "Operating System :: OS Independent"],
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     cmdclass={"develop": PostDevelopCommand, "install": PostInstallCommand},
     include_package_data=True,
     scripts=["scripts/capreolus"],